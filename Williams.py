@@ -4,239 +4,107 @@ Created on Mon Aug 2 10:38:45 2018
 
 @author: yingw
 """
-import pandas as pd
 import numpy as np
 import os
 import warnings
-import williams_criticals as will
+import cebspy.stats.design as sd
+import cebspy.stats.groupstats as gs
+import cebspy.stats.isotonic as iso
+import cebspy.stats.jonckheere as jt
+import cebspy.stats.profiling as prof
+import cebspy.stats.williamscrit as wcrit
 
 
 
-__all__ = ['Williams']
+__all__ = ['Williams', 'williams_batch']
 
 
-def Williams(x,y,jonck_trend):
-    if (len(x) == len(y)):
-        will005 = will.get_will005_csv()
-        will025 = will.get_will025_csv()
-        willtables = will005.merge(will025, on='dof')
-        results = {'method':"Williams test",
-                   'is_finished':bool(0),
-                   'has_output':bool(0),
-                   'has_errors':bool(0)}
-        x_y_dataframe = pd.DataFrame([x,y]).transpose()
-        x_y_dataframe.columns = ['x','y']
-        
-        ## get william-ized dose means
-        ## direction of smoothing dependent on Jonckheere output
-        wmeans = x_y_dataframe.groupby('x')['y'].agg(['mean','count'])
-        wmeans = wmeans.reset_index(drop=False)
-        wmeans = wmeans.sort_values(['x'])
-        smeans = pd.Series(wmeans['mean']).copy()
-        slength = pd.Series(wmeans['count']).copy()
-        
-        #smeans = smeans[[0,2,1,3]].reset_index(drop=True) #for test purpose
-        smeans.pop(0)   ## remove control group
-        slength.pop(0)  ## remove control group
-        
-        ## set comparison direction based on JONCK trend result
-        direction = 'decreasing' if jonck_trend < 0 else 'increasing'
-        
-        ## need more than 1 trt grp for smoothing
-        if len(smeans) > 1:
-            if direction == 'decreasing':
-                for i in range(1,len(smeans),1):
-                    if smeans[i] < smeans[i+1]:  	## smoothing required  
-                        if i==1:  ## FIRST ITEM
-                            tempSmean = smeans[i]*(slength[i]/(slength[i]+slength[i+1])) + smeans[i+1]*slength[i+1]/(slength[i]+slength[i+1])
-                            smeans[i] = tempSmean
-                            smeans[i+1] = tempSmean
-                        elif i>1: ## NOT FIRST ITEM
-                            tempSmean = smeans[i]*(slength[i]/(slength[i]+slength[i+1])) + smeans[i+1]*slength[i+1]/(slength[i]+slength[i+1])
-                            s_count = 0   ## initialize counter for previous consecutive smoothed means
-                            for j in range(i-1, 0, -1):   	## loop back to find number of elements in smoothing
-                                if tempSmean > smeans[j]:
-                                    s_count = s_count + 1  ## count once for each consecutive previous "smooth"	
-                                    if s_count > 0:
-                                        tempSmean = 0
-                                        for k in range(i-s_count, i, 1): ## recalculate tempSmean
-                                            tempSmean = tempSmean + smeans[k]*slength[k]/sum(slength[i-s_count-1:i])
-                                else:
-                                    break
-                            
-                            denom = 0  	## this is denominator for weighting by sample size
-                            for k in range(i+1, i-s_count-1,-1):  ## get count from previous smoothing
-                                denom = denom + slength[k]
-                            
-                            tempSmean = 0
-                            for k in range(i+1,i-s_count-1,-1): ## go back through and get smoothed mean(s)
-                                tempSmean = tempSmean = smeans[k]*slength[k]/denom
-                                
-                            smeans[i] = tempSmean
-                            smeans[i+1] = tempSmean
-                            if s_count > 0:
-                                for k in range(1,s_count+1,1):
-                                    smeans[i-k] = tempSmean
-            else:  	## DIRECTION BREAK
-                for i in range(1,len(smeans),1):
-                    if smeans[i] > smeans[i+1]:  ## smoothing required
-                        if i==1:  	## FIRST ITEM
-                            tempSmean = smeans[i]*(slength[i]/(slength[i]+slength[i+1])) + smeans[i+1]*slength[i+1]/(slength[i]+slength[i+1])
-                            smeans[i] = tempSmean
-                            smeans[i+1] = tempSmean
-                        elif i>1: 	## NOT FIRST ITEM
-                            tempSmean = smeans[i]*(slength[i]/(slength[i]+slength[i+1])) + smeans[i+1]*slength[i+1]/(slength[i]+slength[i+1])
-                            s_count = 0  ## initialize counter for previous consecutive smoothed means
-                            for j in range(i-1, 0, -1):  ## loop back to find number of elements in smoothing
-                                if tempSmean < smeans[j]:
-                                    s_count = s_count + 1  	## count once for each consecutive previous "smooth"
-                                    if s_count > 0:
-                                        tempSmean = 0
-                                        for k in range(i-s_count, i, 1):  ## recalculate tempSmean
-                                            tempSmean = tempSmean + smeans[k]*slength[k]/sum(slength[i-s_count-1:i])
-                                else:
-                                    break
-                            
-                            denom = 0  	## this is denominator for weighting by sample size
-                            for k in range(i+1, i-s_count-1,-1):  ## get count from previous smoothing
-                                denom = denom + slength[k]
-                            
-                            tempSmean = 0
-                            for k in range(i+1,i-s_count-1,-1):  ## go back through and get smoothed mean(s)
-                                tempSmean = tempSmean + smeans[k]*slength[k]/denom
-                                
-                            smeans[i] = tempSmean
-                            smeans[i+1] = tempSmean
-                            if s_count > 0:
-                                for k in range(1,s_count+1,1):
-                                    smeans[i-k] = tempSmean
-                                    
-        smeans = pd.concat([pd.Series(wmeans['mean'].iloc[0]),smeans]) ## pre-pend control mean to beginning of smoothed means
-        wmeans['smeans'] = smeans  	## combine with means info
-        
-        		## get DOF for each sex/phase_type combination
+def _williams_tests(groups, jonck_trend):
+    """
+    Williams test output from the dose group statistics
+
+    groups is a DoseGroupStats with the control first, jonck_trend the
+    trend statistic whose sign sets the direction of the smoothing.
+    """
+    ## get william-ized dose means
+    ## direction of smoothing dependent on Jonckheere output
+    doses = groups.doses
+    counts = groups.count
+    means = groups.mean
+    
+    ## set comparison direction based on JONCK trend result
+    direction = 'decreasing' if jonck_trend < 0 else 'increasing'
+    
+    ## pool adjacent violators among the treatment groups, control is kept
+    smeans = np.array(means, dtype=float)
+    with prof.stage('williams', 'smoothing', len(smeans) - 1):
+        smeans[1:] = iso.pava(smeans[1:], counts[1:],
+                              increasing=(direction == 'increasing'))
+    
+    		## get DOF for each sex/phase_type combination
 			                           
 		##	dof1 <- nrow(subset(will_data, sex==william$sex[w] & endpoint==william$endpoint[w] & selection==william$selection[w] & litter_name==william$litter_name[w] & phase_type==william$phase_type[w] & phase_time==william$phase_time[w] & time_in_study==william$time_in_study[w]))
 		##	dof2 <- length(unique(subset(will_data, sex==william$sex[w] & endpoint==william$endpoint[w] & selection==william$selection[w] & litter_name==william$litter_name[w] & phase_type==william$phase_type[w] & phase_time==william$phase_time[w] & time_in_study==william$time_in_study[w])$dose))
 		
 			## simplify dof calcs ... if errors try old method above
-        dof1 = sum(wmeans['count'])
-        dof2 = wmeans.shape[0]
-        wmeans['dof'] = dof1-dof2
-        
-        se = x_y_dataframe.groupby('x')['y'].agg(['std','count'])
-        se['sterr'] = se['std']/(se['count']**(0.5))
-        se = se.reset_index(drop=False)
-        
-        mse = 0
-        for i in range(se.shape[0]):
-            temp = (se['sterr'].iloc[i]**2) * (x_y_dataframe[x_y_dataframe['x']==se['x'].iloc[i]].shape[0]) * (x_y_dataframe[x_y_dataframe['x']==se['x'].iloc[i]].shape[0]-1)
-            mse = mse + temp
-            
-        mse = mse/(x_y_dataframe.shape[0] - len(np.unique(x_y_dataframe['x'])))
-        
-        ## create WILLIAMS TEST STATISTIC
-        willStat = pd.Series()
-        for i in range(1,wmeans.shape[0],1):
-            control_num = wmeans['count'].iloc[0]
-            control_mean = wmeans['smeans'].iloc[0]
-            test_num = wmeans['count'].iloc[i]
-            test_mean = wmeans['smeans'].iloc[i]
-            
-            willstat = (control_mean - test_mean) / ((mse*((1/test_num) + (1/control_num)))**0.5)
-            willStat = willStat.append(pd.Series(willstat))
-        
-        willStat = willStat.tolist() 
-        willStat.insert(0,'control')
-        wmeans['willStat'] = willStat
-        
-        
-        	## ----------------------------------------------------------------------
+    dof = groups.dof
+    
+    with prof.stage('williams', 'mse', groups.n_total):
+        mse = groups.pooled_variance()
+    
+    ## create WILLIAMS TEST STATISTIC
+    control_num = counts[0]
+    control_mean = smeans[0]
+    willStat = np.r_[np.nan,    ## control has no statistic
+                     (control_mean - smeans[1:]) / ((mse*((1/counts[1:]) + (1/control_num)))**0.5)]
+    
+    
+    	## ----------------------------------------------------------------------
 		## convert williams statistic into p-value based on SAS crit levels
-		## read in critical tables
+		## critical tables are indexed once per process by williamscrit
 		## ----------------------------------------------------------------------
 
 		## if DOF matches with the crit tables, we can make a simple comparison, if not we extrapolate
-        for k in range(wmeans.shape[0]):
-            ## CONTROL GROUP
-            if wmeans['x'].iloc[k] == 0:
-                crit05 = 0
-                crit01 = 0
-                temp = pd.Series([crit05, crit01])
-                
-            ## NOT CONTROL AND DOF PRESENT IN TABLE
-            elif wmeans['x'].iloc[k] != 0 and (wmeans['dof'].iloc[k] in willtables['dof']):
-                col1 = 'w1crit' + str(k+1)
-                col5 = 'w5crit' + str(k+1)
-                adj1 = 'w1adj' + str(k+1)
-                adj5 = 'w5adj' + str(k+1)
-                
-                w1crit = willtables[willtables['dof']==wmeans['dof'].iloc[k]][col1]
-                w1adj = willtables[willtables['dof']==wmeans['dof'].iloc[k]][adj1]
-                w5crit = willtables[willtables['dof']==wmeans['dof'].iloc[k]][col5]
-                w5adj = willtables[willtables['dof']==wmeans['dof'].iloc[k]][adj5]
-                
-                con_num = wmeans[wmeans.x==0]['count'].iloc[0]
-                trt_num = wmeans['count'].iloc[k]
-                
-                crit01 = w1crit - (.1 * w1adj * (1 - (trt_num / con_num)))
-                crit05 = w5crit - (.1 * w5adj * (1 - (trt_num / con_num)))
-                
-                temp = pd.Series([crit05, crit01])
-                
-            	## NOT CONTROL AND DOF NOT PRESENT IN TABLE
-            elif wmeans['x'].iloc[k] != 0 and not np.isin(wmeans['dof'].iloc[k],willtables['dof']).tolist():
-                col1 = 'w1crit' + str(k+1)
-                col5 = 'w5crit' + str(k+1)
-                adj1 = 'w1adj' + str(k+1)
-                adj5 = 'w5adj' + str(k+1)
-                
-                ## get lower bound from table
-                lowdof = max(willtables[wmeans['dof'].iloc[k] > willtables['dof']]['dof'])
-                
-                low_w1crit = willtables[willtables['dof']==lowdof][col1].iloc[0]
-                low_w1adj = willtables[willtables['dof']==lowdof][adj1].iloc[0]
-                low_w5crit = willtables[willtables['dof']==lowdof][col5].iloc[0]
-                low_w5adj = willtables[willtables['dof']==lowdof][adj5].iloc[0]
-                
-                	## get upper bound from table
-                highdof = min(willtables[wmeans['dof'].iloc[k] < willtables['dof']]['dof'])
-                
-                high_w1crit = willtables[willtables['dof']==highdof][col1].iloc[0]
-                high_w1adj = willtables[willtables['dof']==highdof][adj1].iloc[0]
-                high_w5crit = willtables[willtables['dof']==highdof][col5].iloc[0]
-                high_w5adj = willtables[willtables['dof']==highdof][adj5].iloc[0]
-                
-                dofactor = (wmeans.dof[k] - lowdof) / (highdof - lowdof)
-                con_num = wmeans[wmeans.x==0]['count'].iloc[0]
-                trt_num = wmeans['count'].iloc[k]
-                
-                crit01 = (low_w1crit - (dofactor * (low_w1crit - high_w1crit))) - (.01 * low_w1adj * (1 - (trt_num / con_num)))
-                crit05 = (low_w5crit - (dofactor * (low_w5crit - high_w5crit))) - (.01 * low_w5adj * (1 - (trt_num / con_num)))
-                
-            will_results = wmeans.copy()
-            will_results['crit01'] = crit01
-            will_results['crit05'] = crit05
-            
-            ## remove control
-            will_results = will_results[will_results.willStat != 'control']
-            will_results =  will_results.reset_index()
-            
-            ## determine how many asterisks each row deserves
-            for r in range(will_results.shape[0]):
-                if will_results['willStat'].iloc[r] >= will_results['crit01'].iloc[r]:
-                    will_results.loc[r,'mult_comp_signif'] = 2
-                elif will_results['willStat'].iloc[r] >= will_results['crit05'].iloc[r]:
-                    will_results.loc[r,'mult_comp_signif'] = 1
-                else:
-                    will_results.loc[r,'mult_comp_signif'] = 0
-        tests = {'is_finished':bool(1),
-                   'has_output':bool(1),
-                   'output':{'x':will_results['x'].tolist(),
-                             'means':will_results['mean'].tolist(),
-                             'counts':will_results['count'].tolist(),
-                             'willStats':will_results['willStat'].tolist(),
-                             'mult_comp_signif':will_results['mult_comp_signif'].tolist()}}
+    ## plain arrays, no DataFrame: the treatment rows are the non-zero doses
+    treated = np.flatnonzero(doses != 0)
+    con_num = counts[doses == 0][0]
+    with prof.stage('williams', 'critical_tables'):
+        criticals = wcrit.get_williams_criticals()
+    with prof.stage('williams', 'critical_lookup', len(treated)):
+        crit01, crit05 = criticals.lookup(np.full(len(treated), dof), treated + 1,
+                                          counts[treated] / con_num)
+
+    ## determine how many asterisks each row deserves
+    will_stats = willStat[treated]
+    mult_comp_signif = np.where(will_stats >= crit01, 2,
+                                np.where(will_stats >= crit05, 1, 0))
+    return {'is_finished':bool(1),
+            'has_output':bool(1),
+            'output':{'x':doses[treated].tolist(),
+                      'means':means[treated].tolist(),
+                      'counts':counts[treated].tolist(),
+                      'willStats':will_stats.tolist(),
+                      'crit05':crit05.tolist(),
+                      'crit01':crit01.tolist(),
+                      'mult_comp_signif':mult_comp_signif.tolist()}}
+
+
+def Williams(x,y,jonck_trend=None):
+    if (len(x) == len(y)):
+        results = {'method':"Williams test",
+                   'is_finished':bool(0),
+                   'has_output':bool(0),
+                   'has_errors':bool(0)}
+        with prof.stage('williams', 'complete_cases', len(y)):
+            design, y = sd.complete_cases(x, y)   ## x may be a StudyDesign shared by endpoints
+        if jonck_trend is None:
+            ## no trend given, run the Jonckheere-Terpstra test here
+            with prof.stage('williams', 'trend', len(y)):
+                trend = jt.jonckheere_test(design, y)
+            jonck_trend = trend['output']['z'] if trend['has_output'] else 0
+        with prof.stage('williams', 'group_stats', len(y)):
+            groups = gs.DoseGroupStats.from_arrays(design, y)
+        tests = _williams_tests(groups, jonck_trend)
         results.update(tests)
        
             
@@ -245,11 +113,125 @@ def Williams(x,y,jonck_trend):
         results.update({'has_errors':bool(1),
                             'warnings':[warn_message]})
     return results
-            
-        
-    
-  
-    
-    
-    
-  
\ No newline at end of file
+
+
+def williams_batch(df, group_keys, dose_col, response_col, trend_col):
+    """
+    Williams test for many endpoint groups in one call
+
+    Runs the Williams test for every endpoint group of a long-format table
+    (e.g. sex/endpoint/selection/litter_name/phase_type/phase_time/
+    time_in_study) with grouped NumPy operations instead of one `Williams`
+    call per group.
+
+    Parameters
+    ----------
+    df : a pandas DataFrame with one row per animal and endpoint
+
+    group_keys : a list of column names identifying an endpoint group
+
+    dose_col : column name of the doses, the control group is dose 0
+
+    response_col : column name of the responses
+
+    trend_col : column name of the Jonckheere trend statistic, only its sign
+        is used (negative for a decreasing trend)
+
+    Returns
+    -------
+    A DataFrame with one row per endpoint group and treatment dose holding
+    the group keys, the dose, 'mean', 'count', Williams-ized 'smean', 'dof',
+    'mse', 'willStat', 'crit05', 'crit01' and 'mult_comp_signif'.
+    Groups without a control, with a single dose group or with a missing
+    trend are skipped with a warning; an empty df gives an empty table.
+
+    Examples
+    --------
+    >>> from cebspy.stats.Williams import williams_batch
+    >>> results = williams_batch(data, ['sex', 'endpoint'], 'dose',
+    ...                          'response', 'jonck_trend')
+    """
+    keys = list(group_keys)
+    data = df[keys + [dose_col, response_col, trend_col]]
+    data = data.dropna(subset=[dose_col, response_col])
+    if data.empty:
+        will_results = data[keys + [dose_col]].reset_index(drop=True)
+        for column in ('mean', 'count', 'smean', 'dof', 'mse', 'willStat',
+                       'crit05', 'crit01', 'mult_comp_signif'):
+            will_results[column] = np.array([])
+        return will_results
+    data = data.sort_values(keys + [dose_col], kind='mergesort')
+    endpoint = data.groupby(keys, sort=False).ngroup().to_numpy()
+    doses = data[dose_col].to_numpy(dtype=float)
+    y = data[response_col].to_numpy(dtype=float)
+    trend = data[trend_col].to_numpy(dtype=float)
+
+    ## one cell per endpoint and dose in the sorted table
+    starts = np.flatnonzero(np.r_[True, (endpoint[1:] != endpoint[:-1]) |
+                                        (doses[1:] != doses[:-1])])
+    counts = np.diff(np.r_[starts, len(y)])
+    means = np.add.reduceat(y, starts) / counts
+    dev = y - np.repeat(means, counts)
+    m2 = np.add.reduceat(dev * dev, starts)
+    cell_endpoint = endpoint[starts]
+    cell_dose = doses[starts]
+
+    ## endpoint level: dof, MSE, control group
+    ep_starts = np.flatnonzero(np.r_[True, cell_endpoint[1:] != cell_endpoint[:-1]])
+    ep_doses = np.diff(np.r_[ep_starts, len(starts)])
+    ep_total = np.add.reduceat(counts, ep_starts)
+    ep_dof = ep_total - ep_doses
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ep_mse = np.add.reduceat(m2, ep_starts) / ep_dof
+    valid = (cell_dose[ep_starts] == 0) & (ep_doses > 1) & (ep_dof > 0)
+    if not valid.all():
+        warnings.warn('%d endpoint groups skipped: control group missing or '
+                      'no enough treatment groups' % np.count_nonzero(~valid))
+    ## a missing trend would be smoothed as decreasing, skip the endpoint
+    no_trend = np.logical_or.reduceat(np.isnan(trend), starts[ep_starts])
+    if (valid & no_trend).any():
+        warnings.warn('%d endpoint groups skipped: trend missing'
+                      % np.count_nonzero(valid & no_trend))
+        valid &= ~no_trend
+
+    ## get william-ized dose means, direction dependent on Jonckheere output
+    ## treatment cells of the valid endpoints
+    cell_ep_index = np.repeat(np.arange(len(ep_starts)), ep_doses)
+    position = np.arange(len(starts)) - np.repeat(ep_starts, ep_doses)
+    trt = valid[cell_ep_index] & (position > 0)
+
+    ## treatment means padded to one row per endpoint and smoothed together
+    padded = np.zeros((len(ep_starts), max(ep_doses.max() - 1, 1)))
+    weights = np.zeros(padded.shape)
+    padded[cell_ep_index[trt], position[trt] - 1] = means[trt]
+    weights[cell_ep_index[trt], position[trt] - 1] = counts[trt]
+    ep_trend = trend[starts[ep_starts]]
+    smeans = means.copy()
+    smeans[trt] = iso.pava(padded, weights, increasing=ep_trend >= 0)[
+            cell_ep_index[trt], position[trt] - 1]
+    control = np.repeat(ep_starts, ep_doses)[trt]
+    trt_num = counts[trt]
+    con_num = counts[control]
+    dof = ep_dof[cell_ep_index][trt]
+    mse = ep_mse[cell_ep_index][trt]
+    will_stat = ((smeans[control] - smeans[trt]) /
+                 np.sqrt(mse * ((1 / trt_num) + (1 / con_num))))
+
+    ## convert williams statistic into significance based on SAS crit levels
+    with prof.stage('williams_batch', 'critical_lookup', len(dof)):
+        crit01, crit05 = wcrit.get_williams_criticals().lookup(
+                dof, position[trt] + 1, trt_num / con_num)
+    signif = np.where(will_stat >= crit01, 2, np.where(will_stat >= crit05, 1, 0))
+
+    will_results = data[keys].iloc[starts[trt]].reset_index(drop=True)
+    will_results[dose_col] = cell_dose[trt]
+    will_results['mean'] = means[trt]
+    will_results['count'] = trt_num
+    will_results['smean'] = smeans[trt]
+    will_results['dof'] = dof
+    will_results['mse'] = mse
+    will_results['willStat'] = will_stat
+    will_results['crit05'] = crit05
+    will_results['crit01'] = crit01
+    will_results['mult_comp_signif'] = signif
+    return will_results
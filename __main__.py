@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+# __main__.py
+"""
+python -m cebspy.stats, see cebspy.stats.cli
+"""
+from cebspy.stats.cli import main
+
+if __name__ == '__main__':
+    raise SystemExit(main())
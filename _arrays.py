@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# _arrays.py
+"""
+Input conversion helpers for the CEBS tests
+
+NumPy arrays, pandas Series (NumPy or Arrow backed) and Arrow arrays are
+turned into float64 NumPy arrays without copying whenever the data is
+already contiguous float64; missing values are handled with masks.
+"""
+import numpy as np
+
+
+def _from_arrow(values):
+    """
+    Float64 NumPy view of an Arrow array or chunked array when possible
+    """
+    if hasattr(values, 'num_chunks'):
+        if values.num_chunks == 1:
+            values = values.chunk(0)
+        else:
+            return np.asarray(values.to_numpy(), dtype=float)
+    if values.null_count == 0 and str(values.type) == 'double':
+        return values.to_numpy(zero_copy_only=True)
+    # nulls (or another type) need a copy with NaN for the missing values
+    return np.asarray(values.to_numpy(zero_copy_only=False), dtype=float)
+
+
+def as_float_array(values):
+    """
+    Return values as a contiguous 1-D float64 array, copying only if needed
+
+    Parameters
+    ----------
+    values : a NumPy array, pandas Series, Arrow array or a list of numbers
+
+    Returns
+    -------
+    A float64 NumPy array; missing values (None, pd.NA, Arrow nulls) are NaN
+    """
+    if isinstance(values, np.ndarray):
+        return np.ascontiguousarray(values, dtype=float)
+    if getattr(getattr(values, 'dtype', None), 'pyarrow_dtype', None) is not None:
+        return _from_arrow(values.array.__arrow_array__())   # Arrow backed Series
+    if hasattr(values, 'null_count') and hasattr(values, 'to_numpy'):
+        return _from_arrow(values)             # pyarrow Array / ChunkedArray
+    if getattr(values, 'dtype', None) == np.float64:
+        return np.ascontiguousarray(values.to_numpy())   # view of a float64 Series
+    if hasattr(values, 'to_numpy'):
+        return np.ascontiguousarray(values.to_numpy(dtype=float, na_value=np.nan))
+    return np.asarray(values, dtype=float)
+
+
+def valid_values(values):
+    """
+    Float64 array of the non-missing values
+
+    The data is masked, not rebuilt element by element; no copy is made when
+    nothing is missing.
+    """
+    values = as_float_array(values)
+    missing = np.isnan(values)
+    if missing.any():
+        return values[~missing]
+    return values
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# _distributions.py
+"""
+Normal and Student t distribution functions for the CEBS tests
+
+The few functions the tests need are the scipy.special ufuncs behind
+scipy.stats.norm and scipy.stats.t (with identical values). scipy.special
+is imported on first use, so importing a test module does not load
+scipy.stats.
+"""
+
+_special = None
+
+
+def _scipy_special():
+    global _special
+    if _special is None:
+        import scipy.special
+        _special = scipy.special
+    return _special
+
+
+def norm_ppf(p):
+    """
+    Quantile of the standard normal distribution, as scipy.stats.norm.ppf
+    """
+    return _scipy_special().ndtri(p)
+
+
+def norm_sf(z):
+    """
+    Upper tail of the standard normal distribution, as scipy.stats.norm.sf
+    """
+    return _scipy_special().ndtr(-z)
+
+
+def t_sf(t, df):
+    """
+    Upper tail of Student's t distribution, as scipy.stats.t.sf
+    """
+    return _scipy_special().stdtr(df, -t)
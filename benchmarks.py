@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+# benchmarks.py
+"""
+Benchmark suite for the CEBS tests
+
+Synthetic dose-response endpoints are generated over the sample size, the
+number of dose groups and the tie density, and Williams, shirley_test,
+dunn_test, dixon, t_test and sample_stats are timed on each of them. Wall
+time, tracemalloc peak memory and a digest of the results are recorded and
+compared with a stored baseline, so a rewrite can be shown to be faster and
+to give identical results.
+
+The reference run is committed next to this module as
+benchmarks_baseline.json (BASELINE) and compared with by default. It holds
+the BASELINE_TESTS over the default grid; Williams and dixon are left out
+as their results depend on the installed williams_criticals and qdixon
+tables. Its timings come from the machine that recorded it, so speed-ups
+are only meaningful against a baseline saved on the same machine:
+
+    python -m cebspy.stats.benchmarks                  # against BASELINE
+    python -m cebspy.stats.benchmarks --save local.json
+    python -m cebspy.stats.benchmarks --baseline local.json
+
+After a change meant to alter results, record the new reference with
+--tests <BASELINE_TESTS> --save <path of BASELINE> and commit it.
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import time
+import tracemalloc
+import warnings
+
+import numpy as np
+
+from cebspy.stats.dixon import dixon
+from cebspy.stats.dunntest import dunn_test
+from cebspy.stats.samplestats import sample_stats
+from cebspy.stats.shirleytest import shirley_test
+from cebspy.stats.ttest import t_test
+from cebspy.stats.Williams import Williams
+
+__all__ = ['SIZES', 'GROUPS', 'TIES', 'BENCHMARKS', 'BASELINE', 'BASELINE_TESTS',
+           'make_endpoint', 'run_benchmarks', 'compare', 'load_baseline',
+           'save_baseline']
+
+SIZES = (10, 100, 1000, 10000, 100000)
+GROUPS = (2, 4, 8)
+## fraction of the animals sharing a response value with another animal
+TIES = {'low':0.0, 'medium':0.5, 'high':0.95}
+
+
+def make_endpoint(n, n_groups, ties='low', effect=0.5, seed=0):
+    """
+    Synthetic endpoint of n animals in n_groups dose groups
+
+    Parameters
+    ----------
+    n : number of animals, at least 2 per dose group
+
+    n_groups : number of dose groups including the control (dose 0)
+
+    ties : 'low', 'medium' or 'high' tie density (see TIES)
+
+    effect : shift of the mean response per dose step, in standard deviations
+
+    seed : seed of the random generator
+
+    Returns
+    -------
+    (doses, responses) as float64 arrays
+    """
+    rng = np.random.default_rng(seed)
+    levels = np.r_[0.0, 10.0 * 3.0 ** np.arange(n_groups - 1)]
+    steps = np.arange(n) % n_groups
+    doses = levels[steps]
+    responses = 10.0 + effect * steps + rng.standard_normal(n)
+    distinct = max(2, int(round(n * (1.0 - TIES[ties]))))
+    if distinct < n:
+        # round to a grid of about `distinct` values over the observed range
+        low, high = responses.min(), responses.max()
+        width = (high - low) / (distinct - 1)
+        responses = low + np.round((responses - low) / width) * width
+    return doses, responses
+
+
+def _dixon_groups(doses, responses):
+    return [dixon(responses[doses == dose][:30]) for dose in np.unique(doses)]
+
+
+def _t_test_top(doses, responses):
+    return t_test(responses[doses == 0], responses[doses == doses.max()])
+
+
+## benchmark name -> callable of (doses, responses)
+BENCHMARKS = {'Williams':Williams,
+              'shirley_test':shirley_test,
+              'dunn_test':dunn_test,
+              'dixon':_dixon_groups,
+              't_test':_t_test_top,
+              'sample_stats':lambda doses, responses: sample_stats(responses)}
+
+
+## committed reference run and its tests, whose results do not depend on
+## the installed critical-value tables
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'benchmarks_baseline.json')
+BASELINE_TESTS = ('shirley_test', 'dunn_test', 't_test', 'sample_stats')
+
+
+def _canonical(value):
+    """
+    Results as plain JSON types, floats rounded to 10 significant digits
+    """
+    if isinstance(value, dict):
+        return {str(k):_canonical(v) for k, v in sorted(value.items(), key=lambda kv: str(kv[0]))}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [_canonical(v) for v in value]
+    if isinstance(value, (bool, np.bool_)) or value is None:
+        return None if value is None else bool(value)
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        value = float(value)
+        if math.isnan(value) or math.isinf(value):
+            return str(value)
+        return float('%.10g' % value)
+    return str(value)
+
+
+def result_digest(results):
+    """
+    Short hash of a results dict, equal for identical results
+    """
+    text = json.dumps(_canonical(results), sort_keys=True)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+def _time(func, doses, responses, repeat):
+    best = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = func(doses, responses)
+        best = min(best, time.perf_counter() - start)
+    return best, results
+
+
+def _peak_memory(func, doses, responses):
+    tracemalloc.start()
+    try:
+        func(doses, responses)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_benchmarks(sizes=SIZES, groups=GROUPS, ties=tuple(TIES), tests=tuple(BENCHMARKS),
+                   repeat=3, seed=0, verbose=False):
+    """
+    Time every test over the grid of sizes, dose group counts and tie densities
+
+    Parameters
+    ----------
+    sizes, groups, ties : the grid of synthetic endpoints (see make_endpoint)
+
+    tests : names of the tests from BENCHMARKS
+
+    repeat : number of timed runs, the best one is kept
+
+    seed : seed of the endpoint generator
+
+    verbose : a logical, print each case as it is run
+
+    Returns
+    -------
+    A list of dicts with 'test', 'n', 'groups', 'ties', 'seconds',
+    'peak_bytes' and 'digest'; a test raising an error has NaN seconds and
+    'error: <exception name>' as digest
+    """
+    records = []
+    for n in sizes:
+        for n_groups in groups:
+            if n < 2 * n_groups:
+                continue
+            for tie in ties:
+                doses, responses = make_endpoint(n, n_groups, tie, seed=seed)
+                for name in tests:
+                    func = BENCHMARKS[name]
+                    with warnings.catch_warnings():
+                        warnings.simplefilter('ignore')
+                        try:
+                            seconds, results = _time(func, doses, responses, repeat)
+                            peak = _peak_memory(func, doses, responses)
+                            digest = result_digest(results)
+                        except Exception as e:   # e.g. constant groups in a t-test
+                            seconds, peak, digest = math.nan, 0, 'error: %s' % type(e).__name__
+                    record = {'test':name, 'n':n, 'groups':n_groups, 'ties':tie,
+                              'seconds':seconds, 'peak_bytes':peak, 'digest':digest}
+                    records.append(record)
+                    if verbose:
+                        print(_format(record))
+    return records
+
+
+def _key(record):
+    return (record['test'], record['n'], record['groups'], record['ties'])
+
+
+def _format(record, base=None):
+    line = '%-13s n=%-7d k=%d ties=%-6s %10.3f ms %10.1f KiB' % (
+        record['test'], record['n'], record['groups'], record['ties'],
+        1000 * record['seconds'], record['peak_bytes'] / 1024.0)
+    if record['digest'].startswith('error'):
+        line += '  ' + record['digest']
+    if base is not None:
+        line += '  x%.2f speed-up  %s' % (
+            base['seconds'] / max(record['seconds'], 1e-12),
+            'same results' if base['digest'] == record['digest'] else 'RESULTS DIFFER')
+    return line
+
+
+def compare(records, baseline):
+    """
+    Compare benchmark records with baseline records
+
+    Returns
+    -------
+    A list of dicts with 'test', 'n', 'groups', 'ties', 'speedup' (baseline
+    time over current time), 'memory_ratio' (current peak over baseline peak)
+    and 'identical' (a logical, equal result digests); cases missing from
+    the baseline are skipped
+    """
+    base = {_key(record):record for record in baseline}
+    rows = []
+    for record in records:
+        old = base.get(_key(record))
+        if old is None:
+            continue
+        rows.append({'test':record['test'], 'n':record['n'],
+                     'groups':record['groups'], 'ties':record['ties'],
+                     'speedup':old['seconds'] / max(record['seconds'], 1e-12),
+                     'memory_ratio':record['peak_bytes'] / max(old['peak_bytes'], 1),
+                     'identical':old['digest'] == record['digest']})
+    return rows
+
+
+def save_baseline(records, path):
+    with open(path, 'w') as f:
+        json.dump(records, f, indent=1)
+
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the CEBS tests')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES))
+    parser.add_argument('--groups', type=int, nargs='+', default=list(GROUPS))
+    parser.add_argument('--ties', nargs='+', choices=list(TIES), default=list(TIES))
+    parser.add_argument('--tests', nargs='+', choices=list(BENCHMARKS),
+                        default=list(BENCHMARKS))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', default=BASELINE,
+                        help='JSON baseline to compare with (default: the '
+                             'committed benchmarks_baseline.json)')
+    parser.add_argument('--save', help='write the records as a JSON baseline')
+    args = parser.parse_args(argv)
+
+    records = run_benchmarks(args.sizes, args.groups, args.ties, args.tests,
+                             repeat=args.repeat)
+    base = {}
+    if args.baseline:
+        base = {_key(record):record for record in load_baseline(args.baseline)}
+    for record in records:
+        print(_format(record, base.get(_key(record))))
+    if args.save:
+        save_baseline(records, args.save)
+    differ = [record for record in records if _key(record) in base
+              and base[_key(record)]['digest'] != record['digest']]
+    return 1 if differ else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+# cache.py
+"""
+Content-addressed cache of test results
+
+Results are keyed by a hash of the dose and response arrays, the test
+parameters and the method version, so reprocessing a study only computes
+the endpoints whose data changed. An in-memory LRU tier is backed by an
+optional SQLite file shared by processes and runs, both evicted by the
+size of the pickled results.
+
+The results are stored pickled, and unpickling runs code chosen by whoever
+wrote the file: the SQLite file must only be writable by trusted users,
+like the study data it caches.
+"""
+import hashlib
+import pickle
+import sqlite3
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import cebspy.stats._arrays as arr
+import cebspy.stats.design as sd
+
+__all__ = ['COMPONENTS', 'USED_BATCH', 'VERSIONS', 'ResultCache', 'endpoint_key', 'method_version']
+
+## method versions, bump one when the results of the method change
+VERSIONS = {'Williams':2,
+            'shirley_test':2,
+            'dunn_test':1,
+            'jonckheere_test':1,
+            'analyze_endpoint':1}
+
+## disk hits whose last use is written back at once
+USED_BATCH = 256
+
+## methods running other tests, their keys change with the versions of these
+COMPONENTS = {'analyze_endpoint':('jonckheere_test', 'Williams', 'shirley_test',
+                                  'dunn_test')}
+
+
+def _method_name(func):
+    return getattr(func, '__name__', str(func))
+
+
+def method_version(method):
+    """
+    Version of a method name as used in the keys, with the versions of its
+    COMPONENTS for the methods running other tests
+    """
+    version = VERSIONS.get(method, 0)
+    if method not in COMPONENTS:
+        return version
+    return '%s(%s)' % (version, ','.join('%s=%s' % (name, method_version(name))
+                                         for name in COMPONENTS[method]))
+
+
+def endpoint_key(method, doses, responses, params=None, version=None):
+    """
+    Hex key of a test run on an endpoint
+
+    Parameters
+    ----------
+    method : a test function or its name
+
+    doses : a list or array of doses, or a StudyDesign
+
+    responses : a list or array of responses
+
+    params : a dict of the other arguments of the test, optional
+
+    version : the method version, method_version(method) by default
+    """
+    if not isinstance(method, str):
+        method = _method_name(method)
+    if version is None:
+        version = method_version(method)
+    if isinstance(doses, sd.StudyDesign):
+        doses = doses.doses
+    dtype = getattr(doses, 'dtype', None)
+    if dtype is None:
+        dtype = np.asarray(doses).dtype
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(('%s:%s:%r' % (method, version, sorted((params or {}).items()))).encode())
+    # the outputs repeat the doses, int and float doses are different keys
+    digest.update(dtype.kind.encode())
+    for values in (doses, responses):
+        values = arr.as_float_array(values)
+        digest.update(np.int64(len(values)).tobytes())
+        digest.update(values.tobytes())
+    return digest.hexdigest()
+
+
+class ResultCache(object):
+    """
+    LRU cache of results with an optional SQLite tier
+
+    Parameters
+    ----------
+    memory_bytes : size limit of the pickled results kept in memory, the
+        least recently used ones are evicted beyond it
+
+    path : path of a SQLite file for the on-disk tier, optional; it must
+        only be writable by trusted users as the results are unpickled
+
+    max_bytes : size limit of the pickled results on disk, the least
+        recently used ones are evicted beyond it; None for no limit
+
+    The last use of the disk hits is written back in batches of USED_BATCH,
+    with the next put and on close, so reads do not wait for the SQLite
+    write lock.
+
+    Examples
+    --------
+    >>> from cebspy.stats.cache import ResultCache
+    >>> from cebspy.stats.dunntest import dunn_test
+    >>> cache = ResultCache(path='results.sqlite', max_bytes=2**30)
+    >>> results = cache.call(dunn_test, doses, responses)   # computed
+    >>> results = cache.call(dunn_test, doses, responses)   # from the cache
+    """
+    def __init__(self, memory_bytes=2**26, path=None, max_bytes=None):
+        self.memory_bytes = memory_bytes
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._used = {}
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(str(path), timeout=60)
+            self._db.execute('CREATE TABLE IF NOT EXISTS results ('
+                             'key TEXT PRIMARY KEY, value BLOB, size INTEGER, used REAL)')
+            self._db.commit()
+
+    def __len__(self):
+        return len(self._memory)
+
+    def _remember(self, key, blob):
+        if len(blob) > self.memory_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_size -= len(old)
+        self._memory[key] = blob
+        self._memory_size += len(blob)
+        while self._memory_size > self.memory_bytes:
+            self._memory_size -= len(self._memory.popitem(last=False)[1])
+
+    def _write_used(self):
+        """
+        Write back the last use of the disk hits, committed by the caller
+        """
+        if self._used:
+            self._db.executemany('UPDATE results SET used = ? WHERE key = ?',
+                                 [(used, key) for key, used in self._used.items()])
+            self._used.clear()
+
+    def get(self, key, default=None):
+        """
+        Cached result of key, or default
+        """
+        blob = self._memory.get(key)
+        if blob is not None:
+            self._memory.move_to_end(key)
+        elif self._db is not None:
+            row = self._db.execute('SELECT value FROM results WHERE key = ?',
+                                   (key,)).fetchone()
+            if row is not None:
+                blob = row[0]
+                self._used[key] = time.time()
+                if len(self._used) >= USED_BATCH:
+                    self._write_used()
+                    self._db.commit()
+                self._remember(key, blob)
+        if blob is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return pickle.loads(blob)   # a fresh copy, callers may modify it
+
+    def put(self, key, results):
+        blob = pickle.dumps(results, protocol=pickle.HIGHEST_PROTOCOL)
+        self._remember(key, blob)
+        if self._db is not None:
+            self._write_used()
+            self._db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                             (key, blob, len(blob), time.time()))
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        if self.max_bytes is None:
+            return
+        total = self._db.execute('SELECT SUM(size) FROM results').fetchone()[0] or 0
+        if total <= self.max_bytes:
+            return
+        excess, stale = total - self.max_bytes, []
+        for key, size in self._db.execute('SELECT key, size FROM results ORDER BY used'):
+            stale.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._db.executemany('DELETE FROM results WHERE key = ?', stale)
+
+    def call(self, func, doses, responses, *args, **kwargs):
+        """
+        func(doses, responses, *args, **kwargs), from the cache when the same
+        inputs were seen before
+        """
+        params = dict(kwargs)
+        params.update(enumerate(args))
+        key = endpoint_key(func, doses, responses, {str(k):v for k, v in params.items()})
+        results = self.get(key)
+        if results is None:
+            results = func(doses, responses, *args, **kwargs)
+            self.put(key, results)
+        return results
+
+    def wrap(self, func):
+        """
+        func taking (doses, responses, ...) with its results cached
+        """
+        def cached(doses, responses, *args, **kwargs):
+            return self.call(func, doses, responses, *args, **kwargs)
+        cached.__name__ = _method_name(func)
+        cached.__doc__ = func.__doc__
+        return cached
+
+    def clear(self):
+        self._memory.clear()
+        self._memory_size = 0
+        self._used.clear()
+        if self._db is not None:
+            self._db.execute('DELETE FROM results')
+            self._db.commit()
+
+    def close(self):
+        if self._db is not None:
+            self._write_used()
+            self._db.commit()
+            self._db.close()
+            self._db = None
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+# cli.py
+"""
+Command-line batch runner for the CEBS tests
+
+Reads a study file (CSV or Parquet, sorted by the endpoint keys) in
+chunks, runs the chosen tests on every endpoint over a pool of worker
+processes and writes one columnar result file:
+
+    python -m cebspy.stats study.parquet results.parquet \\
+        --keys sex endpoint --dose dose --response response \\
+        --tests pipeline dixon --jobs 8
+"""
+import argparse
+import sys
+import time
+import warnings
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import cebspy.stats.design as sd
+import cebspy.stats.reader as rd
+from cebspy.stats.pipeline import analyze_endpoint
+from cebspy.stats.results import ResultTable
+
+__all__ = ['main', 'run_batch']
+
+## the decision tree of the pipeline on top of the single tests of reader
+CHOICES = sorted(rd.TESTS) + ['pipeline']
+
+
+def run_batch(endpoints, key_names, tests, parametric=False, trend_alpha=0.01):
+    """
+    Run tests on a list of (key, doses, responses) endpoints
+
+    Returns
+    -------
+    (table, seconds) with table as the ResultTable of the batch and seconds
+    as a dict of the time spent per test; a test raising an error gets a
+    row with the error message as warning
+    """
+    table = ResultTable(key_names)
+    seconds = dict.fromkeys(tests, 0.0)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        for key, doses, responses in endpoints:
+            design, responses = sd.complete_cases(doses, responses)
+            for name in tests:
+                start = time.perf_counter()
+                try:
+                    if name == 'pipeline':
+                        results = analyze_endpoint(design, responses, parametric,
+                                                   trend_alpha)
+                        table.append_results(key, results['trend'])
+                        table.append_results(key, results['test'])
+                    else:
+                        table.append_results(key, rd.TESTS[name](design, responses))
+                except Exception as e:
+                    table.append(key, name, float('nan'),
+                                 warnings='%s: %s' % (type(e).__name__, e))
+                seconds[name] += time.perf_counter() - start
+    return table, seconds
+
+
+class _Progress(object):
+    """
+    Endpoint counts and rates written to stderr at most every `every` seconds
+    """
+    def __init__(self, quiet, every=2.0):
+        self.quiet = quiet
+        self.every = every
+        self.start = self.shown = time.perf_counter()
+        self.endpoints = 0
+        self.rows = 0
+
+    def update(self, endpoints, rows, force=False):
+        self.endpoints += endpoints
+        self.rows += rows
+        now = time.perf_counter()
+        if not self.quiet and (force or now - self.shown >= self.every):
+            self.shown = now
+            elapsed = now - self.start
+            sys.stderr.write('%d endpoints, %d result rows, %.1f s, %.0f endpoints/s\n' % (
+                self.endpoints, self.rows, elapsed, self.endpoints / max(elapsed, 1e-9)))
+
+
+def _parser():
+    parser = argparse.ArgumentParser(
+            prog='python -m cebspy.stats',
+            description='Run the CEBS dose-response tests on every endpoint of a study file')
+    parser.add_argument('study', help='CSV or Parquet file sorted by the endpoint keys')
+    parser.add_argument('output', help='result file, .parquet, .pq or .feather')
+    parser.add_argument('--keys', nargs='+', required=True,
+                        help='columns identifying an endpoint')
+    parser.add_argument('--dose', default='dose', help='dose column (default: dose)')
+    parser.add_argument('--response', default='response',
+                        help='response column (default: response)')
+    parser.add_argument('--tests', nargs='+', choices=CHOICES, default=['pipeline'],
+                        help='tests to run (default: pipeline)')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='number of worker processes (default: 1)')
+    parser.add_argument('--batch-size', type=int, default=200,
+                        help='endpoints sent to a worker at a time')
+    parser.add_argument('--chunksize', type=int, default=100000,
+                        help='rows read from the study file at a time')
+    parser.add_argument('--parametric', action='store_true',
+                        help='pipeline: Williams instead of Shirley after a trend')
+    parser.add_argument('--trend-alpha', type=float, default=0.01,
+                        help='pipeline: significance level of the trend test')
+    parser.add_argument('--quiet', '-q', action='store_true',
+                        help='no progress and timing output')
+    return parser
+
+
+def main(argv=None):
+    """
+    Entry point of python -m cebspy.stats, returns the exit status
+    """
+    args = _parser().parse_args(argv)
+    if not args.output.lower().endswith(('.parquet', '.pq', '.feather')):
+        _parser().error('the output must be a .parquet, .pq or .feather file')
+    keys = list(args.keys)
+    batches = rd.iter_endpoint_batches(args.study, keys, args.dose, args.response,
+                                       args.batch_size, args.chunksize)
+    options = (keys, args.tests, args.parametric, args.trend_alpha)
+    table = ResultTable(keys)
+    seconds = dict.fromkeys(args.tests, 0.0)
+    progress = _Progress(args.quiet)
+
+    def collect(part, n_endpoints):
+        part_table, part_seconds = part
+        table.extend(part_table)
+        for name, value in part_seconds.items():
+            seconds[name] += value
+        progress.update(n_endpoints, len(part_table))
+
+    if args.jobs <= 1:
+        for batch in batches:
+            collect(run_batch(batch, *options), len(batch))
+    else:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            pending = {}
+            for batch in batches:
+                pending[executor.submit(run_batch, batch, *options)] = len(batch)
+                if len(pending) >= 2 * args.jobs:   # bounded read-ahead
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future.result(), pending.pop(future))
+            for future in list(pending):
+                collect(future.result(), pending.pop(future))
+
+    start = time.perf_counter()
+    table.write(args.output)
+    write_seconds = time.perf_counter() - start
+    if not args.quiet:
+        progress.update(0, 0, force=True)
+        for name in args.tests:
+            sys.stderr.write('  %-10s %8.2f s in tests (%.3f ms per endpoint)\n' % (
+                name, seconds[name], 1000 * seconds[name] / max(progress.endpoints, 1)))
+        sys.stderr.write('  %-10s %8.2f s, %d rows to %s\n' % (
+            'write', write_seconds, len(table), args.output))
+    return 0
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# design.py
+"""
+Study design index shared by the endpoints of a study
+
+In a study hundreds of endpoints share the same animals and dose
+assignment, so the dose vector is factorized once into a StudyDesign and
+the tests only do the response dependent work per endpoint.
+"""
+import numpy as np
+
+import cebspy.stats._arrays as arr
+
+__all__ = ['StudyDesign', 'as_design', 'complete_cases']
+
+
+class StudyDesign(object):
+    """
+    Factorized dose vector
+
+    Parameters
+    ----------
+    doses : a list or array of float values as doses, 0 as control
+
+    Attributes
+    ----------
+    doses : array of the doses as given
+    levels : sorted array of the distinct dose levels
+    codes : int array of the dose group index 0..k-1 of each animal
+    counts : int array of the number of animals per dose group
+    order : int array, a stable permutation sorting the animals by dose
+    control : int index of the control group (dose 0) in levels, or None
+
+    Examples
+    --------
+    >>> from cebspy.stats.design import StudyDesign
+    >>> from cebspy.stats.dunntest import dunn_test
+    >>> design = StudyDesign(study['dose'])
+    >>> for endpoint in endpoints:
+    ...     results = dunn_test(design, study[endpoint])
+    """
+    def __init__(self, doses):
+        self.doses = np.asarray(doses)
+        self.levels, codes = np.unique(self.doses, return_inverse=True)
+        self.codes = codes.ravel()
+        self.counts = np.bincount(self.codes, minlength=len(self.levels))
+        self.order = np.argsort(self.codes, kind='mergesort')
+        control = np.flatnonzero(self.levels == 0)
+        self.control = int(control[0]) if len(control) > 0 else None
+
+    def __len__(self):
+        return len(self.doses)
+
+    @property
+    def n_groups(self):
+        return len(self.levels)
+
+    def subset(self, mask):
+        """
+        Design of the animals selected by a boolean mask, e.g. non-missing
+        responses
+        """
+        return StudyDesign(self.doses[mask])
+
+
+def as_design(doses):
+    """
+    Return doses as a StudyDesign, factorizing them if needed
+    """
+    if isinstance(doses, StudyDesign):
+        return doses
+    return StudyDesign(doses)
+
+
+def complete_cases(doses, responses):
+    """
+    Design and float64 responses of the animals with a non-missing response
+
+    Responses are taken as zero-copy float views where possible and missing
+    values are dropped with a mask; nothing is copied when none are missing.
+    """
+    design = as_design(doses)
+    responses = arr.as_float_array(responses)
+    keep = ~np.isnan(responses)
+    if not keep.all():
+        design, responses = design.subset(keep), responses[keep]
+    return design, responses
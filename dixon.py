@@ -7,15 +7,19 @@ Created on Mon Aug 13 12:23:01 2018
 #os.chdir('C:\\Users\\yingw\\AnacondaProjects\\cebstats')
 #import pandas as pd
 import numpy as np
-import qdixon
+import cebspy.stats._arrays as arr
+import cebspy.stats.profiling as prof
 
 #x = [0.2022, 0.2111, 0.2173, 0.2190, 0.2268, 0.2270, 0.2334, 0.2338, 0.2338, 0.2354, 0.2371, 0.2372, 0.2378, 0.2418, 0.2451, 0.2455, 0.2460, 0.2549, 0.2550, 0.2633, 0.2644, 0.2724, 0.2915]
 
 __all__ = ['dixon']
 
 def dixon(x, type = 0, opposite = False, two_sided = True):
-    x.sort()
+    with prof.stage('dixon', 'sort', len(x)):
+        x = np.sort(arr.valid_values(x))   # sorted copy, the input is left untouched
     n = len(x)
+    if (n < 3 or n > 30):
+        prof.path('dixon', 'sample_size', 'out_of_tables')
     if ((type == 10 or type == 0) and (n < 3 or n > 30)):
         return("Sample size must be in range 3-30")
     if ((type == 11) and (n < 4 or n > 30)):
@@ -67,12 +71,15 @@ def dixon(x, type = 0, opposite = False, two_sided = True):
             Q = (x[n-1] - x[n-3]) / (x[n-1] - x[1])
         else:
             Q = (x[n-1] - x[n-3]) / (x[n-1] - x[2])
-    pval = qdixon.qdixon(Q, n, type)
+    prof.path('dixon', 'statistic', 'r%d' % type)
+    with prof.stage('dixon', 'p_value', n):
+        import qdixon   # Dixon tables, loaded on the first test
+        pval = qdixon.qdixon(Q, n, type)
     if two_sided:
         pval = 2 * pval
         if pval > 1:
             pval = 2 - pval
-    Q_list = ['Q',Q]
+    Q_list = ['Q',float(Q)]
     RVAL = {'statistic' : Q_list, 'alternative' : alt, 'p.value' : pval,
         'method' :"Dixon test for outliers",  'class': 'htest'}
     return(RVAL)
@@ -7,16 +7,74 @@ Created on Thu Jul 26 15:58:00 2018
 """
 
 import numpy as np
-import pandas as pd
 import warnings
 
-import cebspy.stats._ties_utils as tu
-from scipy.stats import norm
+import cebspy.stats._distributions as dist
+import cebspy.stats.design as sd
+import cebspy.stats.profiling as prof
+import cebspy.stats.ranking as rk
 
-__all__ = ['dunn_test']
+__all__ = ['ADJUSTMENTS', 'dunn_all_pairs', 'dunn_test', 'dunn_test_matrix']
 
+## multiplicity adjustments of dunn_all_pairs
+ADJUSTMENTS = ('bonferroni', 'holm', 'sidak')
 
-def dunn_test(doses, responses):
+
+def _dunn_comparisons(counts, rank_means, n_total, correction):
+    """
+    Compare each dose group with control for one or more endpoints
+
+    Parameters
+    ----------
+    counts : int array of group sizes per dose, control first
+
+    rank_means : float array (doses x endpoints) of mean ranks
+
+    n_total : int as the total number of values
+
+    correction : float array of the tie sums per endpoint
+
+    Returns
+    -------
+    (dunnsign, mult_comp_signif) as int arrays of the shape of rank_means,
+    0 for the control row
+    """
+    # find variance
+    v = (n_total * (n_total + 1)) / 12
+    # get crit values ... Bonferroni over the treatment groups
+    prob05 = 1 - (.05 / (2 * (len(counts) - 1)))
+    prob01 = 1 - (.01 / (2 * (len(counts) - 1)))
+    z_score05 = dist.norm_ppf(prob05)
+    z_score01 = dist.norm_ppf(prob01)
+    rankdiff = np.abs(rank_means - rank_means[0])
+    comp2 = v * (1 / counts + 1 / counts[0])[:, None]
+    comp2 = (comp2 * (1 - correction / (n_total ** 3 - n_total))) ** .5
+    dunnsign = np.where(rank_means >= rank_means[0], 0, -1)
+    signif = np.where(rankdiff - (z_score01 * comp2) > 0, 2,
+                      np.where(rankdiff - (z_score05 * comp2) > 0, 1, 0))
+    dunnsign[0] = 0
+    signif[0] = 0
+    return dunnsign, signif
+
+
+def _dunn_tests(dose_groups, counts, rank_means, n_total, correction):
+    """
+    Dunn's test output from the mean ranks and the tie sum of one endpoint
+    """
+    with prof.stage('dunn', 'comparisons', len(dose_groups)):
+        dunnsigns, mult_comp_signifs = _dunn_comparisons(
+                counts, rank_means[:, None], n_total, np.array([correction]))
+    return {'is_finished':bool(1),
+            'has_output':bool(1),
+            'output':{'dose':dose_groups.tolist(),
+                      'count':counts.tolist(),
+                      'dose_rank':list(range(len(dose_groups))),
+                      'rank_mean':rank_means.tolist(),
+                      'dunnsign':dunnsigns[:, 0].tolist(),
+                      'mult_comp_signif':mult_comp_signifs[:, 0].tolist()}}
+
+
+def dunn_test(doses, responses, permutations=0, seed=None):
     """
     Dunn's multiple comsprison test
     
@@ -24,9 +82,17 @@ def dunn_test(doses, responses):
     
     Parameters
     ----------
-    doses : a list of folat values as doses ordered ascendingly
+    doses : a list of folat values as doses ordered ascendingly, or a
+        StudyDesign shared by the endpoints of a study
     
     responses : a list of float values as responses
+
+    permutations : int, optional; when given, the significance comes from
+        up to this many permutations of the dose labels (exactly when there
+        are few labelings) instead of the normal critical values, see
+        permutation.dunn_permutation_test
+
+    seed : seed of the permutations, optional
     
     Examples
     --------
@@ -49,68 +115,28 @@ def dunn_test(doses, responses):
      'mult_comp_signif': [0, 0, 0, 0]}
     
     """
+    if permutations:
+        import cebspy.stats.permutation as perm
+        return perm.dunn_permutation_test(doses, responses, permutations, seed=seed)
     results = {'method':"Dunn's test",
                'has_output':bool(0),
                'has_errors':bool(0)}
     warn_message = None
     if (len(doses) == len(responses)):
-        dose_groups = np.unique(doses) # also sorted
+        with prof.stage('dunn', 'complete_cases', len(responses)):
+            design, responses = sd.complete_cases(doses, responses)
+        dose_groups = design.levels # also sorted
         if (0 in dose_groups):
             if (len(dose_groups) > 1):
-                ranks = np.unique(responses, return_counts=True)
-                # np.shape(ranks)
-                ties = np.unique(ranks[1], return_counts=True)
-                # tie adjustment correction
-                correction = tu._ties_correction(ties)
-                weights = tu._ranks_weights(ranks)
-                #ranks2 = tuple([ranks[0], ranks[1], np.array(weights)]) # ['value', 'count', 'rank']
-                ranks2 = pd.DataFrame({'values':ranks[0].tolist(),
-                                       'counts':ranks[1].tolist(),
-                                       'ranks':weights})
-                ranks2.set_index('values', inplace=True)
-                ex_df = pd.DataFrame({'doses':doses, 'response':responses})
-                ex_df['counts'] = [ranks2['counts'][value] for value in responses]
-                ex_df['ranks'] = [ranks2['ranks'][value] for value in responses]
-                #rank_sums = ex_df.groupby('doses')['ranks'].agg(['sum','count'])
-                rank_means = ex_df.groupby('doses')['ranks'].agg(['mean','count'])
-                rank_means['dose_count'] = list(range(len(rank_means)))
-                rank_means.reset_index(drop=False, inplace=True)
-                # find variance
-                n_total = len(ex_df)
-                v = (n_total * (n_total + 1))/12
-                # get crit values ... warnings are for CONTROL group, which is fine
-                prob05 = 1 - (.05 / (2 * max(rank_means['dose_count'])))
-                prob01 = 1 - (.01 / (2 * max(rank_means['dose_count'])))
-                z_score05 = norm.ppf(prob05)
-                z_score01 = norm.ppf(prob01)
-                # loop through doses, determine significance
-                dunnsigns = [0]
-                mult_comp_signifs = [0]
-                for i in range(1, len(rank_means), 1):
-                    sig = - 1
-                    if (rank_means['mean'][i] >= rank_means['mean'][0]):
-                        sig = 0
-                    dunnsigns.append(sig)
-                    #num = rank_means['count'][i]
-                    rankdiff = abs(rank_means['mean'][i] - rank_means['mean'][0])
-                    comp2 = v * (1/rank_means['count'][i] + 1/rank_means['count'][0])
-                    comp2 = (comp2 * (1 - correction / (n_total ** 3 - n_total))) ** .5
-                    sig05 = rankdiff - (z_score05 * comp2)
-                    sig01 = rankdiff - (z_score01 * comp2)
-                    signific = 0
-                    if (sig05 > 0):
-                        signific = 1
-                    if (sig01 > 0):
-                        signific = 2
-                    mult_comp_signifs.append(signific)
-                tests = {'is_finished':bool(1),
-                        'has_output':bool(1),
-                        'output':{'dose':rank_means['doses'].tolist(),
-                                  'count':rank_means['count'].tolist(),
-                                  'dose_rank':rank_means['dose_count'].tolist(),
-                                  'rank_mean':rank_means['mean'].tolist(),
-                                  'dunnsign':dunnsigns,
-                                  'mult_comp_signif':mult_comp_signifs}}
+                codes = design.codes
+                with prof.stage('dunn', 'ranking', len(responses)):
+                    ranks, ties, correction = rk.rank_data(responses)
+                counts = design.counts
+                with prof.stage('dunn', 'group_ranks', len(responses)):
+                    rank_means = np.bincount(codes, weights=ranks,
+                                             minlength=len(dose_groups)) / counts
+                tests = _dunn_tests(dose_groups, counts, rank_means,
+                                    len(responses), correction)
                 results.update(tests)
             else:
                 warn_message = 'No enough treatment groups'
@@ -126,3 +152,169 @@ def dunn_test(doses, responses):
                         'warnings':[warn_message]})
 
     return results
+
+
+def dunn_test_matrix(doses, responses):
+    """
+    Dunn's multiple comparison test for many endpoints sharing one dose vector
+
+    Every column of the response matrix is ranked in a single call and all
+    dose versus control comparisons are computed as array expressions.
+
+    Parameters
+    ----------
+    doses : a list or array of n float values as doses, or a StudyDesign
+
+    responses : a 2-D array (n x endpoints) of float values without NaN, one
+        endpoint per column
+
+    Returns
+    -------
+    The results dict of dunn_test where 'output' holds arrays: 'dose' and
+    'count' per dose group, and 'rank_mean', 'dunnsign' and
+    'mult_comp_signif' of shape (doses x endpoints)
+
+    Examples
+    --------
+    >>> from cebspy.stats.dunntest import dunn_test_matrix
+    >>> results = dunn_test_matrix(doses, np.column_stack([weights, volumes]))
+    >>> results['output']['mult_comp_signif'][:, 1]   # second endpoint
+    """
+    results = {'method':"Dunn's test",
+               'has_output':bool(0),
+               'has_errors':bool(0)}
+    warn_message = None
+    responses = np.asarray(responses, dtype=float)
+    if responses.ndim == 1:
+        responses = responses[:, None]
+    design = sd.as_design(doses)
+    dose_groups = design.levels # also sorted
+    if (len(doses) != responses.shape[0]):
+        warn_message = 'The number of values betwee doses and responses are not equal'
+    elif (0 not in dose_groups):
+        warn_message = 'The control group (dose = 0) is missing'
+    elif (len(dose_groups) < 2):
+        warn_message = 'No enough treatment groups'
+    if (warn_message is not None):
+        warnings.warn(warn_message)
+        results.update({'has_errors':bool(1),
+                        'warnings':[warn_message]})
+        return results
+    codes = design.codes
+    ranks, correction = rk.rank_columns(responses)
+    counts = design.counts
+    # one-hot dose membership (doses x n) times ranks (n x endpoints)
+    membership = (codes[None, :] == np.arange(len(dose_groups))[:, None])
+    rank_means = membership.astype(float).dot(ranks) / counts[:, None]
+    dunnsign, signif = _dunn_comparisons(counts, rank_means, responses.shape[0],
+                                         correction)
+    results.update({'is_finished':bool(1),
+                    'has_output':bool(1),
+                    'output':{'dose':dose_groups,
+                              'count':counts,
+                              'rank_mean':rank_means,
+                              'dunnsign':dunnsign,
+                              'mult_comp_signif':signif}})
+    return results
+
+
+def _adjust_p_values(p_values, adjust):
+    """
+    Multiplicity adjusted p values of a family of comparisons
+    """
+    m = len(p_values)
+    if adjust is None:
+        return p_values.copy()
+    if adjust == 'bonferroni':
+        return np.minimum(p_values * m, 1)
+    if adjust == 'holm':
+        order = np.argsort(p_values, kind='stable')
+        adjusted = np.empty(m)
+        adjusted[order] = np.minimum(
+                np.maximum.accumulate((m - np.arange(m)) * p_values[order]), 1)
+        return adjusted
+    # sidak
+    return -np.expm1(m * np.log1p(-p_values))
+
+
+def dunn_all_pairs(doses, responses, adjust='holm'):
+    """
+    Dunn's test of all pairs of dose groups
+
+    The responses are ranked once; the z statistics of every pair come
+    from the k x k differences of the mean ranks and the standard errors
+    broadcast from the group counts, and the adjustment is applied to the
+    vector of the k (k - 1) / 2 two-sided p values.
+
+    Parameters
+    ----------
+    doses : a list of float values as doses, or a StudyDesign
+
+    responses : a list of float values as responses
+
+    adjust : 'holm' (default), 'bonferroni', 'sidak' or None for the raw p
+        values
+
+    Returns
+    -------
+    The results dict with 'output' holding 'dose', 'count' and 'rank_mean'
+    per dose group and, per pair (dose1 < dose2), 'dose1', 'dose2', 'z',
+    'p_value', 'p_adjusted', 'dunnsign' (-1 when the higher dose has the
+    lower mean rank) and 'mult_comp_signif' (1 for 5%, 2 for 1% on the
+    adjusted p values)
+
+    Examples
+    --------
+    >>> from cebspy.stats.dunntest import dunn_all_pairs
+    >>> doses = [0, 0, 0, 10, 10, 10, 30, 30, 30]
+    >>> responses = [5.1, 4.9, 5.0, 4.1, 4.3, 4.0, 3.1, 3.0, 3.3]
+    >>> dunn_all_pairs(doses, responses, adjust='bonferroni')['output']['mult_comp_signif']
+    [0, 1, 0]
+    """
+    if adjust is not None and adjust not in ADJUSTMENTS:
+        raise ValueError('Unknown adjustment %r, use one of %s or None'
+                         % (adjust, ', '.join(ADJUSTMENTS)))
+    results = {'method':"Dunn's test (all pairs)",
+               'has_output':bool(0),
+               'has_errors':bool(0)}
+    warn_message = None
+    if (len(doses) != len(responses)):
+        warn_message = 'The number of values betwee doses and responses are not equal'
+    else:
+        design, responses = sd.complete_cases(doses, responses)
+        if (len(design.levels) < 2):
+            warn_message = 'No enough dose groups'
+    if (warn_message is not None):
+        warnings.warn(warn_message)
+        results.update({'has_errors':bool(1),
+                        'warnings':[warn_message]})
+        return results
+    dose_groups = design.levels
+    counts = design.counts
+    n_total = len(responses)
+    with prof.stage('dunn', 'ranking', n_total):
+        ranks, ties, correction = rk.rank_data(responses)
+    rank_means = np.bincount(design.codes, weights=ranks,
+                             minlength=len(dose_groups)) / counts
+    with prof.stage('dunn', 'all_pairs', len(dose_groups)):
+        first, second = np.triu_indices(len(dose_groups), 1)
+        rankdiff = rank_means[None, :] - rank_means[:, None]
+        v = (n_total * (n_total + 1)) / 12 * (1 - correction / (n_total ** 3 - n_total))
+        se = (v * (1 / counts[:, None] + 1 / counts[None, :])) ** .5
+        z = (rankdiff / se)[first, second]
+        p_values = np.minimum(2 * dist.norm_sf(np.abs(z)), 1)
+        p_adjusted = _adjust_p_values(p_values, adjust)
+    results.update({'is_finished':bool(1),
+                    'has_output':bool(1),
+                    'output':{'dose':dose_groups.tolist(),
+                              'count':counts.tolist(),
+                              'rank_mean':rank_means.tolist(),
+                              'dose1':dose_groups[first].tolist(),
+                              'dose2':dose_groups[second].tolist(),
+                              'z':z.tolist(),
+                              'p_value':p_values.tolist(),
+                              'p_adjusted':p_adjusted.tolist(),
+                              'dunnsign':np.where(z < 0, -1, 0).tolist(),
+                              'mult_comp_signif':np.where(p_adjusted < .01, 2,
+                                                          np.where(p_adjusted < .05, 1, 0)).tolist()}})
+    return results
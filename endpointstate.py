@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+# endpointstate.py
+"""
+Updatable summary of one endpoint for data corrections
+
+Adding, removing or correcting a few animals updates the per-dose count,
+sum and M2, the pairwise Mann-Whitney counts between dose groups and the
+tie sums in O(k sqrt(n)) instead of recomputing the group statistics and
+re-ranking all responses. The Williams, Shirley, Dunn and
+Jonckheere-Terpstra results are then refreshed from these summaries.
+"""
+import bisect
+
+import numpy as np
+
+import cebspy.stats.design as sd
+import cebspy.stats.dunntest as dt
+import cebspy.stats.groupstats as gs
+import cebspy.stats.jonckheere as jt
+import cebspy.stats.ranking as rk
+import cebspy.stats.shirleytest as st
+import cebspy.stats.Williams as wt
+
+__all__ = ['EndpointState']
+
+
+class _OrderedValues(object):
+    """
+    Responses kept sorted in blocks of about `load` values with the counts
+    per dose group of each block, for counting the values below or equal
+    to a value per dose group in O(k n / load + load)
+    """
+    def __init__(self, values, codes, n_groups, load=512):
+        self.n_groups = n_groups
+        self.load = load
+        order = np.lexsort((codes, values))
+        values, codes = values[order], codes[order]
+        bounds = list(range(0, len(values), load)) + [len(values)]
+        self._values = [values[i:j] for i, j in zip(bounds[:-1], bounds[1:])]
+        self._codes = [codes[i:j] for i, j in zip(bounds[:-1], bounds[1:])]
+        if not self._values:
+            self._values, self._codes = [values[:0]], [codes[:0]]
+        self._maxes = [block[-1] if len(block) else np.inf for block in self._values]
+        self._counts = np.array([np.bincount(block, minlength=n_groups)
+                                 for block in self._codes]).reshape(-1, n_groups)
+
+    def _count(self, value, side):
+        """
+        Counts per dose group of the values < value (side 'left') or
+        <= value (side 'right')
+        """
+        find = bisect.bisect_left if side == 'left' else bisect.bisect_right
+        b = min(find(self._maxes, value), len(self._maxes) - 1)
+        p = np.searchsorted(self._values[b], value, side=side)
+        return (self._counts[:b].sum(axis=0) +
+                np.bincount(self._codes[b][:p], minlength=self.n_groups))
+
+    def below_equal(self, value):
+        """
+        (below, equal) counts per dose group of the values < and == value
+        """
+        below = self._count(value, 'left')
+        return below, self._count(value, 'right') - below
+
+    def insert(self, value, code):
+        b = min(bisect.bisect_left(self._maxes, value), len(self._maxes) - 1)
+        p = np.searchsorted(self._values[b], value, side='right')
+        self._values[b] = np.insert(self._values[b], p, value)
+        self._codes[b] = np.insert(self._codes[b], p, code)
+        self._counts[b, code] += 1
+        self._maxes[b] = self._values[b][-1]
+        if len(self._values[b]) > 2 * self.load:
+            half = len(self._values[b]) // 2
+            for blocks in (self._values, self._codes):
+                blocks[b:b + 1] = [blocks[b][:half], blocks[b][half:]]
+            self._maxes[b:b + 1] = [self._values[b][-1], self._values[b + 1][-1]]
+            self._counts = np.insert(self._counts, b + 1, 0, axis=0)
+            self._counts[b] = np.bincount(self._codes[b], minlength=self.n_groups)
+            self._counts[b + 1] = np.bincount(self._codes[b + 1], minlength=self.n_groups)
+
+    def remove(self, value, code):
+        b = bisect.bisect_left(self._maxes, value)
+        while b < len(self._maxes):
+            block = self._values[b]
+            start = np.searchsorted(block, value, side='left')
+            stop = np.searchsorted(block, value, side='right')
+            found = np.flatnonzero(self._codes[b][start:stop] == code)
+            if len(found):
+                p = start + found[0]
+                self._values[b] = np.delete(block, p)
+                self._codes[b] = np.delete(self._codes[b], p)
+                self._counts[b, code] -= 1
+                if len(self._values[b]) == 0 and len(self._values) > 1:
+                    del self._values[b], self._codes[b], self._maxes[b]
+                    self._counts = np.delete(self._counts, b, axis=0)
+                else:
+                    self._maxes[b] = self._values[b][-1] if len(self._values[b]) else np.inf
+                return
+            if stop < len(block):
+                break
+            b += 1
+        raise KeyError('No response %r in dose group %d' % (value, code))
+
+
+class EndpointState(object):
+    """
+    Dose group and rank summaries of an endpoint supporting corrections
+
+    Parameters
+    ----------
+    doses : a list or array of float values as doses, 0 as control, or a
+        StudyDesign
+
+    responses : a list or array of float values as responses, NaN values
+        are dropped
+
+    Attributes
+    ----------
+    levels : sorted array of the dose levels, fixed at construction
+
+    count, sum, m2 : float arrays of the count, sum and sum of squared
+        deviations of the responses per dose group
+
+    wins : float array (k x k), wins[a, b] counts the pairs of a response
+        of group a above a response of group b, ties counting 1/2
+
+    Examples
+    --------
+    >>> from cebspy.stats.endpointstate import EndpointState
+    >>> state = EndpointState(doses, responses)
+    >>> state.replace(10, 4.3, 4.6)         # a corrected value at dose 10
+    >>> state.remove(30, 3.3)               # an excluded animal
+    >>> results = state.dunn_test()
+    """
+    def __init__(self, doses, responses):
+        design, responses = sd.complete_cases(doses, responses)
+        self.levels = design.levels
+        self._codes = {float(level):i for i, level in enumerate(design.levels)}
+        groups = gs.DoseGroupStats.from_arrays(design, responses)
+        k = design.n_groups
+        self.count = groups.count.astype(float)
+        self.sum = groups.sum.copy()
+        self.m2 = groups.m2.copy()
+        self._order = _OrderedValues(responses, design.codes, k)
+        table = rk.NestedRanks(design.codes, responses, k).table
+        # pairwise wins from the counts per (dose group, distinct value)
+        below = np.cumsum(table, axis=1) - table
+        self.wins = np.zeros((k, k))
+        for a in range(k):
+            self.wins[a] = (table[a] * (below + 0.5 * table)).sum(axis=1)
+        # sums of squares and cubes of the tie sizes in the subsets 0..g
+        ties = np.cumsum(table, axis=0).astype(float)
+        self._tie_squares = (ties ** 2).sum(axis=1)
+        self._tie_cubes = (ties ** 3).sum(axis=1)
+
+    @property
+    def n_groups(self):
+        return len(self.levels)
+
+    @property
+    def n_total(self):
+        return int(self.count.sum())
+
+    def _code(self, dose):
+        code = self._codes.get(float(dose))
+        if code is None:
+            raise ValueError('Unknown dose level %r' % (dose,))
+        return code
+
+    def _update_ranks(self, code, value, sign):
+        """
+        Add (sign 1) or remove (sign -1) a value of group code in the wins
+        and tie sums; the ordered values must not hold it at this point
+        """
+        below, equal = self._order.below_equal(value)
+        above = self.count - below - equal
+        other = np.arange(self.n_groups) != code
+        self.wins[code, other] += sign * (below + 0.5 * equal)[other]
+        self.wins[other, code] += sign * (above + 0.5 * equal)[other]
+        # tie groups of the subsets 0..g containing the code
+        ties = np.cumsum(equal)[code:].astype(float)
+        grown = ties + 1
+        self._tie_squares[code:] += sign * (grown ** 2 - ties ** 2)
+        self._tie_cubes[code:] += sign * (grown ** 3 - ties ** 3)
+
+    def add(self, dose, value):
+        """
+        Add the response value of an animal at dose
+        """
+        code, value = self._code(dose), float(value)
+        if np.isnan(value):
+            return
+        self._update_ranks(code, value, 1)
+        self._order.insert(value, code)
+        n = self.count[code]
+        delta = value - (self.sum[code] / n if n else 0.0)
+        self.count[code] = n + 1
+        self.sum[code] += value
+        self.m2[code] += delta * (value - self.sum[code] / (n + 1))
+
+    def remove(self, dose, value):
+        """
+        Remove a response value at dose, KeyError if it is not there
+        """
+        code, value = self._code(dose), float(value)
+        if np.isnan(value):
+            return
+        self._order.remove(value, code)
+        self._update_ranks(code, value, -1)
+        n = self.count[code]
+        mean = self.sum[code] / n
+        self.count[code] = n - 1
+        self.sum[code] -= value
+        if n > 1:
+            self.m2[code] -= (value - mean) * (value - self.sum[code] / (n - 1))
+        else:
+            self.sum[code], self.m2[code] = 0.0, 0.0
+
+    def replace(self, dose, old_value, new_value, new_dose=None):
+        """
+        Correct the response (and optionally the dose) of an animal; the
+        state is unchanged when the new dose is unknown or the old value
+        is not there
+        """
+        new_dose = dose if new_dose is None else new_dose
+        self._code(new_dose)
+        new_value = float(new_value)
+        self.remove(dose, old_value)
+        self.add(new_dose, new_value)
+
+    def _present(self):
+        """
+        Codes of the dose groups with responses, the levels dunn_test and
+        the other tests see in the current data
+        """
+        return np.flatnonzero(self.count > 0)
+
+    def group_stats(self):
+        """
+        DoseGroupStats of the dose groups with responses
+        """
+        present = self._present()
+        return gs.DoseGroupStats(self.levels[present], self.count[present].astype(int),
+                                 self.sum[present], np.maximum(self.m2[present], 0.0))
+
+    def rank_sums(self, top=None):
+        """
+        Rank sums of the dose groups 0..top ranked together (all by default)
+        """
+        top = self.n_groups - 1 if top is None else top
+        n = self.count[:top + 1]
+        wins = self.wins[:top + 1, :top + 1]
+        return n * (n + 1) / 2 + wins.sum(axis=1) - np.diag(wins)
+
+    def levels_iter(self):
+        """
+        (top, n_total, tie_sum, rank_sums, group_counts) of the subsets from
+        all dose groups with responses down to control + 1, as
+        NestedRanks.levels over those groups
+        """
+        present = self._present()
+        for top in range(len(present) - 1, 0, -1):
+            groups = present[:top + 1]
+            group_counts = self.count[groups].astype(int)
+            n_total = int(group_counts.sum())
+            # empty groups add nothing to the tie sums of the subsets
+            tie_sum = float(self._tie_cubes[groups[-1]] - n_total)
+            yield top, n_total, tie_sum, self.rank_sums(groups[-1])[groups], group_counts
+
+    def jonckheere(self):
+        """
+        Output of the Jonckheere-Terpstra test, as jonckheere_test
+        """
+        statistic = float(np.tril(self.wins, -1).sum())
+        return jt._jonckheere_stats(statistic, self.count[self._present()],
+                                    self._tie_squares[-1],
+                                    self._tie_cubes[-1])
+
+    def _results(self, method, tests):
+        results = {'method':method, 'has_output':bool(0), 'has_errors':bool(0)}
+        if tests is None:
+            results.update({'has_errors':bool(1),
+                            'warnings':['Either no enough treatment groups or '
+                                        'the control group is missing']})
+        else:
+            results.update(tests)
+        return results
+
+    def _valid(self):
+        # empty dose groups are dropped as dunn_test drops missing levels
+        present = self._present()
+        return len(present) > 1 and self.levels[present[0]] == 0
+
+    def williams(self, jonck_trend=None):
+        """
+        Williams test results of the current data
+        """
+        if not self._valid():
+            return self._results("Williams test", None)
+        if jonck_trend is None:
+            jonck_trend = self.jonckheere()['z']
+        return self._results("Williams test",
+                             wt._williams_tests(self.group_stats(), jonck_trend))
+
+    def shirley_test(self, tau=None):
+        """
+        Shirley's test results of the current data
+        """
+        if not self._valid():
+            return self._results("Shirley's test", None)
+        if tau is None:
+            tau = self.jonckheere()['tau']
+        return self._results("Shirley's test",
+                             st._shirley_tests(self.levels[self._present()],
+                                               self.levels_iter(), tau))
+
+    def dunn_test(self):
+        """
+        Dunn's test results of the current data
+        """
+        if not self._valid():
+            return self._results("Dunn's test", None)
+        present = self._present()
+        counts = self.count[present].astype(int)
+        return self._results("Dunn's test", dt._dunn_tests(
+                self.levels[present], counts, self.rank_sums()[present] / counts,
+                self.n_total, float(self._tie_cubes[-1] - self.n_total)))
+
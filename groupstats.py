@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# groupstats.py
+"""
+Per-dose sufficient statistics shared by the CEBS tests
+
+One entry per dose level, sorted ascendingly so that the control group
+(dose 0) comes first.
+"""
+import math
+import numpy as np
+
+import cebspy.stats._arrays as arr
+import cebspy.stats.design as sd
+
+__all__ = ['DoseGroupStats']
+
+
+class DoseGroupStats(object):
+    """
+    Count, sum and M2 (sum of squared deviations) per dose group
+
+    Built once from the observations, then the group means, variances,
+    pooled variance (MSE) and degrees of freedom are derived from the arrays
+    without going back to the raw data.
+
+    Parameters
+    ----------
+    doses : array of the sorted dose levels
+
+    count : array of the number of observations per dose
+
+    sum : array of the sum of the responses per dose
+
+    m2 : array of the sum of squared deviations from the dose mean
+
+    Examples
+    --------
+    >>> from cebspy.stats.groupstats import DoseGroupStats
+    >>> groups = DoseGroupStats.from_arrays([0, 0, 10, 10], [1.0, 2.0, 3.0, 5.0])
+    >>> groups.mean
+    array([1.5, 4. ])
+    >>> groups.pooled_variance()
+    1.25
+    """
+    def __init__(self, doses, count, sum, m2):
+        self.doses = np.asarray(doses)
+        self.count = np.asarray(count)
+        self.sum = np.asarray(sum, dtype=float)
+        self.m2 = np.asarray(m2, dtype=float)
+
+    @classmethod
+    def from_arrays(cls, doses, responses):
+        """
+        Group the responses by dose level, doses may be a StudyDesign
+        """
+        design = sd.as_design(doses)
+        levels, codes, count = design.levels, design.codes, design.counts
+        y = arr.as_float_array(responses)
+        sums = np.bincount(codes, weights=y, minlength=len(levels))
+        dev = y - (sums / np.maximum(count, 1))[codes]
+        m2 = np.bincount(codes, weights=dev * dev, minlength=len(levels))
+        return cls(levels, count, sums, m2)
+
+    @classmethod
+    def from_samples(cls, *samples):
+        """
+        One group per sample, the doses being the sample positions 0, 1, ...
+        """
+        doses = np.repeat(np.arange(len(samples)), [len(s) for s in samples])
+        responses = np.concatenate([arr.as_float_array(s) for s in samples])
+        return cls.from_arrays(doses, responses)
+
+    def __len__(self):
+        return len(self.doses)
+
+    @property
+    def mean(self):
+        return self.sum / self.count
+
+    @property
+    def variance(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.count > 1, self.m2 / (self.count - 1), np.nan)
+
+    @property
+    def std_error(self):
+        return np.sqrt(self.variance / self.count)
+
+    @property
+    def n_total(self):
+        return int(self.count.sum())
+
+    @property
+    def dof(self):
+        """
+        Degrees of freedom of the pooled variance, N - number of doses
+        """
+        return self.n_total - len(self.doses)
+
+    def pooled_variance(self):
+        """
+        Pooled within-group variance (MSE) over all dose groups, NaN
+        without degrees of freedom (one value per group)
+        """
+        if self.dof <= 0:
+            return np.nan
+        return float(self.m2.sum()) / self.dof
+
+    def summary(self, i):
+        """
+        Sample statistics of the i-th group as returned by sample_stats
+        """
+        n = int(self.count[i])
+        variance = float(self.m2[i]) / (n - 1) if n > 1 else float('nan')
+        return {'mean': float(self.sum[i]) / n, 'variance': variance,
+                'std_error': math.sqrt(variance / n), 'size': n}
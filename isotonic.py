@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# isotonic.py
+"""
+Weighted isotonic regression by pool-adjacent-violators (PAVA)
+
+Used for the Williams-ized (monotone smoothed) dose means.
+"""
+import numpy as np
+
+__all__ = ['pava']
+
+
+def pava(values, weights, increasing=True):
+    """
+    Weighted isotonic regression of one or many sequences
+
+    Adjacent values violating the requested order are pooled into their
+    weighted mean until the sequence is monotone. Each row is processed in
+    O(k) amortized time and all rows of a 2-D input are processed together.
+
+    Parameters
+    ----------
+    values : a 1-D array of k values or a 2-D array with one sequence per row
+
+    weights : an array of the same shape as values, e.g. the group sizes;
+        entries with a weight of 0 (such as padding of shorter sequences) are
+        ignored and returned as NaN
+
+    increasing : a bool, or an array of bools with one entry per row, for
+        a non-decreasing (True) or non-increasing (False) fit
+
+    Returns
+    -------
+    An array of the same shape as values with the monotone fitted values
+
+    Examples
+    --------
+    >>> from cebspy.stats.isotonic import pava
+    >>> pava([9.6, 9.8, 8.2], [4, 4, 4], increasing=False)
+    array([9.7, 9.7, 8.2])
+    """
+    values = np.asarray(values, dtype=float)
+    one_d = values.ndim == 1
+    values = np.atleast_2d(values)
+    weights = np.broadcast_to(np.asarray(weights, dtype=float), values.shape)
+    m, k = values.shape
+    sign = np.where(np.broadcast_to(increasing, (m,)), 1.0, -1.0)[:, None]
+    signed = values * sign
+
+    ## stack of pooled blocks per row: weighted sum, weight, last position
+    sums = np.zeros((m, k))
+    wts = np.zeros((m, k))
+    ends = np.zeros((m, k), dtype=int)
+    top = np.full(m, -1)
+    rows = np.arange(m)
+    for j in range(k):
+        active = weights[:, j] > 0
+        top[active] += 1
+        r, t = rows[active], top[active]
+        sums[r, t] = signed[r, j] * weights[r, j]
+        wts[r, t] = weights[r, j]
+        ends[r, t] = j
+        ## pool while the previous block mean exceeds the top block mean
+        while True:
+            r = rows[top >= 1]
+            t = top[r]
+            violated = sums[r, t - 1] * wts[r, t] > sums[r, t] * wts[r, t - 1]
+            if not violated.any():
+                break
+            r, t = r[violated], t[violated]
+            sums[r, t - 1] += sums[r, t]
+            wts[r, t - 1] += wts[r, t]
+            ends[r, t - 1] = ends[r, t]
+            top[r] -= 1
+
+    ## expand the blocks back to positions
+    boundary = np.zeros((m, k + 1), dtype=int)
+    r, b = np.nonzero(np.arange(k)[None, :] < top[:, None])
+    np.add.at(boundary, (r, ends[r, b] + 1), 1)
+    block = np.minimum(np.cumsum(boundary[:, :k], axis=1), k - 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fitted = np.take_along_axis(sums / wts, block, axis=1) * sign
+    fitted[~(weights > 0)] = np.nan
+    return fitted[0] if one_d else fitted
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+# jonckheere.py
+"""
+Jonckheere-Terpstra test for an ordered dose trend
+
+The trend direction drives the smoothing of Williams and the statistic of
+Shirley's test, so both can take the output of this test directly.
+"""
+import numpy as np
+import warnings
+
+import cebspy.stats._distributions as dist
+import cebspy.stats.design as sd
+import cebspy.stats.ranking as rk
+
+__all__ = ['jonckheere_test']
+
+
+def _jonckheere(nested):
+    """
+    Jonckheere-Terpstra statistics from the ranks of the nested dose subsets
+
+    The Mann-Whitney count of dose group g against all lower groups is its
+    rank sum within groups 0..g minus n_g(n_g+1)/2, ties counting 1/2, so
+    the statistic comes out of the single sort of NestedRanks instead of
+    comparing every pair of values.
+    """
+    statistic = 0.0
+    for top, n_total, tie_sum, rank_sums, group_counts in nested.levels():
+        n_top = group_counts[top]
+        statistic += rank_sums[top] - n_top * (n_top + 1) / 2.0
+    t = nested.table.sum(axis=0).astype(float)   # tie group sizes
+    return _jonckheere_stats(statistic, nested.table.sum(axis=1),
+                             np.sum(t ** 2), np.sum(t ** 3))
+
+
+def _jonckheere_stats(statistic, group_sizes, t2, t3):
+    """
+    Jonckheere-Terpstra z, p value and tau from J, the dose group sizes and
+    the sums of squares (t2) and cubes (t3) of the tie group sizes
+    """
+    n = np.asarray(group_sizes, dtype=float)
+    N = n.sum()
+    ties1 = t2 - N                       # sum of t(t - 1)
+    ties2 = t3 - 3 * t2 + 2 * N          # sum of t(t - 1)(t - 2)
+    ties5 = 2 * t3 + 3 * t2 - 5 * N      # sum of t(t - 1)(2t + 5)
+    cross_pairs = (N ** 2 - np.sum(n ** 2)) / 2
+    expected = cross_pairs / 2
+    # variance with the correction for ties (Hollander and Wolfe)
+    variance = (N * (N - 1) * (2 * N + 5) - np.sum(n * (n - 1) * (2 * n + 5))
+                - ties5) / 72
+    # the tie terms are 0 when their denominators are (fewer than 3 values)
+    if N > 2:
+        variance += (np.sum(n * (n - 1) * (n - 2)) * ties2
+                     / (36 * N * (N - 1) * (N - 2)))
+    if N > 1:
+        variance += np.sum(n * (n - 1)) * ties1 / (8 * N * (N - 1))
+    z = (statistic - expected) / variance ** 0.5 if variance > 0 else 0.0
+    # Kendall's tau-b between dose and response from the same counts
+    pairs = N * (N - 1) / 2
+    tau_denom = ((pairs - np.sum(n * (n - 1)) / 2) * (pairs - ties1 / 2)) ** 0.5
+    tau = 2 * (statistic - expected) / tau_denom if tau_denom > 0 else 0.0
+    return {'statistic':float(statistic),
+            'expected':float(expected),
+            'variance':float(variance),
+            'z':float(z),
+            'p_value':float(2 * dist.norm_sf(abs(z))),
+            'tau':float(tau),
+            'direction':'decreasing' if z < 0 else 'increasing'}
+
+
+def jonckheere_test(doses, responses):
+    """
+    Jonckheere-Terpstra test for ordered alternatives
+
+    Tests for a monotone trend of the responses with increasing doses. The
+    values are sorted once and the concordant pairs between dose groups
+    are counted from mid-ranks, in O(n log n + k^2 u) for k dose groups
+    and u distinct values (the rank sums of the k nested subsets each walk
+    the k x u table of NestedRanks) instead of comparing all pairs, with
+    the normal approximation corrected for ties.
+
+    Parameters
+    ----------
+    doses : a list of float values as doses, or a StudyDesign
+
+    responses : a list of float values as responses
+
+    Returns
+    -------
+    The results dict with 'output' holding
+    statistic : the Jonckheere-Terpstra J (pairs in trend order, ties 1/2)
+    z : the standardized statistic, to be used as jonck_trend for Williams
+    p_value : two-sided p value of the normal approximation
+    tau : Kendall's tau-b between doses and responses, for shirley_test
+    direction : 'increasing' or 'decreasing'
+
+    References
+    ----------
+    .. [1] Hollander, M. and Wolfe, D. A. (1999) Nonparametric Statistical
+           Methods, 2nd ed., Wiley.
+
+    Examples
+    --------
+    >>> from cebspy.stats.jonckheere import jonckheere_test
+    >>> doses = [0, 0, 0, 10, 10, 10, 30, 30, 30]
+    >>> responses = [1.1, 1.3, 0.9, 1.4, 1.2, 1.6, 1.9, 1.5, 2.1]
+    >>> jonckheere_test(doses, responses)['output']['statistic']
+    25.0
+    """
+    results = {'method':"Jonckheere-Terpstra test",
+               'has_output':bool(0),
+               'has_errors':bool(0)}
+    warn_message = None
+    if (len(doses) == len(responses)):
+        design, responses = sd.complete_cases(doses, responses)
+        if (design.n_groups > 1):
+            nested = rk.NestedRanks(design.codes, responses, design.n_groups)
+            results.update({'is_finished':bool(1),
+                            'has_output':bool(1),
+                            'output':_jonckheere(nested)})
+        else:
+            warn_message = 'At least two dose groups are required'
+    else:
+        warn_message = 'The number of values betwee doses and responses are not equal'
+    if (warn_message is not None):
+        warnings.warn(warn_message)
+        results.update({'has_errors':bool(1),
+                        'warnings':[warn_message]})
+    return results
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+# permutation.py
+"""
+Permutation p values for Dunn's and Shirley's tests
+
+The responses are ranked once; permuting the dose labels leaves the ranks
+and the tie correction unchanged, so the statistics of a whole batch of
+permutations are a bincount of the ranks by (permutation, dose group)
+followed by array expressions. Monte Carlo runs stop early once every
+p value is confidently on one side of the 5% and 1% levels, and designs
+with few distinct labelings are enumerated exactly.
+"""
+import itertools
+import warnings
+
+import numpy as np
+
+import cebspy.stats._distributions as dist
+import cebspy.stats.design as sd
+import cebspy.stats.jonckheere as jt
+import cebspy.stats.ranking as rk
+from cebspy.stats.dunntest import dunn_test
+
+__all__ = ['ALPHA', 'SHIRLEY_ALPHA', 'permutation_p_values', 'dunn_permutation_test',
+           'shirley_permutation_test']
+
+## significance levels of mult_comp_signif 1 and 2 for the two-sided
+## max |z| of Dunn's test
+ALPHA = (0.05, 0.01)
+
+## one-sided levels of Shirley's step-down, as the C05 and C01 critical
+## values of shirleytest
+SHIRLEY_ALPHA = (0.025, 0.005)
+
+
+def _n_labelings(counts, limit):
+    """
+    Number of distinct assignments of the group labels, N! / prod(n_g!),
+    or limit + 1 as soon as it exceeds limit
+    """
+    total = 1
+    n = 0
+    for count in counts:
+        # total grows by the binomial C(n + count, count) one factor at a time
+        for i in range(1, int(count) + 1):
+            n += 1
+            total = total * n // i
+            if total > limit:
+                return limit + 1
+    return total
+
+
+def _labelings(counts):
+    """
+    All distinct assignments of the group labels as an int array
+    """
+    n = int(sum(counts))
+    rows = [np.full(n, len(counts) - 1)]
+    for group, count in enumerate(counts[:-1]):
+        expanded = []
+        for row in rows:
+            free = np.flatnonzero(row == len(counts) - 1)
+            for chosen in itertools.combinations(free, int(count)):
+                labels = row.copy()
+                labels[list(chosen)] = group
+                expanded.append(labels)
+        rows = expanded
+    return np.array(rows)
+
+
+def permutation_p_values(statistic, codes, observed, n_permutations=10000,
+                         batch_size=1000, max_exact=20000, confidence=0.999,
+                         seed=None, alpha=ALPHA):
+    """
+    Permutation p values of statistics of the group labels
+
+    Parameters
+    ----------
+    statistic : a function of an int array (permutations x n) of group
+        labels returning an array (permutations x q) of statistics, large
+        values against the null hypothesis
+
+    codes : int array of the observed group labels 0..k-1
+
+    observed : float array (q) of the observed statistics
+
+    n_permutations : maximum number of random permutations
+
+    batch_size : permutations evaluated at a time
+
+    max_exact : largest number of distinct labelings enumerated exactly
+
+    confidence : level of the interval of the Monte Carlo p values used to
+        stop early once it excludes alpha
+
+    seed : seed of the random generator
+
+    alpha : significance levels the p values are compared with
+
+    Returns
+    -------
+    (p_values, permutations, exact) with p_values as a float array (q)
+    """
+    codes = np.asarray(codes)
+    observed = np.atleast_1d(np.asarray(observed, dtype=float))
+    # statistics equal to the observed one up to rounding count as exceeding
+    threshold = observed - 1e-9 * np.maximum(np.abs(observed), 1)
+    counts = np.bincount(codes)
+    total = _n_labelings(counts, max_exact)
+    if total <= max_exact:
+        exceed = statistic(_labelings(counts)) >= threshold
+        return exceed.mean(axis=0), total, True
+    rng = np.random.default_rng(seed)
+    z = dist.norm_ppf(1 - (1 - confidence) / 2)
+    alpha = np.array(alpha)[:, None]
+    hits = np.zeros(len(observed))
+    done = 0
+    while done < n_permutations:
+        size = min(batch_size, n_permutations - done)
+        labels = rng.permuted(np.tile(codes, (size, 1)), axis=1)
+        hits += (statistic(labels) >= threshold).sum(axis=0)
+        done += size
+        p_values = (hits + 1) / (done + 1)
+        half = z * np.sqrt(p_values * (1 - p_values) / done)
+        if not ((p_values - half < alpha) & (alpha < p_values + half)).any():
+            break
+    return (hits + 1) / (done + 1), done, False
+
+
+def _signif(p_value, alpha=ALPHA):
+    return 2 if p_value < alpha[1] else (1 if p_value < alpha[0] else 0)
+
+
+def _rank_sums(labels, ranks, k):
+    """
+    Rank sums (permutations x k) of a batch of label assignments
+    """
+    batch = len(labels)
+    index = labels + k * np.arange(batch)[:, None]
+    return np.bincount(index.ravel(), weights=np.tile(ranks, batch),
+                       minlength=batch * k).reshape(batch, k)
+
+
+def dunn_permutation_test(doses, responses, n_permutations=10000, batch_size=1000,
+                          max_exact=20000, confidence=0.999, seed=None):
+    """
+    Dunn's test with permutation p values
+
+    Each dose group is compared with control by Dunn's z statistic; its p
+    value is the permutation probability of the largest z over all dose
+    groups reaching it (single-step max-T), which controls the familywise
+    error like the Bonferroni critical values of dunn_test.
+
+    Parameters
+    ----------
+    doses, responses : as dunn_test
+
+    n_permutations, batch_size, max_exact, confidence, seed : as
+        permutation_p_values
+
+    Returns
+    -------
+    The results dict of dunn_test with 'mult_comp_signif' from the
+    permutation p values and 'p_value' per dose (NaN for control),
+    'permutations' and 'exact' added to 'output'
+    """
+    results = dunn_test(doses, responses)
+    if not results['has_output']:
+        return results
+    design, responses = sd.complete_cases(doses, responses)
+    ranks, ties, tie_sum = rk.rank_data(responses)
+    counts = design.counts
+    k, n = len(counts), len(responses)
+    se = np.sqrt((n * (n + 1)) / 12 * (1 / counts[1:] + 1 / counts[0])
+                 * (1 - tie_sum / (n ** 3 - n)))
+
+    def z_scores(labels):
+        means = _rank_sums(labels, ranks, k) / counts
+        return np.abs(means[:, 1:] - means[:, :1]) / se
+
+    def max_z(labels):
+        return np.repeat(z_scores(labels).max(axis=1)[:, None], k - 1, axis=1)
+
+    observed = z_scores(design.codes[None, :])[0]
+    p_values, done, exact = permutation_p_values(
+            max_z, design.codes, observed, n_permutations, batch_size, max_exact,
+            confidence, seed)
+    output = results['output']
+    output['p_value'] = [float('nan')] + p_values.tolist()
+    output['mult_comp_signif'] = [0] + [_signif(p) for p in p_values]
+    output['permutations'] = int(done)
+    output['exact'] = bool(exact)
+    results['method'] = "Dunn's test (permutation)"
+    return results
+
+
+def _shirley_statistic(ranks, counts, tie_sum, tau):
+    """
+    Shirley statistic of the top dose as a function of a batch of labels
+    of the dose groups 0..top, from the fixed ranks of the subset
+    """
+    top = len(counts) - 1
+    n_total = counts.sum()
+    V = (n_total * (n_total + 1)) / 12 - tie_sum / (12 * (n_total - 1))
+    scale = (V * (1 / counts[top] + 1 / counts[0])) ** -0.5
+    pooled = np.cumsum(counts[:0:-1])[::-1]
+
+    def statistic(labels):
+        sums = _rank_sums(labels, ranks, top + 1)
+        # mean ranks pooled from the top dose down to each treatment group
+        trt_means = np.cumsum(sums[:, :0:-1], axis=1)[:, ::-1] / pooled
+        zero_mean = sums[:, 0] / counts[0]
+        if tau >= 0:
+            return ((trt_means.max(axis=1) - zero_mean) * scale)[:, None]
+        return ((zero_mean - trt_means.min(axis=1)) * scale)[:, None]
+    return statistic
+
+
+def shirley_permutation_test(doses, responses, tau=None, n_permutations=10000,
+                             batch_size=1000, max_exact=20000, confidence=0.999,
+                             seed=None):
+    """
+    Shirley's test with permutation p values
+
+    Step-down from the top dose as in shirley_test: at each step the
+    labels of the dose groups 0..top are permuted and the p value of the
+    Shirley statistic replaces the critical values. The statistic is
+    one-sided, so the p values are compared with SHIRLEY_ALPHA (the
+    one-sided levels of the C05 and C01 values). Permutations stop at the
+    first dose that is not significant, the lower doses get None as in
+    shirley_test.
+
+    Parameters
+    ----------
+    doses, responses, tau : as shirley_test
+
+    n_permutations, batch_size, max_exact, confidence, seed : as
+        permutation_p_values
+
+    Returns
+    -------
+    The results dict of shirley_test with 'p_value' per dose,
+    'permutations' (per tested dose) and 'exact' added to 'output'
+    """
+    results = {'method':"Shirley's test (permutation)",
+               'has_output':bool(0),
+               'has_errors':bool(0)}
+    if len(doses) != len(responses):
+        return results
+    design, responses = sd.complete_cases(doses, responses)
+    dose_groups = design.levels
+    if not (len(dose_groups) > 1 and 0 in dose_groups):
+        warn_message = 'Either no enough treatment groups or the control group is missing'
+        warnings.warn(warn_message)
+        results.update({'has_errors':bool(1), 'warnings':[warn_message]})
+        return results
+    if tau is None:
+        tau = jt._jonckheere(rk.NestedRanks(design.codes, responses,
+                                            len(dose_groups)))['tau']
+    # distinct values once, the ranks of each subset follow from counts
+    value_ids = np.unique(responses, return_inverse=True)[1].ravel()
+    n_values = int(value_ids.max()) + 1
+    test_doses, test_stats, p_values, signif, permutations = [], [], [], [], []
+    exact = True
+    testing = True
+    for top in range(len(dose_groups) - 1, 0, -1):
+        keep = design.codes <= top
+        codes, ids = design.codes[keep], value_ids[keep]
+        value_counts = np.bincount(ids, minlength=n_values).astype(float)
+        ranks = (np.cumsum(value_counts) - (value_counts - 1) / 2.0)[ids]
+        statistic = _shirley_statistic(ranks, np.bincount(codes, minlength=top + 1),
+                                       float(np.sum(value_counts ** 3 - value_counts)),
+                                       tau)
+        observed = statistic(codes[None, :])[0]
+        test_doses.append(dose_groups[top])
+        test_stats.append(float(observed[0]))
+        if testing:
+            p_value, done, step_exact = permutation_p_values(
+                    statistic, codes, observed, n_permutations, batch_size,
+                    max_exact, confidence, seed, SHIRLEY_ALPHA)
+            p_values.append(float(p_value[0]))
+            signif.append(_signif(p_value[0], SHIRLEY_ALPHA))
+            permutations.append(int(done))
+            exact = exact and step_exact
+            testing = signif[-1] > 0
+        else:
+            p_values.append(None)
+            signif.append(None)
+    results.update({'is_finished':bool(1),
+                    'has_output':bool(1),
+                    'output':{'dose':test_doses,
+                              'shirleyStats':test_stats,
+                              'p_value':p_values,
+                              'mult_comp_signif':signif,
+                              'permutations':permutations,
+                              'exact':bool(exact)}})
+    return results
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+# pipeline.py
+"""
+CEBS dose-response decision pipeline over the endpoints of a study
+
+Per endpoint: Jonckheere-Terpstra trend test, then Williams (parametric) or
+Shirley (nonparametric) when the trend is significant, otherwise Dunn's
+test. Endpoint chunks are spread over a process pool.
+"""
+import contextlib
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import cebspy.stats._arrays as arr
+import cebspy.stats.design as sd
+import cebspy.stats.jonckheere as jt
+import cebspy.stats.profiling as prof
+from cebspy.stats.cache import ResultCache
+from cebspy.stats.dunntest import dunn_test
+from cebspy.stats.results import ResultTable
+from cebspy.stats.shirleytest import shirley_test
+from cebspy.stats.Williams import Williams
+
+__all__ = ['analyze_endpoint', 'run_study']
+
+
+def analyze_endpoint(doses, responses, parametric=False, trend_alpha=0.01):
+    """
+    Run the trend / pairwise decision tree for one endpoint
+
+    Parameters
+    ----------
+    doses : a list or array of float values as doses, 0 as control, or a
+        StudyDesign
+
+    responses : a list or array of float values as responses, NaN values
+        are dropped
+
+    parametric : a logical, Williams (True) or Shirley (False) after a
+        significant trend
+
+    trend_alpha : significance level of the Jonckheere-Terpstra test
+
+    Returns
+    -------
+    A dict with 'trend' as the Jonckheere-Terpstra results and 'test' as the
+    results of the Williams, Shirley or Dunn test that was run
+    """
+    design, responses = sd.complete_cases(doses, responses)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        trend = jt.jonckheere_test(design, responses)
+        test = None
+        if trend['has_output'] and trend['output']['p_value'] < trend_alpha:
+            if parametric:
+                test = Williams(design, responses, trend['output']['z'])
+            else:
+                test = shirley_test(design, responses, trend['output']['tau'])
+        if test is None or test['has_errors']:
+            ## no trend, or the trend test could not be run: Dunn's test
+            test = dunn_test(design, responses)
+    return {'trend':trend, 'test':test}
+
+
+def _run_chunk(endpoints, key_names, parametric, trend_alpha, profiled=False,
+               cache_path=None):
+    """
+    Analyze a list of (key, doses, responses) endpoints into a ResultTable
+
+    Endpoints with the same dose vector share one StudyDesign; an endpoint
+    raising an error gets one 'analyze_endpoint' row with the error message
+    as warning. Returns the table and, when profiled, the Profile of the
+    chunk (else None).
+    """
+    table = ResultTable(key_names)
+    profile = prof.Profile() if profiled else None
+    analyze = analyze_endpoint
+    if cache_path is not None:
+        cache = ResultCache(memory_bytes=0, path=cache_path)
+        analyze = cache.wrap(analyze_endpoint)
+    designs = {}
+    with profile or contextlib.nullcontext():
+        for key, doses, responses in endpoints:
+            design = designs.get(doses.tobytes())
+            if design is None:
+                design = designs[doses.tobytes()] = sd.StudyDesign(doses)
+            try:
+                results = analyze(design, responses, parametric=parametric,
+                                  trend_alpha=trend_alpha)
+            except Exception as e:
+                ## one failing endpoint gets an error row instead of
+                ## stopping the study, as cli.run_batch does
+                table.append(key, 'analyze_endpoint', np.nan,
+                             warnings='%s: %s' % (type(e).__name__, e))
+                continue
+            table.append_results(key, results['trend'])
+            table.append_results(key, results['test'])
+    if cache_path is not None:
+        cache.close()
+    return table, profile
+
+
+def _chunks(df, group_keys, dose_col, response_col, chunk_size):
+    """
+    Split the study table into lists of chunk_size endpoints
+    """
+    data = df.sort_values(group_keys, kind='mergesort')
+    endpoint = data.groupby(group_keys, sort=False).ngroup().to_numpy()
+    starts = np.flatnonzero(np.r_[True, endpoint[1:] != endpoint[:-1]])
+    ends = np.r_[starts[1:], len(endpoint)]
+    # whole columns once, each endpoint is a slice (view) of them
+    doses = arr.as_float_array(data[dose_col])
+    responses = arr.as_float_array(data[response_col])
+    keys = data[group_keys].iloc[starts].itertuples(index=False, name=None)
+    chunk = []
+    for key, start, end in zip(keys, starts, ends):
+        chunk.append((key, doses[start:end], responses[start:end]))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def run_study(df, group_keys, dose_col, response_col, parametric=False,
+              trend_alpha=0.01, chunk_size=500, max_workers=None, as_frame=True,
+              profile=None, cache_path=None):
+    """
+    Run the dose-response decision tree for every endpoint of a study
+
+    Parameters
+    ----------
+    df : a long-format pandas DataFrame with one row per animal and endpoint
+
+    group_keys : a list of column names identifying an endpoint (e.g. sex,
+        endpoint, selection, litter_name, phase_type, phase_time,
+        time_in_study)
+
+    dose_col : column name of the doses, 0 as control
+
+    response_col : column name of the responses
+
+    parametric : a logical, Williams (True) or Shirley (False) after a
+        significant trend
+
+    trend_alpha : significance level of the Jonckheere-Terpstra test
+
+    chunk_size : number of endpoints sent to a worker at a time
+
+    max_workers : number of worker processes, None for all cores, 1 to run
+        in the calling process
+
+    as_frame : a logical, return a DataFrame (True) or the ResultTable
+
+    profile : a profiling.Profile, optional, receiving the merged stage
+        timings of all workers
+
+    cache_path : path of a SQLite ResultCache file, optional; endpoints
+        whose doses and responses did not change since a previous run are
+        read from it instead of being tested again
+
+    Returns
+    -------
+    The ResultTable of all endpoints, or its DataFrame: per endpoint one
+    Jonckheere-Terpstra row (z as statistic) and the dose rows of the
+    Williams, Shirley or Dunn test, or one 'analyze_endpoint' row with the
+    error message as warning for an endpoint raising an error
+
+    Examples
+    --------
+    >>> from cebspy.stats.pipeline import run_study
+    >>> results = run_study(study, ['sex', 'endpoint'], 'dose', 'response',
+    ...                     chunk_size=200, max_workers=8)
+    """
+    group_keys = list(group_keys)
+    chunks = _chunks(df, group_keys, dose_col, response_col, chunk_size)
+    table = ResultTable(group_keys)
+    profiled = profile is not None
+
+    def collect(part):
+        part_table, part_profile = part
+        table.extend(part_table)
+        if profiled:
+            profile.merge(part_profile)
+
+    if max_workers == 1:
+        for chunk in chunks:
+            collect(_run_chunk(chunk, group_keys, parametric, trend_alpha,
+                               profiled, cache_path))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(_run_chunk, chunk, group_keys, parametric,
+                                       trend_alpha, profiled, cache_path)
+                       for chunk in chunks]
+            for future in futures:
+                collect(future.result())
+    return table.to_frame() if as_frame else table
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+# profiling.py
+"""
+Opt-in per-stage instrumentation of the CEBS tests
+
+Williams, shirley_test, dunn_test and dixon report the timing and size of
+their internal stages (ranking, smoothing, MSE, critical-table loading and
+lookup, ...) and the code paths they took (exact or interpolated dof
+lookup, table-limit fallback, ...) to the registered hooks. With no hook
+registered a stage costs one function call and a shared no-op context.
+"""
+import contextlib
+import time
+
+__all__ = ['Profile', 'add_hook', 'remove_hook', 'stage', 'path', 'enabled']
+
+## callables receiving the event dicts, empty when profiling is off
+_hooks = []
+
+_NULL = contextlib.nullcontext()
+
+
+def enabled():
+    return bool(_hooks)
+
+
+def add_hook(hook):
+    """
+    Register a callable receiving every event as a dict
+
+    Stage events are {'event': 'stage', 'test', 'stage', 'seconds', 'size'},
+    path events are {'event': 'path', 'test', 'stage', 'path', 'count'}.
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+def _emit(event):
+    for hook in list(_hooks):
+        hook(event)
+
+
+class _Stage(object):
+    __slots__ = ('test', 'name', 'size', 'start')
+
+    def __init__(self, test, name, size):
+        self.test, self.name, self.size = test, name, size
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        _emit({'event':'stage', 'test':self.test, 'stage':self.name,
+               'seconds':time.perf_counter() - self.start, 'size':self.size})
+        return False
+
+
+def stage(test, name, size=None):
+    """
+    Context timing one stage of a test, a shared no-op when profiling is off
+
+    Examples
+    --------
+    >>> with prof.stage('dunn', 'ranking', len(responses)):
+    ...     ranks, ties, correction = rk.rank_data(responses)
+    """
+    if not _hooks:
+        return _NULL
+    return _Stage(test, name, size)
+
+
+def path(test, name, value, count=1):
+    """
+    Report that a stage took the code path value (count times)
+    """
+    if _hooks and count:
+        _emit({'event':'path', 'test':test, 'stage':name, 'path':value,
+               'count':int(count)})
+
+
+class Profile(object):
+    """
+    Aggregated stage timings and code path counts
+
+    Used as a context manager it collects the events of the tests run in
+    its block. Profiles are plain picklable data, so worker processes can
+    return theirs to be merged.
+
+    Attributes
+    ----------
+    stages : dict of (test, stage) -> [calls, seconds, total size]
+    paths : dict of (test, stage, path) -> count
+
+    Examples
+    --------
+    >>> from cebspy.stats.profiling import Profile
+    >>> with Profile() as profile:
+    ...     results = Williams(doses, responses)
+    >>> for row in profile.summary():
+    ...     print(row)
+    """
+    def __init__(self):
+        self.stages = {}
+        self.paths = {}
+
+    def __call__(self, event):
+        if event['event'] == 'stage':
+            record = self.stages.setdefault((event['test'], event['stage']), [0, 0.0, 0])
+            record[0] += 1
+            record[1] += event['seconds']
+            record[2] += event['size'] or 0
+        else:
+            key = (event['test'], event['stage'], event['path'])
+            self.paths[key] = self.paths.get(key, 0) + event['count']
+
+    def __enter__(self):
+        add_hook(self)
+        return self
+
+    def __exit__(self, *exc):
+        remove_hook(self)
+        return False
+
+    def merge(self, other):
+        """
+        Add the counts and timings of another Profile, returns self
+        """
+        for key, (calls, seconds, size) in other.stages.items():
+            record = self.stages.setdefault(key, [0, 0.0, 0])
+            record[0] += calls
+            record[1] += seconds
+            record[2] += size
+        for key, count in other.paths.items():
+            self.paths[key] = self.paths.get(key, 0) + count
+        return self
+
+    def summary(self):
+        """
+        List of dicts with 'test', 'stage', 'calls', 'seconds' and 'size' of
+        every stage, slowest first, and 'paths' as the counts of its paths
+        """
+        rows = []
+        for (test, name), (calls, seconds, size) in self.stages.items():
+            rows.append({'test':test, 'stage':name, 'calls':calls,
+                         'seconds':seconds, 'size':size, 'paths':{}})
+        by_stage = {(row['test'], row['stage']):row for row in rows}
+        for (test, name, value), count in self.paths.items():
+            row = by_stage.get((test, name))
+            if row is None:
+                row = by_stage[(test, name)] = {'test':test, 'stage':name, 'calls':0,
+                                                'seconds':0.0, 'size':0, 'paths':{}}
+                rows.append(row)
+            row['paths'][value] = count
+        return sorted(rows, key=lambda row: -row['seconds'])
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# ranking.py
+"""
+Mid-rank computations shared by the rank-based CEBS tests
+
+The responses are sorted once; ranks, tie corrections and per-dose rank
+sums are then derived from counts per distinct value.
+"""
+import numpy as np
+
+import cebspy.stats._arrays as arr
+
+__all__ = ['rank_data', 'rank_columns', 'NestedRanks']
+
+
+def rank_data(values):
+    """
+    Mid-ranks of the values with the tie information
+
+    Parameters
+    ----------
+    values : a list or array of float values
+
+    Returns
+    -------
+    ranks : float array of mid-ranks (ties get the average rank)
+    ties : int array of the size of the tie group of each value
+    tie_sum : float as the sum of (t**3 - t) over the tie groups
+    """
+    values = arr.as_float_array(values)
+    uniques, inverse, counts = np.unique(values, return_inverse=True,
+                                         return_counts=True)
+    inverse = inverse.ravel()
+    midranks = np.cumsum(counts) - (counts - 1) / 2.0
+    tie_sum = float(np.sum(counts.astype(float) ** 3 - counts))
+    return midranks[inverse], counts[inverse], tie_sum
+
+
+def rank_columns(values):
+    """
+    Mid-ranks of every column of a 2-D array in one call
+
+    Parameters
+    ----------
+    values : a 2-D float array with one endpoint per column
+
+    Returns
+    -------
+    ranks : float array of the same shape with the mid-ranks per column
+    tie_sum : float array with the sum of (t**3 - t) over the tie groups of
+        each column
+    """
+    values = np.asarray(values, dtype=float)
+    n = values.shape[0]
+    order = np.argsort(values, axis=0, kind='mergesort')
+    sorted_values = np.take_along_axis(values, order, axis=0)
+    position = np.arange(n)[:, None]
+    new = np.ones(values.shape, dtype=bool)
+    new[1:] = sorted_values[1:] != sorted_values[:-1]
+    last = np.ones(values.shape, dtype=bool)
+    last[:-1] = new[1:]
+    # first and last sorted position of the tie group of each element
+    start = np.maximum.accumulate(np.where(new, position, 0), axis=0)
+    end = np.minimum.accumulate(np.where(last, position, n - 1)[::-1], axis=0)[::-1]
+    ties = end - start + 1
+    ranks = np.empty(values.shape)
+    np.put_along_axis(ranks, order, (start + end) / 2.0 + 1, axis=0)
+    # each element of a tie group of size t adds t**2 - 1, i.e. t**3 - t per group
+    tie_sum = np.sum(ties.astype(float) ** 2 - 1, axis=0)
+    return ranks, tie_sum
+
+
+class NestedRanks(object):
+    """
+    Ranks of the nested dose subsets 0..g used by Shirley's test
+
+    The responses are sorted once and summarized as a table of counts per
+    (dose group, distinct value). The ranks of a subset of dose groups then
+    only depend on the column sums of the table, so dropping the top dose
+    group is a subtraction of one row instead of a re-ranking.
+
+    Parameters
+    ----------
+    codes : int array of dose group indexes 0..k-1 (0 as control)
+
+    values : float array of the responses
+
+    n_groups : int as the number of dose groups k, optional
+
+    Examples
+    --------
+    >>> from cebspy.stats.ranking import NestedRanks
+    >>> nested = NestedRanks([0, 0, 1, 1, 2, 2], [1.0, 2.0, 2.0, 3.0, 5.0, 4.0])
+    >>> for top, n_total, tie_sum, rank_sums, counts in nested.levels():
+    ...     print(top, rank_sums)
+    2 [ 3.5  6.5 11. ]
+    1 [3.5 6.5]
+    """
+    def __init__(self, codes, values, n_groups=None):
+        codes = np.asarray(codes, dtype=int)
+        values = arr.as_float_array(values)
+        k = int(codes.max()) + 1 if n_groups is None else n_groups
+        order = np.argsort(values, kind='mergesort')
+        sorted_values = values[order]
+        distinct = np.r_[True, sorted_values[1:] != sorted_values[:-1]]
+        value_ids = np.empty(len(values), dtype=int)
+        value_ids[order] = np.cumsum(distinct) - 1
+        n_values = int(distinct.sum())
+        self.n_groups = k
+        self.table = np.bincount(codes * n_values + value_ids,
+                                 minlength=k * n_values).reshape(k, n_values)
+
+    def ranks(self, counts):
+        """
+        Mid-rank of each distinct value given its counts in a subset
+        """
+        return np.cumsum(counts) - (counts - 1) / 2.0
+
+    def levels(self):
+        """
+        Iterate over the subsets from all dose groups down to control + 1,
+        O(k u) per subset for the k x u table of counts
+
+        Yields
+        ------
+        (top, n_total, tie_sum, rank_sums, group_counts) with top as the
+        highest dose group kept, rank_sums and group_counts per dose group
+        0..top
+        """
+        counts = self.table.sum(axis=0)
+        for top in range(self.n_groups - 1, 0, -1):
+            midranks = self.ranks(counts)
+            rank_sums = self.table[:top + 1].dot(midranks)
+            group_counts = self.table[:top + 1].sum(axis=1)
+            tie_sum = float(np.sum(counts.astype(float) ** 3 - counts))
+            yield top, int(counts.sum()), tie_sum, rank_sums, group_counts
+            counts = counts - self.table[top]
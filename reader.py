@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+# reader.py
+"""
+Out-of-core reader streaming the endpoints of large study extracts
+
+CSV and Parquet files sorted by the endpoint keys are read in chunks and
+handed to the tests one endpoint (or a small batch of endpoints) at a
+time, so the peak memory is bounded by a chunk plus the largest endpoint
+instead of the whole archive.
+"""
+import warnings
+
+import numpy as np
+import pandas as pd
+
+import cebspy.stats._arrays as arr
+import cebspy.stats.design as sd
+from cebspy.stats.dixon import dixon
+from cebspy.stats.dunntest import dunn_test
+from cebspy.stats.shirleytest import shirley_test
+from cebspy.stats.ttest import t_test
+from cebspy.stats.Williams import Williams
+
+__all__ = ['TESTS', 'iter_endpoints', 'iter_endpoint_batches', 'stream_tests']
+
+
+def _dixon_by_dose(design, responses):
+    """
+    Dixon's outlier test within each dose group
+    """
+    statistics, p_values, alternatives = [], [], []
+    for i in range(design.n_groups):
+        test = dixon(responses[design.codes == i])
+        if isinstance(test, dict):
+            statistics.append(test['statistic'][1])
+            p_values.append(test['p.value'])
+            alternatives.append(test['alternative'])
+        else:   # message for a sample size out of the tables
+            statistics.append(np.nan)
+            p_values.append(np.nan)
+            alternatives.append(test)
+    return {'method':"Dixon test for outliers",
+            'is_finished':bool(1),
+            'has_output':bool(1),
+            'has_errors':bool(0),
+            'output':{'dose':design.levels.tolist(),
+                      'statistic':statistics,
+                      'p_value':p_values,
+                      'alternative':alternatives}}
+
+
+def _t_test_by_dose(design, responses):
+    """
+    Two samples t-test of each treatment group against control
+    """
+    results = {'method':'T-test', 'has_output':bool(0), 'has_errors':bool(0)}
+    if design.control is None:
+        results.update({'has_errors':bool(1),
+                        'warnings':['The control group (dose = 0) is missing']})
+        return results
+    control = responses[design.codes == design.control]
+    doses, t, p_values = [], [], []
+    for i in range(design.n_groups):
+        if i != design.control:
+            test = t_test(control, responses[design.codes == i])
+            output = test.get('output', {})
+            doses.append(design.levels[i])
+            t.append(output.get('t', np.nan))
+            p_values.append(output.get('p_value', np.nan))
+    results.update({'is_finished':bool(1),
+                    'has_output':bool(1),
+                    'output':{'dose':doses, 't':t, 'p_value':p_values}})
+    return results
+
+
+def _williams(design, responses):
+    return Williams(design, responses)
+
+
+## tests run per endpoint, called as test(design, responses)
+TESTS = {'williams':_williams,
+         'shirley':shirley_test,
+         'dunn':dunn_test,
+         'dixon':_dixon_by_dose,
+         't_test':_t_test_by_dose}
+
+
+def _read_chunks(path, columns, chunksize):
+    """
+    DataFrames of at most chunksize rows from a CSV or Parquet file
+    """
+    if str(path).lower().endswith(('.parquet', '.pq')):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize,
+                                                       columns=columns):
+            yield batch.to_pandas()
+    else:
+        for chunk in pd.read_csv(path, usecols=columns, chunksize=chunksize):
+            yield chunk
+
+
+def iter_endpoints(path, group_keys, dose_col, response_col, chunksize=100000):
+    """
+    Stream the endpoints of a study file sorted by the endpoint keys
+
+    Parameters
+    ----------
+    path : path of a CSV file, or a Parquet file (.parquet or .pq), with the
+        rows of an endpoint next to each other
+
+    group_keys : a list of column names identifying an endpoint
+
+    dose_col : column name of the doses
+
+    response_col : column name of the responses
+
+    chunksize : number of rows read at a time
+
+    Yields
+    ------
+    (key, doses, responses) with key as a tuple of the group key values and
+    doses and responses as float64 views into the current chunk
+
+    Examples
+    --------
+    >>> from cebspy.stats.reader import iter_endpoints
+    >>> from cebspy.stats.dunntest import dunn_test
+    >>> for key, doses, responses in iter_endpoints('study.parquet',
+    ...         ['sex', 'endpoint'], 'dose', 'response'):
+    ...     results = dunn_test(doses, responses)
+    """
+    group_keys = list(group_keys)
+    pending = None   # rows of the last endpoint of a chunk, it may continue
+    finished = set()
+    for chunk in _read_chunks(path, group_keys + [dose_col, response_col], chunksize):
+        if pending is not None:
+            chunk = pd.concat([pending, chunk], ignore_index=True)
+        endpoint = chunk.groupby(group_keys, sort=False, dropna=False).ngroup().to_numpy()
+        starts = np.flatnonzero(np.r_[True, endpoint[1:] != endpoint[:-1]])
+        if len(starts) != endpoint.max() + 1:
+            raise ValueError('The study file is not sorted by %s' % ', '.join(group_keys))
+        ends = np.r_[starts[1:], len(endpoint)]
+        doses = arr.as_float_array(chunk[dose_col])
+        responses = arr.as_float_array(chunk[response_col])
+        keys = list(chunk[group_keys].iloc[starts].itertuples(index=False, name=None))
+        for key, start, end in zip(keys[:-1], starts[:-1], ends[:-1]):
+            if key in finished:
+                raise ValueError('The study file is not sorted by %s' % ', '.join(group_keys))
+            finished.add(key)
+            yield key, doses[start:end], responses[start:end]
+        pending = chunk.iloc[starts[-1]:]
+    if pending is not None and len(pending) > 0:
+        key = next(pending[group_keys].itertuples(index=False, name=None))
+        if key in finished:
+            raise ValueError('The study file is not sorted by %s' % ', '.join(group_keys))
+        yield (key, arr.as_float_array(pending[dose_col]),
+               arr.as_float_array(pending[response_col]))
+
+
+def iter_endpoint_batches(path, group_keys, dose_col, response_col,
+                          batch_size=100, chunksize=100000):
+    """
+    Stream lists of up to batch_size (key, doses, responses) endpoints
+    """
+    batch = []
+    for endpoint in iter_endpoints(path, group_keys, dose_col, response_col,
+                                   chunksize):
+        batch.append(endpoint)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def stream_tests(path, group_keys, dose_col, response_col, tests=('dunn',),
+                 chunksize=100000):
+    """
+    Run tests on every endpoint of a study file as it is read
+
+    Parameters
+    ----------
+    path, group_keys, dose_col, response_col, chunksize : as iter_endpoints
+
+    tests : names of the tests from TESTS: 'williams', 'shirley', 'dunn',
+        'dixon' (per dose group) and 't_test' (each dose against control)
+
+    Yields
+    ------
+    (key, results) with results as a dict of the results per test name
+    """
+    unknown = set(tests) - set(TESTS)
+    if unknown:
+        raise ValueError('Unknown tests: %s' % ', '.join(sorted(unknown)))
+    for key, doses, responses in iter_endpoints(path, group_keys, dose_col,
+                                                response_col, chunksize):
+        design, responses = sd.complete_cases(doses, responses)
+        results = {}
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            for name in tests:
+                results[name] = TESTS[name](design, responses)
+        yield key, results
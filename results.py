@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+# results.py
+"""
+Columnar result table for many endpoints and tests
+
+Batch and pipeline runs append their rows to typed NumPy columns instead
+of collecting one nested dict per test call, and the table is written to
+Parquet or Feather in one bulk operation.
+"""
+import numpy as np
+
+__all__ = ['ResultTable']
+
+## result keys holding the test statistic, by test; z comes before statistic
+## so the Jonckheere-Terpstra row holds z rather than J
+_STATISTICS = ('willStats', 'shirleyStats', 'z', 'statistic', 't')
+
+
+class ResultTable(object):
+    """
+    Typed, growable columns of test results
+
+    Each row is one endpoint, test and dose with the columns: the endpoint
+    key columns, 'method', 'dose', 'statistic', 'p_value', 'crit05',
+    'crit01', 'mult_comp_signif' (-1 when not available) and 'warnings'.
+    Endpoint keys, methods and warnings are stored as integer codes into
+    lists of distinct values.
+
+    Parameters
+    ----------
+    key_names : a list of the endpoint key column names
+
+    Examples
+    --------
+    >>> from cebspy.stats.results import ResultTable
+    >>> table = ResultTable(['sex', 'endpoint'])
+    >>> table.append_results(('M', 'BODY WT'), dunn_test(doses, responses))
+    >>> table.write('results.parquet')
+    """
+    FLOATS = ('dose', 'statistic', 'p_value', 'crit05', 'crit01')
+    CODES = ('endpoint', 'method', 'warnings')
+
+    def __init__(self, key_names, capacity=1024):
+        self.key_names = list(key_names)
+        self.keys = []
+        self.methods = []
+        self.messages = ['']
+        self._key_codes = {}
+        self._method_codes = {}
+        self._message_codes = {'': 0}
+        self._size = 0
+        self._columns = {}
+        for name in self.FLOATS:
+            self._columns[name] = np.empty(capacity)
+        for name in self.CODES:
+            self._columns[name] = np.empty(capacity, dtype=np.int32)
+        self._columns['mult_comp_signif'] = np.empty(capacity, dtype=np.int8)
+
+    def __len__(self):
+        return self._size
+
+    def _reserve(self, n):
+        capacity = len(self._columns['dose'])
+        if self._size + n > capacity:
+            capacity = max(2 * capacity, self._size + n)
+            for name, column in self._columns.items():
+                grown = np.empty(capacity, dtype=column.dtype)
+                grown[:self._size] = column[:self._size]
+                self._columns[name] = grown
+
+    @staticmethod
+    def _code(value, codes, values):
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(values)
+            values.append(value)
+        return code
+
+    def append(self, key, method, dose, statistic=np.nan, p_value=np.nan,
+               crit05=np.nan, crit01=np.nan, mult_comp_signif=-1, warnings=''):
+        """
+        Append the rows of one endpoint and test
+
+        dose and the numeric columns are scalars or arrays of the same length,
+        key is the tuple of endpoint key values.
+        """
+        dose = np.atleast_1d(np.asarray(dose, dtype=float))
+        n = len(dose)
+        self._reserve(n)
+        rows = slice(self._size, self._size + n)
+        columns = self._columns
+        columns['endpoint'][rows] = self._code(tuple(key), self._key_codes, self.keys)
+        columns['method'][rows] = self._code(method, self._method_codes, self.methods)
+        columns['warnings'][rows] = self._code(warnings, self._message_codes, self.messages)
+        columns['dose'][rows] = dose
+        columns['statistic'][rows] = statistic
+        columns['p_value'][rows] = p_value
+        columns['crit05'][rows] = crit05
+        columns['crit01'][rows] = crit01
+        columns['mult_comp_signif'][rows] = mult_comp_signif
+        self._size += n
+
+    def append_many(self, keys, method, dose, **values):
+        """
+        Append rows of several endpoints, keys being one key tuple per row
+        """
+        keys = list(keys)
+        dose = np.asarray(dose, dtype=float)
+        start = self._size
+        self.append(keys[0] if keys else (), method, dose, **values)
+        self._columns['endpoint'][start:self._size] = [
+                self._code(tuple(key), self._key_codes, self.keys) for key in keys]
+
+    def append_results(self, key, results):
+        """
+        Append the results dict of a test (Williams, Shirley, Dunn, t-test,
+        Dixon or Jonckheere-Terpstra) for one endpoint
+        """
+        method = results.get('method', '')
+        warnings = '; '.join(results.get('warnings', []))
+        if not results.get('has_output'):
+            self.append(key, method, np.nan, warnings=warnings)
+            return
+        output = results['output']
+        values = {'warnings':warnings}
+        for name in _STATISTICS:
+            if name in output:
+                values['statistic'] = np.asarray(output[name], dtype=float)
+                break
+        for name in ('p_value', 'crit05', 'crit01'):
+            if name in output:
+                values[name] = np.asarray(output[name], dtype=float)
+        if 'mult_comp_signif' in output:
+            values['mult_comp_signif'] = [-1 if s is None else s
+                                          for s in output['mult_comp_signif']]
+        dose = output.get('x', output.get('dose', np.nan))
+        self.append(key, method, dose, **values)
+
+    def extend(self, other):
+        """
+        Append all rows of another table, e.g. from a worker process
+        """
+        n = len(other)
+        self._reserve(n)
+        rows = slice(self._size, self._size + n)
+        for name in self.FLOATS + ('mult_comp_signif',):
+            self._columns[name][rows] = other._columns[name][:n]
+        for name, codes, values, other_values in (
+                ('endpoint', self._key_codes, self.keys, other.keys),
+                ('method', self._method_codes, self.methods, other.methods),
+                ('warnings', self._message_codes, self.messages, other.messages)):
+            remap = np.array([self._code(v, codes, values) for v in other_values],
+                             dtype=np.int32)
+            if n:
+                self._columns[name][rows] = remap[other._columns[name][:n]]
+        self._size += n
+
+    def column(self, name):
+        """
+        Column as an array view, codes for 'endpoint', 'method', 'warnings'
+        """
+        return self._columns[name][:self._size]
+
+    def to_frame(self):
+        """
+        The table as a pandas DataFrame
+        """
+        import pandas as pd
+        frame = {}
+        endpoint = self.column('endpoint')
+        for i, name in enumerate(self.key_names):
+            values = pd.Series([key[i] for key in self.keys], dtype=object)
+            frame[name] = values.infer_objects().to_numpy()[endpoint]
+        frame['method'] = pd.Categorical.from_codes(self.column('method'),
+                                                    categories=self.methods)
+        for name in self.FLOATS:
+            frame[name] = self.column(name)
+        signif = self.column('mult_comp_signif')
+        frame['mult_comp_signif'] = pd.array(np.where(signif < 0, None, signif),
+                                             dtype='Int8')
+        frame['warnings'] = pd.Categorical.from_codes(self.column('warnings'),
+                                                      categories=self.messages)
+        return pd.DataFrame(frame)
+
+    def write(self, path):
+        """
+        Write the table to a Parquet (.parquet, .pq) or Feather (.feather)
+        file in one operation
+        """
+        path = str(path)
+        if path.lower().endswith(('.parquet', '.pq')):
+            self.to_frame().to_parquet(path, index=False)
+        elif path.lower().endswith('.feather'):
+            self.to_frame().to_feather(path)
+        else:
+            raise ValueError('Result files must be .parquet, .pq or .feather')
@@ -10,18 +10,95 @@ Created on Fri Jul 13 11:57:28 2018
 import warnings
 import math
 
-__all__ = ['sample_stats']
+import cebspy.stats._arrays as arr
+
+__all__ = ['RunningStats', 'sample_stats']
 
 #####################################
 #       INFERENTIAL STATISTICS      #
 #####################################
 
+class RunningStats(object):
+    """
+    Mergeable streaming accumulator of size, mean and M2
+
+    Values are fed one at a time (Welford update) or as NumPy chunks, and
+    partial accumulators from other chunks or processes are combined with
+    merge() (Chan et al. pairwise update), so the mean and variance are
+    exact without keeping the data and without the cancellation of the
+    sum of squares formula.
+
+    Examples
+    --------
+    >>> from cebspy.stats.samplestats import RunningStats
+    >>> first = RunningStats()
+    >>> first.update([362.8, 337.9, 341.4, 338.8, 285.1])
+    >>> second = RunningStats()
+    >>> second.update([336.8, 343.0, 340.0, 339.4, 324.2])
+    >>> first.merge(second).summary()
+    {'mean': 334.93999999999994, 'variance': 394.98488888888863, 'std_error': 6.284782326293319, 'size': 10}
+    """
+    def __init__(self, size=0, mean=0.0, m2=0.0):
+        self.size = size
+        self.mean = mean
+        self.m2 = m2
+
+    def push(self, value):
+        """
+        Add one value (Welford update)
+        """
+        self.size += 1
+        delta = value - self.mean
+        self.mean += delta / self.size
+        self.m2 += delta * (value - self.mean)
+
+    def update(self, values):
+        """
+        Add a chunk of values, e.g. a NumPy array read from disk
+        """
+        values = arr.as_float_array(values).ravel()
+        if len(values) > 0:
+            mean = values.mean()
+            dev = values - mean
+            self.merge(RunningStats(len(values), float(mean), float(dev.dot(dev))))
+
+    def merge(self, other):
+        """
+        Combine the statistics of another accumulator into this one
+
+        Returns this accumulator.
+        """
+        if other.size > 0:
+            size = self.size + other.size
+            delta = other.mean - self.mean
+            self.mean += delta * other.size / size
+            self.m2 += other.m2 + delta * delta * self.size * other.size / size
+            self.size = size
+        return self
+
+    @property
+    def variance(self):
+        return self.m2 / (self.size - 1) if self.size > 1 else float('nan')
+
+    @property
+    def std_error(self):
+        return math.sqrt(self.variance / self.size) if self.size > 1 else float('nan')
+
+    def summary(self):
+        """
+        Sample statistics as returned by sample_stats
+        """
+        return {'mean': self.mean, 'variance': self.variance,
+                'std_error': self.std_error, 'size': self.size}
+
+
 def sample_stats(x):
     """
     Compute sample statistics
     
-    From a list of values to compute mean, variance with the implementation of
-    a naive algorithm
+    From a list of values to compute mean, variance and standard error with
+    the RunningStats accumulator (the mean can differ from sum(x) / len(x)
+    in the last digits)
     
     Parameters
     ----------
@@ -56,17 +133,10 @@ def sample_stats(x):
     {'warning': 'At least two values are required for a sample'}
     >>>
     """
-    (n, sum, sum_sq) = (0, 0, 0)
-    if (len(x) > 1):
-        for xi in x:
-            n += 1
-            sum += xi
-            sum_sq += xi * xi
-    if n > 1:
-        variance = (sum_sq - (sum * sum) / n) / (n - 1)
-        mean = sum / n
-        return {'mean': mean, 'variance': variance, 
-                'std_error':math.sqrt(variance/n), 'size': n}
+    if len(x) > 1:
+        stats = RunningStats()
+        stats.update(x)
+        return stats.summary()
     else:
         warnings.warn("At least two values are required for a sample")
     
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+# service.py
+"""
+Local asyncio service running the CEBS tests for interactive clients
+
+A StatsService keeps a warm worker pool with the Williams and Dixon tables
+loaded, gathers the requests arriving within a short window into one batch
+and runs the batch in a single worker call, then fans the results back out
+to the callers. Endpoints with the same doses share one StudyDesign; only
+their Dunn's tests are vectorized, as one dunn_test_matrix call, the other
+tests of a batch run one request at a time in that worker call. NaN and
+infinite values of the results are sent as null. The service is used
+directly from asyncio code or over HTTP on localhost or a Unix socket:
+
+    python -m cebspy.stats.service --port 8765
+
+    POST /dunn   {"doses": [...], "responses": [...]}
+    POST /williams   {"doses": [...], "responses": [...], "params": {"jonck_trend": -2.1}}
+    POST /batch  [{"test": "dunn", "doses": [...], "responses": [...]}, ...]
+    GET  /health
+"""
+import argparse
+import asyncio
+import json
+import warnings
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+import cebspy.stats._arrays as arr
+import cebspy.stats.design as sd
+import cebspy.stats.dunntest as dt
+import cebspy.stats.reader as rd
+import cebspy.stats.williamscrit as wcrit
+from cebspy.stats.jonckheere import jonckheere_test
+from cebspy.stats.pipeline import analyze_endpoint
+from cebspy.stats.Williams import Williams
+
+__all__ = ['TESTS', 'StatsService', 'serve']
+
+## tests served, called as test(design, responses, **params)
+TESTS = dict(rd.TESTS, williams=Williams, jonckheere=jonckheere_test,
+             pipeline=analyze_endpoint)
+
+_REASONS = {200:'OK', 400:'Bad Request', 404:'Not Found'}
+
+
+def _warm():
+    """
+    Load the critical-value tables once in a worker process
+    """
+    wcrit.get_williams_criticals()
+    try:
+        import qdixon   # noqa: F401
+    except ImportError:
+        pass
+
+
+def _dunn_columns(design, responses):
+    """
+    dunn_test results of endpoints sharing a design from one
+    dunn_test_matrix call, None when the matrix form does not apply
+    """
+    results = dt.dunn_test_matrix(design, np.column_stack(responses))
+    if not results['has_output']:
+        return None
+    output = results['output']
+    return [{'method':results['method'],
+             'has_output':bool(1),
+             'has_errors':bool(0),
+             'is_finished':bool(1),
+             'output':{'dose':output['dose'].tolist(),
+                       'count':output['count'].tolist(),
+                       'dose_rank':list(range(len(output['dose']))),
+                       'rank_mean':output['rank_mean'][:, j].tolist(),
+                       'dunnsign':output['dunnsign'][:, j].tolist(),
+                       'mult_comp_signif':output['mult_comp_signif'][:, j].tolist()}}
+            for j in range(len(responses))]
+
+
+def _run_requests(requests):
+    """
+    Run a batch of (test, doses, responses, params) requests
+
+    The Dunn's tests of complete endpoints sharing a design are run as one
+    dunn_test_matrix call, the other requests one at a time.
+
+    Returns a list of (ok, results or error message)
+    """
+    designs = {}
+    out = [None] * len(requests)
+    grouped = {}
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        for i, (name, doses, responses, params) in enumerate(requests):
+            try:
+                doses = arr.as_float_array(doses)
+                design = designs.get(doses.tobytes())
+                if design is None:
+                    design = designs[doses.tobytes()] = sd.StudyDesign(doses)
+                responses = arr.as_float_array(responses)
+                if (name == 'dunn' and not params and len(responses) == len(doses)
+                        and not np.isnan(responses).any()):
+                    grouped.setdefault(doses.tobytes(), []).append((i, responses))
+                else:
+                    out[i] = (True, TESTS[name](design, responses, **params))
+            except Exception as e:
+                out[i] = (False, '%s: %s' % (type(e).__name__, e))
+        for key, members in grouped.items():
+            columns = None
+            if len(members) > 1:
+                columns = _dunn_columns(designs[key], [r for i, r in members])
+            for j, (i, responses) in enumerate(members):
+                try:
+                    out[i] = (True, columns[j] if columns is not None
+                              else TESTS['dunn'](designs[key], responses))
+                except Exception as e:
+                    out[i] = (False, '%s: %s' % (type(e).__name__, e))
+    return out
+
+
+def _json_safe(value):
+    """
+    value with NumPy values as Python ones and NaN or infinite floats as
+    None, which json.dumps(allow_nan=False) accepts
+    """
+    if isinstance(value, dict):
+        return {key:_json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [_json_safe(item) for item in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    return value
+
+
+class StatsService(object):
+    """
+    Micro-batching front end of a warm worker pool
+
+    Parameters
+    ----------
+    processes : number of worker processes, None for all cores, 0 to run
+        the batches in a thread of this process
+
+    window : seconds to wait for more requests after the first one of a
+        batch
+
+    max_batch : maximum number of requests in a batch
+
+    Examples
+    --------
+    >>> from cebspy.stats.service import StatsService
+    >>> async def review(endpoints):
+    ...     async with StatsService(processes=4) as service:
+    ...         return await asyncio.gather(*[service.submit('dunn', doses, responses)
+    ...                                       for doses, responses in endpoints])
+    """
+    def __init__(self, processes=None, window=0.005, max_batch=256):
+        self.processes = processes
+        self.window = window
+        self.max_batch = max_batch
+        self.batches = 0
+        self.requests = 0
+        self._executor = None
+        self._queue = None
+        self._batcher = None
+        self._dispatches = set()
+
+    async def start(self):
+        if self.processes == 0:
+            self._executor = ThreadPoolExecutor(max_workers=1, initializer=_warm)
+        else:
+            self._executor = ProcessPoolExecutor(max_workers=self.processes,
+                                                 initializer=_warm)
+        self._queue = asyncio.Queue()
+        self._batcher = asyncio.ensure_future(self._collect())
+        return self
+
+    async def close(self):
+        if self._batcher is not None:
+            self._batcher.cancel()
+            await asyncio.gather(self._batcher, *self._dispatches,
+                                 return_exceptions=True)
+            self._batcher = None
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def submit(self, test, doses, responses, **params):
+        """
+        Results dict of test on one endpoint, run in the next batch
+
+        ValueError is raised for an unknown test or a failing request.
+        """
+        if test not in TESTS:
+            raise ValueError('Unknown test %r' % (test,))
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((test, doses, responses, params, future))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # run the batch while the next one is being gathered
+            dispatch = asyncio.ensure_future(self._dispatch(batch))
+            self._dispatches.add(dispatch)
+            dispatch.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self, batch):
+        loop = asyncio.get_running_loop()
+        self.batches += 1
+        self.requests += len(batch)
+        try:
+            outputs = await loop.run_in_executor(
+                    self._executor, _run_requests, [request[:4] for request in batch])
+        except Exception as e:
+            outputs = [(False, '%s: %s' % (type(e).__name__, e))] * len(batch)
+        for request, (ok, value) in zip(batch, outputs):
+            future = request[4]
+            if future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(ValueError(value))
+
+    async def _route(self, method, target, body):
+        name = target.split('?', 1)[0].strip('/')
+        if method == 'GET' and name == 'health':
+            return 200, {'status':'ok', 'tests':sorted(TESTS),
+                         'batches':self.batches, 'requests':self.requests}
+        if method != 'POST':
+            return 404, {'error':'Unknown route %s %s' % (method, target)}
+        payload = json.loads(body or b'{}')
+        if name == 'batch':
+            outputs = await asyncio.gather(
+                    *[self.submit(item['test'], item['doses'], item['responses'],
+                                  **item.get('params', {})) for item in payload],
+                    return_exceptions=True)
+            return 200, [{'error':str(o)} if isinstance(o, Exception) else o
+                         for o in outputs]
+        if name not in TESTS:
+            return 404, {'error':'Unknown test %r' % (name,)}
+        return 200, await self.submit(name, payload['doses'], payload['responses'],
+                                      **payload.get('params', {}))
+
+    async def handle_http(self, reader, writer):
+        """
+        Answer one HTTP/1.1 request with a JSON body, then close
+        """
+        try:
+            method, target, _ = (await reader.readline()).decode('latin-1').split(' ', 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                key, _, value = line.decode('latin-1').partition(':')
+                headers[key.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            status, payload = await self._route(method, target, body)
+        except Exception as e:
+            status, payload = 400, {'error':'%s: %s' % (type(e).__name__, e)}
+        data = json.dumps(_json_safe(payload), allow_nan=False).encode('utf-8')
+        writer.write(('HTTP/1.1 %d %s\r\nContent-Type: application/json\r\n'
+                      'Content-Length: %d\r\nConnection: close\r\n\r\n'
+                      % (status, _REASONS[status], len(data))).encode('latin-1') + data)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+
+async def serve(host='127.0.0.1', port=8765, path=None, processes=None,
+                window=0.005, max_batch=256):
+    """
+    Run a StatsService over HTTP on host:port, or on the Unix socket path,
+    until cancelled
+    """
+    async with StatsService(processes, window, max_batch) as service:
+        if path is not None:
+            server = await asyncio.start_unix_server(service.handle_http, path=path)
+        else:
+            server = await asyncio.start_server(service.handle_http, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m cebspy.stats.service',
+                                     description='Local CEBS statistics service')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', help='Unix socket path instead of host:port')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='worker processes (default: all cores, 0: a thread)')
+    parser.add_argument('--window', type=float, default=0.005,
+                        help='seconds to gather a batch (default: 0.005)')
+    parser.add_argument('--max-batch', type=int, default=256)
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.unix, args.processes,
+                          args.window, args.max_batch))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
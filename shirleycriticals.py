@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+# shirleycriticals.py
+"""
+Generated Williams-type critical values for any number of dose groups
+
+The SAS table in shirleytest covers up to six treatment groups with equal
+group sizes corrected by a linear adjustment, the Williams tables a fixed
+range of dof and dose columns. Beyond them the critical values are the
+quantiles of
+
+    T = (max_u mean(Z_u..Z_k) - Z_0) / (sqrt(1 + 1/w) * S)
+
+with Z_1..Z_k ~ N(0, 1), Z_0 ~ N(0, 1/w), w the control to treatment size
+ratio and S^2 ~ chi2(dof) / dof (S = 1 for the asymptotic values of
+Shirley's rank statistic). The treatment groups are simulated one group at
+a time, so every k up to the largest comes from one pass, and the control
+is integrated out exactly (P(T > t | Z_1..Z_k, S) is a normal tail), which
+leaves a smooth tail probability solved for t by Newton steps.
+
+The values of GRID_K over the GRID blocks (Shirley's size ratios, the
+dof of Williams' test below its tables) are precomputed by build_grid and
+shipped read-only next to this module (shirley_criticals.csv); they
+are read on the first lookup and interpolated linearly in 1/ratio and
+1/dof, so the usual designs never simulate. Values off the grid are
+simulated once per process and kept in memory; setting
+CEBSPY_SHIRLEY_TABLE to a CSV path also saves them there for later
+processes. A table with another header is ignored and rewritten, and the
+table is replaced atomically so concurrent processes never leave a
+partial file.
+"""
+import csv
+import os
+import tempfile
+
+import numpy as np
+
+import cebspy.stats._distributions as dist
+import cebspy.stats.profiling as prof
+
+__all__ = ['ALPHA', 'ShirleyCriticals', 'build_grid', 'generate_criticals',
+           'get_criticals', 'table_path']
+
+## one-sided levels of the SAS C05 and C01 values (mult_comp_signif 1 and 2)
+ALPHA = (0.025, 0.005)
+
+## ratios are rounded to this many decimals in the table keys
+RATIO_DECIMALS = 2
+
+## treatment groups of the packaged grid
+GRID_K = tuple(range(1, 21))
+
+## control to treatment size ratios of Shirley's test in the packaged grid
+GRID_RATIOS = (0.25, 0.33, 0.5, 0.6, 0.75, 0.9, 1.0, 1.1, 1.25, 1.5, 1.75, 2.0,
+               2.5, 3.0, 4.0, 5.0, 6.0, 8.0, 10.0)
+
+## small dof of Williams' test, below the first rows of its SAS tables
+GRID_DOF = tuple(range(1, 11))
+
+## blocks of the packaged grid as (dofs, ratios, alphas): Shirley's test,
+## then the asymptotic and small dof values of Williams' test
+GRID = (((np.inf,), GRID_RATIOS, ALPHA),
+        ((np.inf,) + GRID_DOF, (1.0,), (0.01, 0.05)))
+
+GRID_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'shirley_criticals.csv')
+
+_FIELDS = ['k', 'ratio', 'dof', 'alpha', 'crit']
+
+_criticals = None
+
+_grid = None
+
+
+def table_path():
+    """
+    Path of the on-disk table of generated critical values, None (values
+    kept in memory) unless CEBSPY_SHIRLEY_TABLE is set
+    """
+    return os.environ.get('CEBSPY_SHIRLEY_TABLE') or None
+
+
+def _read_table(path):
+    """
+    Values of a table written by ShirleyCriticals, empty when the file is
+    missing or has another layout
+    """
+    values = {}
+    try:
+        with open(path, newline='') as f:
+            reader = csv.reader(f)
+            if next(reader, None) != _FIELDS:
+                return values
+            for row in reader:
+                try:
+                    k, ratio, dof, alpha, crit = row
+                    values[(int(k), float(ratio), float(dof), float(alpha))] = float(crit)
+                except ValueError:
+                    continue    # a damaged row is generated again
+    except OSError:
+        pass
+    return values
+
+
+def _write_table(path, values):
+    """
+    Write the values as a table through a temporary file replacing path
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    os.makedirs(folder, exist_ok=True)
+    handle, temp = tempfile.mkstemp(dir=folder, suffix='.csv')
+    try:
+        with os.fdopen(handle, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(_FIELDS)
+            writer.writerows([list(key) + [repr(value)]
+                              for key, value in sorted(values.items())])
+        os.replace(temp, path)
+    except BaseException:
+        os.remove(temp)
+        raise
+
+
+def _load_grid():
+    """
+    The packaged grid as {(dof, alpha): {k: (sorted 1/ratio, crit)}}
+    """
+    global _grid
+    if _grid is None:
+        columns = {}
+        for (k, ratio, dof, alpha), crit in _read_table(GRID_PATH).items():
+            columns.setdefault((dof, alpha), {}).setdefault(k, []).append((1 / ratio, crit))
+        _grid = {}
+        for key, ks in columns.items():
+            _grid[key] = {}
+            for k, points in ks.items():
+                inverse, crit = np.array(sorted(points)).T
+                _grid[key][k] = (inverse, crit)
+    return _grid
+
+
+def _grid_value(k, ratio, dof, alpha):
+    """
+    Critical value interpolated from the packaged grid, linear in 1/ratio
+    and 1/dof, None outside the grid
+    """
+    grid = _load_grid()
+    if ratio <= 0 or dof < 1:
+        return None
+    if np.isfinite(dof) and dof != np.floor(dof):
+        lo = _grid_value(k, ratio, np.floor(dof), alpha)
+        hi = _grid_value(k, ratio, np.ceil(dof), alpha)
+        if lo is None or hi is None:
+            return None
+        factor = (1 / np.floor(dof) - 1 / dof) / (1 / np.floor(dof) - 1 / np.ceil(dof))
+        return lo + factor * (hi - lo)
+    column = grid.get((dof, alpha), {}).get(k)
+    if column is None:
+        return None
+    inverse, crit = column
+    u = 1 / ratio
+    if not inverse[0] - 1e-9 <= u <= inverse[-1] + 1e-9:
+        return None
+    return float(np.interp(u, inverse, crit))
+
+
+def _solve(top_means, scale, root, level):
+    """
+    t with P(T > t) = level, averaged over the simulated treatment maxima
+    """
+    t = float(dist.norm_ppf(1 - level))
+    for _ in range(100):
+        x = (t * scale - top_means) * root
+        step = ((dist.norm_sf(x).mean() - level) /
+                (np.exp(-x ** 2 / 2) * scale * root).mean() * np.sqrt(2 * np.pi))
+        t += step
+        if abs(step) < 1e-8:
+            break
+    return t
+
+
+def generate_criticals(k, ratio=1.0, alpha=ALPHA, dof=np.inf, draws=400000,
+                       seed=20180724):
+    """
+    Critical values of Williams-type statistics by simulation
+
+    Parameters
+    ----------
+    k : number of treatment groups in the step (the rank of the top dose),
+        an int or a sequence of ints
+
+    ratio : control to treatment group size ratio w = n_control / n_trt
+
+    alpha : one-sided significance levels
+
+    dof : degrees of freedom of the variance estimate, inf for a known
+        variance as in Shirley's test
+
+    draws : number of simulated treatment groups
+
+    seed : seed of the random generator, fixed so the values are
+        reproducible
+
+    Returns
+    -------
+    float array of the critical values in the order of alpha, with a row
+    per k when k is a sequence
+
+    Examples
+    --------
+    >>> generate_criticals(2).round(2)
+    array([2.01, 2.61])
+    """
+    ks = np.atleast_1d(k).astype(int)
+    levels = np.atleast_1d(alpha).astype(float)
+    rng = np.random.default_rng(seed)
+    ratio = float(ratio)
+    scale = np.sqrt(1 + 1 / ratio)
+    if np.isfinite(dof):
+        scale = scale * np.sqrt(rng.chisquare(dof, draws) / dof)
+    root = np.sqrt(ratio)
+    total = np.zeros(draws)
+    top_means = np.full(draws, -np.inf)
+    found = {}
+    # by exchangeability the maximum of the means pooled from the top dose
+    # down is the running maximum of the means of the first j groups
+    for j in range(1, ks.max() + 1):
+        total += rng.standard_normal(draws)
+        np.maximum(top_means, total / j, out=top_means)
+        if j in ks:
+            found[j] = [_solve(top_means, scale, root, level) for level in levels]
+    criticals = np.array([found[j] for j in ks])
+    return criticals[0] if np.ndim(k) == 0 else criticals
+
+
+def build_grid(path=GRID_PATH, draws=400000):
+    """
+    Simulate the GRID blocks over GRID_K and write them as the packaged
+    table (a few minutes, only needed when the grid changes)
+    """
+    values = {}
+    for dofs, ratios, alphas in GRID:
+        for dof in dofs:
+            for ratio in ratios:
+                generated = generate_criticals(GRID_K, ratio, alphas, dof, draws)
+                for k, row in zip(GRID_K, generated):
+                    for alpha, value in zip(alphas, row):
+                        values[(k, float(ratio), float(dof), float(alpha))] = float(value)
+    _write_table(path, values)
+
+
+class ShirleyCriticals(object):
+    """
+    Critical values from the packaged grid, memoized simulations beyond it
+
+    Parameters
+    ----------
+    path : path of a CSV table the simulated values are saved to and read
+        from, None to keep them in memory only
+
+    Attributes
+    ----------
+    values : simulated values (and the values of the table) by
+        (k, ratio, dof, alpha)
+
+    grid : values interpolated from the packaged grid so far
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.values = {} if path is None else _read_table(path)
+        self.grid = {}
+
+    def _value(self, key):
+        value = self.grid.get(key)
+        if value is None:
+            value = _grid_value(*key)
+            if value is None:
+                return self.values.get(key)
+            self.grid[key] = value
+        return value
+
+    def criticals(self, k, ratio=1.0, alpha=ALPHA, dof=np.inf, test='shirley'):
+        """
+        Critical values as generate_criticals, from the packaged grid or
+        simulated (and stored) for the (k, ratio, dof, alpha) off the grid;
+        test names the calling test in the profiling events
+        """
+        ks = np.atleast_1d(k).astype(int)
+        levels = [float(level) for level in np.atleast_1d(alpha)]
+        ratio = round(float(ratio), RATIO_DECIMALS)
+        dof = float(dof)
+        found = {(int(j), level):self._value((int(j), ratio, dof, level))
+                 for j in ks for level in levels}
+        missing = sorted(set(j for (j, level), value in found.items() if value is None))
+        prof.path(test, 'generated_criticals', 'generated' if missing else 'grid')
+        if missing:
+            generated = generate_criticals(missing, ratio, levels, dof)
+            for j, values in zip(missing, generated):
+                for level, value in zip(levels, values):
+                    self.values[(j, ratio, dof, level)] = float(value)
+                    found[(j, level)] = float(value)
+            self._store()
+        criticals = np.array([[found[(int(j), level)] for level in levels] for j in ks])
+        return criticals[0] if np.ndim(k) == 0 else criticals
+
+    def lookup(self, k, ratio=1.0):
+        """
+        (crit01, crit05) of Shirley's test at the column k of the SAS table
+        (the number of treatment groups + 1) and the control to treatment
+        size ratio
+        """
+        crit05, crit01 = self.criticals(k, ratio)
+        return crit01, crit05
+
+    def _store(self):
+        """
+        Merge the values into the table on disk through a temporary file
+        """
+        if self.path is None:
+            return
+        try:
+            values = _read_table(self.path)   # rows added by other processes
+            values.update(self.values)
+            self.values = values
+            _write_table(self.path, values)
+        except OSError:
+            pass    # read-only folder, the values stay in memory
+
+
+def get_criticals():
+    """
+    Return the process-wide ShirleyCriticals, saving simulated values to
+    the table of CEBSPY_SHIRLEY_TABLE when it is set
+    """
+    global _criticals
+    if _criticals is None:
+        _criticals = ShirleyCriticals(table_path())
+    return _criticals
@@ -37,7 +37,7 @@ class TestCEBSStats(unittest.TestCase):
                   339.4, 324.2]
         results = stats.samplestats.sample_stats(sample)
         self.assertEqual(results.get('size'), len(sample))
-        self.assertEqual(results.get('mean'), sum(sample) / len(sample))
+        self.assertAlmostEqual(results.get('mean'), sum(sample) / len(sample))
     
     def test_ttest(self):
         sample1 = [362.8, 337.9, 341.4, 338.8, 285.1, 336.8, 343.0, 340.0]
@@ -56,6 +56,553 @@ class TestCEBSStats(unittest.TestCase):
         self.assertFalse(results['has_errors'])
         self.assertIn('is_finished', results)
         self.assertEqual(list(results.keys()), ['method', 'has_output', 'has_errors', 'is_finished', 'output'])
+
+    def test_williams_batch(self):
+        import pandas as pd
+        doses = [0, 0, 0, 0, 10, 10, 10, 10, 30, 30, 30, 30, 100, 100, 100, 100]
+        responses = [10.2, 9.8, 10.5, 10.1, 9.9, 9.4, 9.7, 9.6,
+                     9.8, 9.9, 9.3, 9.5, 8.1, 8.4, 8.0, 8.6]
+        data = pd.DataFrame({'sex': ['M'] * 16 + ['F'] * 16,
+                             'dose': doses * 2,
+                             'response': responses * 2,
+                             'trend': -1})
+        results = stats.Williams.williams_batch(data, ['sex'], 'dose',
+                                                'response', 'trend')
+        self.assertEqual(len(results), 6)
+        males = results[results['sex'] == 'M'].reset_index(drop=True)
+        females = results[results['sex'] == 'F'].reset_index(drop=True)
+        self.assertEqual(males['willStat'].tolist(), females['willStat'].tolist())
+        # smoothed means are non-increasing for a decreasing trend
+        self.assertTrue((males['smean'].diff().dropna() <= 0).all())
+        self.assertEqual(males['count'].tolist(), [4, 4, 4])
+        # endpoints without a trend are skipped, not smoothed as decreasing
+        data.loc[data['sex'] == 'F', 'trend'] = float('nan')
+        with self.assertWarns(UserWarning):
+            results = stats.Williams.williams_batch(data, ['sex'], 'dose',
+                                                    'response', 'trend')
+        self.assertEqual(results['sex'].tolist(), ['M'] * 3)
+        empty = stats.Williams.williams_batch(data.iloc[:0], ['sex'], 'dose',
+                                              'response', 'trend')
+        self.assertEqual(len(empty), 0)
+        self.assertIn('willStat', empty.columns)
+
+    def test_williams_criticals(self):
+        from unittest import mock
+        import numpy as np
+        criticals = stats.williamscrit.get_williams_criticals()
+        self.assertIs(criticals, stats.williamscrit.get_williams_criticals())
+        low, high = criticals.dof[0], criticals.dof[1]
+        crit01, crit05 = criticals.lookup([low, high, (low + high) / 2], 2, 1)
+        self.assertTrue(min(crit01[0], crit01[1]) <= crit01[2] <= max(crit01[0], crit01[1]))
+        self.assertTrue(min(crit05[0], crit05[1]) <= crit05[2] <= max(crit05[0], crit05[1]))
+        # beyond the tables: large dof decrease to the asymptote, small dof
+        # and extra dose columns come from the packaged grid, never simulated
+        top = criticals.dof[-1]
+        with mock.patch.object(stats.shirleycriticals, 'generate_criticals',
+                               side_effect=AssertionError):
+            crit01, crit05 = criticals.lookup([top, 2 * top, float('inf'), 3, 3.5, 4], 2, 1)
+            self.assertFalse(np.isnan(crit01).any() or np.isnan(crit05).any())
+            self.assertTrue(crit05[0] >= crit05[1] >= crit05[2])
+            self.assertTrue(crit05[3] > crit05[4] > crit05[5] > crit05[0])
+            crit01, crit05 = criticals.lookup(30, criticals.max_k + 3, 1)
+            self.assertTrue(crit05 < crit01 < 5)
+            results = stats.Williams.Williams([0, 0, 10, 10, 20, 20],
+                                              [1.0, 1.2, 1.5, 1.7, 2.4, 2.6])
+            self.assertTrue(results['has_output'])
+
+    def test_pava(self):
+        fitted = stats.isotonic.pava([9.6, 9.8, 8.2], [4, 4, 4], increasing=False)
+        self.assertEqual([round(v, 10) for v in fitted], [9.7, 9.7, 8.2])
+        fitted = stats.isotonic.pava([[1.0, 3.0, 2.0], [3.0, 1.0, 2.0]],
+                                     [[1, 1, 1], [1, 1, 0]], increasing=[True, False])
+        self.assertEqual(fitted[0].tolist(), [1.0, 2.5, 2.5])
+        self.assertEqual(fitted[1][:2].tolist(), [3.0, 1.0])
+
+    def test_dose_group_stats(self):
+        doses = [0, 0, 0, 10, 10, 10, 10]
+        responses = [1.0, 2.0, 3.0, 4.0, 6.0, 8.0, 10.0]
+        groups = stats.groupstats.DoseGroupStats.from_arrays(doses, responses)
+        self.assertEqual(groups.count.tolist(), [3, 4])
+        self.assertEqual(groups.mean.tolist(), [2.0, 7.0])
+        self.assertEqual(groups.dof, 5)
+        self.assertAlmostEqual(groups.pooled_variance(), (2.0 + 20.0) / 5)
+        self.assertEqual(groups.summary(0), stats.samplestats.sample_stats(responses[:3]))
+        # one animal per group leaves no degrees of freedom
+        single = stats.groupstats.DoseGroupStats.from_arrays([0, 10, 20], [1.0, 2.0, 3.0])
+        self.assertNotEqual(single.pooled_variance(), single.pooled_variance())
+        self.assertTrue(stats.Williams.Williams([0, 10, 20], [1.0, 2.0, 3.0])['has_output'])
+
+    def test_shirley(self):
+        doses = [0, 0, 0, 0, 0, 10, 10, 10, 10, 10, 30, 30, 30, 30, 30]
+        responses = [1.0, 1.2, 0.9, 1.1, 1.0, 1.3, 1.5, 1.4, 1.2, 1.6,
+                     2.0, 2.2, 1.9, 2.4, 2.1]
+        results = stats.shirleytest.shirley_test(doses, responses, 0.8)
+        self.assertTrue(results['has_output'])
+        self.assertEqual(results['output']['dose'], [30, 10])
+        self.assertEqual(results['output']['mult_comp_signif'][0], 2)
+
+    def test_dunn_matrix(self):
+        doses = [0, 0, 0, 0, 10, 10, 10, 10, 30, 30, 30, 30]
+        responses = [5.1, 4.9, 5.0, 5.2, 4.1, 4.3, 4.0, 4.2, 3.1, 3.0, 3.3, 3.2]
+        single = stats.dunntest.dunn_test(doses, responses)
+        matrix = stats.dunntest.dunn_test_matrix(doses, [[r, -r] for r in responses])
+        output = matrix['output']
+        self.assertEqual(output['rank_mean'][:, 0].tolist(), single['output']['rank_mean'])
+        self.assertEqual(output['dunnsign'][:, 0].tolist(), [0, -1, -1])
+        self.assertEqual(output['dunnsign'][:, 1].tolist(), [0, 0, 0])
+        self.assertEqual(output['mult_comp_signif'][:, 0].tolist(),
+                         single['output']['mult_comp_signif'])
+
+    def test_ttest_matrix(self):
+        sample1 = [362.8, 337.9, 341.4, 338.8, 285.1, 336.8, 343.0, 340.0]
+        sample2 = [422.2, 454.3, 429.8, 376.8, 408.7, 488.9, 405.9, 444.2, 369.1, 441.7]
+        for var_equal in (True, False):
+            single = stats.ttest.t_test(sample1, sample2, var_equal=var_equal)['output']
+            matrix = stats.ttest.t_test_matrix([sample1 + [float('nan')] * 2, sample2],
+                                               [sample2, sample1 + [float('nan')] * 2],
+                                               var_equal=var_equal)['output']
+            self.assertAlmostEqual(matrix['t'][0], single['t'])
+            self.assertAlmostEqual(matrix['t'][1], -single['t'])
+            self.assertAlmostEqual(matrix['df'][0], single['df'])
+            self.assertAlmostEqual(matrix['p_value'][0], single['p_value'])
+            # 1-D samples are a single comparison
+            vector = stats.ttest.t_test_matrix(sample1, sample2, axis=0,
+                                               var_equal=var_equal)['output']
+            self.assertAlmostEqual(vector['t'][0], single['t'])
+
+    def test_running_stats(self):
+        sample = [362.8, 337.9, 341.4, 338.8, 285.1, 336.8, 343.0, 340.0,
+                  339.4, 324.2]
+        whole = stats.samplestats.sample_stats(sample)
+        first = stats.samplestats.RunningStats()
+        first.update(sample[:3])
+        second = stats.samplestats.RunningStats()
+        for value in sample[3:]:
+            second.push(value)
+        merged = first.merge(second)
+        self.assertEqual(merged.size, whole['size'])
+        self.assertAlmostEqual(merged.mean, whole['mean'])
+        self.assertAlmostEqual(merged.variance, whole['variance'])
+        # large magnitude values keep their precision
+        shifted = stats.samplestats.sample_stats([v + 1e9 for v in sample])
+        self.assertAlmostEqual(shifted['variance'], whole['variance'], places=4)
+
+    def test_jonckheere(self):
+        doses = [0, 0, 0, 10, 10, 10, 30, 30, 30]
+        responses = [1.1, 1.3, 0.9, 1.4, 1.2, 1.6, 1.9, 1.5, 1.3]
+        # brute force count of ordered pairs, ties counting 1/2
+        pairs = sum((a < b) + 0.5 * (a == b)
+                    for i, a in enumerate(responses) for j, b in enumerate(responses)
+                    if doses[i] < doses[j])
+        results = stats.jonckheere.jonckheere_test(doses, responses)
+        self.assertTrue(results['has_output'])
+        self.assertEqual(results['output']['statistic'], pairs)
+        self.assertEqual(results['output']['direction'], 'increasing')
+        reverse = stats.jonckheere.jonckheere_test(doses, [-r for r in responses])
+        self.assertAlmostEqual(reverse['output']['z'], -results['output']['z'])
+        self.assertEqual(reverse['output']['direction'], 'decreasing')
+        # two values have no tie terms in the variance
+        import warnings
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            output = stats.jonckheere.jonckheere_test([0, 10], [1.0, 2.0])['output']
+        self.assertEqual(output['variance'], 0.25)
+        self.assertEqual(output['direction'], 'increasing')
+
+    def test_pipeline(self):
+        import pandas as pd
+        doses = [0, 0, 0, 0, 10, 10, 10, 10, 30, 30, 30, 30]
+        trend = [5.1, 4.9, 5.0, 5.2, 4.1, 4.3, 4.0, 4.2, 3.1, 3.0, 3.3, 3.2]
+        flat = [5.1, 4.9, 5.0, 5.2, 5.0, 5.3, 4.8, 5.1, 5.2, 4.9, 5.0, 5.1]
+        study = pd.DataFrame({'endpoint': ['trend'] * 12 + ['flat'] * 12,
+                              'dose': doses * 2,
+                              'response': trend + flat})
+        results = stats.pipeline.run_study(study, ['endpoint'], 'dose', 'response',
+                                           max_workers=1)
+        tests = results[results['method'] != 'Jonckheere-Terpstra test']
+        methods = tests.groupby('endpoint', observed=True)['method'].first()
+        self.assertEqual(methods['trend'], "Shirley's test")
+        self.assertEqual(methods['flat'], "Dunn's test")
+        trend = tests[tests['endpoint'] == 'trend']
+        self.assertEqual(sorted(trend['dose'].tolist()), [10, 30])
+        self.assertTrue(trend['statistic'].notna().all())
+        jonckheere = results[(results['method'] == 'Jonckheere-Terpstra test') &
+                             (results['endpoint'] == 'trend')]
+        expected = stats.jonckheere.jonckheere_test(doses, study['response'][:12])['output']['z']
+        self.assertAlmostEqual(jonckheere['statistic'].iloc[0], expected)
+        # an endpoint raising an error is recorded, the others still run
+        from unittest import mock
+        analyze = stats.pipeline.analyze_endpoint
+
+        def failing(design, responses, **options):
+            if responses[0] == 5.1 and responses[5] == 5.3:
+                raise ZeroDivisionError('float division by zero')
+            return analyze(design, responses, **options)
+        with mock.patch.object(stats.pipeline, 'analyze_endpoint', failing):
+            results = stats.pipeline.run_study(study, ['endpoint'], 'dose', 'response',
+                                               max_workers=1)
+        failed = results[results['endpoint'] == 'flat']
+        self.assertEqual(failed['method'].tolist(), ['analyze_endpoint'])
+        self.assertEqual(failed['warnings'].tolist(),
+                         ['ZeroDivisionError: float division by zero'])
+        self.assertEqual(len(results[results['endpoint'] == 'trend']), 3)
+
+    def test_result_table(self):
+        import os
+        import tempfile
+        doses = [0, 0, 0, 0, 10, 10, 10, 10, 30, 30, 30, 30]
+        responses = [5.1, 4.9, 5.0, 5.2, 4.1, 4.3, 4.0, 4.2, 3.1, 3.0, 3.3, 3.2]
+        table = stats.results.ResultTable(['sex', 'endpoint'], capacity=2)
+        table.append_results(('M', 'BW'), stats.Williams.Williams(doses, responses))
+        other = stats.results.ResultTable(['sex', 'endpoint'])
+        other.append_results(('F', 'BW'), stats.dunntest.dunn_test(doses, responses))
+        table.extend(other)
+        frame = table.to_frame()
+        self.assertEqual(len(frame), len(table))
+        self.assertEqual(frame['sex'].unique().tolist(), ['M', 'F'])
+        self.assertEqual(frame['method'].unique().tolist(),
+                         ['Williams test', "Dunn's test"])
+        self.assertTrue(frame['crit05'].iloc[:2].notna().all())
+        try:
+            import pyarrow
+        except ImportError:
+            return
+        path = os.path.join(tempfile.mkdtemp(), 'results.parquet')
+        table.write(path)
+        import pandas as pd
+        self.assertEqual(len(pd.read_parquet(path)), len(frame))
+        self.assertRaises(ValueError, table.write, path + '.csv')
+
+    def test_study_design(self):
+        doses = [0, 0, 0, 0, 10, 10, 10, 10, 30, 30, 30, 30]
+        responses = [5.1, 4.9, 5.0, 5.2, 4.1, 4.3, 4.0, 4.2, 3.1, 3.0, 3.3, 3.2]
+        design = stats.design.StudyDesign(doses)
+        self.assertEqual(design.levels.tolist(), [0, 10, 30])
+        self.assertEqual(design.counts.tolist(), [4, 4, 4])
+        self.assertEqual(design.control, 0)
+        self.assertEqual(stats.dunntest.dunn_test(design, responses),
+                         stats.dunntest.dunn_test(doses, responses))
+        self.assertEqual(stats.shirleytest.shirley_test(design, responses, -1),
+                         stats.shirleytest.shirley_test(doses, responses, -1))
+        self.assertEqual(stats.Williams.Williams(design, responses, -1),
+                         stats.Williams.Williams(doses, responses, -1))
+
+    def test_array_inputs(self):
+        import numpy as np
+        import pandas as pd
+        values = np.array([362.8, 337.9, 341.4, 338.8, 285.1, 336.8, 343.0, 340.0])
+        self.assertIs(stats._arrays.as_float_array(values), values)
+        column = pd.DataFrame({'response': values})['response']
+        self.assertTrue(np.shares_memory(stats._arrays.as_float_array(column),
+                                         column.to_numpy()))
+        doses = np.array([0, 0, 0, 0, 10, 10, 10, 10], dtype=float)
+        with_nan = np.append(values, np.nan)
+        self.assertEqual(stats.dunntest.dunn_test(np.append(doses, 10), with_nan),
+                         stats.dunntest.dunn_test(doses, values))
+        self.assertEqual(stats.ttest.t_test(with_nan)['output']['sample_stats']['size'], 8)
+
+    def test_reader(self):
+        import os
+        import tempfile
+        import pandas as pd
+        doses = [0, 0, 0, 0, 10, 10, 10, 10, 30, 30, 30, 30]
+        responses = [5.1, 4.9, 5.0, 5.2, 4.1, 4.3, 4.0, 4.2, 3.1, 3.0, 3.3, 3.2]
+        study = pd.DataFrame({'endpoint': ['a'] * 12 + ['b'] * 12,
+                              'dose': doses * 2,
+                              'response': responses * 2})
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'study.csv')
+            study.to_csv(path, index=False)
+            endpoints = list(stats.reader.iter_endpoints(path, ['endpoint'], 'dose',
+                                                         'response', chunksize=5))
+            self.assertEqual([key for key, d, r in endpoints], [('a',), ('b',)])
+            self.assertEqual(endpoints[1][2].tolist(), responses)
+            results = dict(stats.reader.stream_tests(path, ['endpoint'], 'dose',
+                                                     'response', tests=('dunn',)))
+        self.assertEqual(results[('a',)]['dunn'], stats.dunntest.dunn_test(doses, responses))
+
+    def test_benchmarks(self):
+        doses, responses = stats.benchmarks.make_endpoint(40, 4, 'high')
+        self.assertEqual(len(set(doses)), 4)
+        self.assertLess(len(set(responses)), 10)
+        records = stats.benchmarks.run_benchmarks(sizes=[20], groups=[2, 4],
+                                                  ties=['low'], repeat=1)
+        self.assertEqual(len(records), 2 * len(stats.benchmarks.BENCHMARKS))
+        rows = stats.benchmarks.compare(records, records)
+        self.assertTrue(all(row['identical'] for row in rows))
+        # the results still match the committed reference run
+        baseline = stats.benchmarks.load_baseline(stats.benchmarks.BASELINE)
+        self.assertEqual(set(record['test'] for record in baseline),
+                         set(stats.benchmarks.BASELINE_TESTS))
+        records = stats.benchmarks.run_benchmarks(sizes=[100], groups=[4], repeat=1,
+                                                  tests=stats.benchmarks.BASELINE_TESTS)
+        rows = stats.benchmarks.compare(records, baseline)
+        self.assertEqual(len(rows), 3 * len(stats.benchmarks.BASELINE_TESTS))
+        self.assertTrue(all(row['identical'] for row in rows))
+
+    def test_profiling(self):
+        doses = [0, 0, 0, 0, 10, 10, 10, 10, 30, 30, 30, 30]
+        responses = [5.1, 4.9, 5.0, 5.2, 4.1, 4.3, 4.0, 4.2, 3.1, 3.0, 3.3, 3.2]
+        events = []
+        stats.profiling.add_hook(events.append)
+        try:
+            stats.dunntest.dunn_test(doses, responses)
+        finally:
+            stats.profiling.remove_hook(events.append)
+        self.assertIn('ranking', [event['stage'] for event in events])
+        with stats.profiling.Profile() as profile:
+            stats.Williams.Williams(doses, responses)
+            stats.shirleytest.shirley_test(doses, responses)
+            stats.dixon.dixon(responses[:4])
+        self.assertIn(('williams', 'smoothing'), profile.stages)
+        self.assertIn(('shirley', 'critical_values', 'sas_table'), profile.paths)
+        self.assertEqual(sum(count for (test, name, path), count in profile.paths.items()
+                             if name == 'dof_lookup'), 2)
+        merged = stats.profiling.Profile().merge(profile).merge(profile)
+        self.assertEqual(merged.stages[('dixon', 'sort')][0], 2)
+        self.assertFalse(stats.profiling.enabled())
+
+    def test_result_cache(self):
+        import os
+        import tempfile
+        doses = [0, 0, 0, 0, 10, 10, 10, 10, 30, 30, 30, 30]
+        responses = [5.1, 4.9, 5.0, 5.2, 4.1, 4.3, 4.0, 4.2, 3.1, 3.0, 3.3, 3.2]
+        path = os.path.join(tempfile.mkdtemp(), 'results.sqlite')
+        cache = stats.cache.ResultCache(memory_bytes=1, path=path)
+        dunn = cache.wrap(stats.dunntest.dunn_test)
+        expected = stats.dunntest.dunn_test(doses, responses)
+        self.assertEqual(dunn(doses, responses), expected)
+        self.assertEqual(dunn(doses, responses), expected)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        cache.call(stats.shirleytest.shirley_test, doses, responses, tau=-1)
+        self.assertNotEqual(cache.call(stats.shirleytest.shirley_test, doses,
+                                       responses, tau=1)['output'], None)
+        self.assertEqual(cache.misses, 3)
+        cache.close()
+        # a new process reads the results from disk
+        cache = stats.cache.ResultCache(path=path, max_bytes=1)
+        self.assertEqual(cache.call(stats.dunntest.dunn_test, doses, responses), expected)
+        self.assertEqual(cache.hits, 1)
+        changed = responses[:-1] + [3.5]
+        self.assertNotEqual(stats.cache.endpoint_key('dunn_test', doses, responses),
+                            stats.cache.endpoint_key('dunn_test', doses, changed))
+        # int and float doses are different keys, the outputs repeat them
+        self.assertNotEqual(stats.cache.endpoint_key('dunn_test', doses, responses),
+                            stats.cache.endpoint_key('dunn_test', [float(d) for d in doses],
+                                                     responses))
+        cache.close()
+        # the memory tier is bounded by the size of the pickled results
+        cache = stats.cache.ResultCache(memory_bytes=1500)
+        for i in range(5):
+            cache.put(str(i), {'output':'x' * 400})
+        self.assertEqual(len(cache), 3)
+        self.assertIsNone(cache.get('0'))
+        self.assertEqual(cache.get('4'), {'output':'x' * 400})
+        # the pipeline keys change with the versions of the tests it runs
+        from unittest import mock
+        key = stats.cache.endpoint_key('analyze_endpoint', doses, responses)
+        with mock.patch.dict(stats.cache.VERSIONS, {'Williams':99}):
+            self.assertNotEqual(stats.cache.endpoint_key('analyze_endpoint', doses, responses),
+                                key)
+
+    def test_endpoint_state(self):
+        doses = [0, 0, 0, 0, 10, 10, 10, 10, 30, 30, 30, 30]
+        responses = [5.1, 4.9, 5.0, 5.2, 4.1, 4.3, 4.0, 4.2, 3.1, 3.0, 3.3, 3.2]
+        state = stats.endpointstate.EndpointState(doses, responses)
+        self.assertEqual(state.dunn_test(), stats.dunntest.dunn_test(doses, responses))
+        state.replace(10, 4.3, 5.0)
+        state.remove(30, 3.3)
+        state.add(0, 5.0)
+        doses = doses[:-2] + [30, 0]
+        responses = [5.1, 4.9, 5.0, 5.2, 4.1, 5.0, 4.0, 4.2, 3.1, 3.0, 3.2, 5.0]
+        self.assertEqual(state.dunn_test(), stats.dunntest.dunn_test(doses, responses))
+        self.assertEqual(state.shirley_test(), stats.shirleytest.shirley_test(doses, responses))
+        self.assertEqual(state.jonckheere(),
+                         stats.jonckheere.jonckheere_test(doses, responses)['output'])
+        williams = state.williams()['output']
+        expected = stats.Williams.Williams(doses, responses)['output']
+        for a, b in zip(williams['willStats'], expected['willStats']):
+            self.assertAlmostEqual(a, b)
+        self.assertEqual(williams['mult_comp_signif'], expected['mult_comp_signif'])
+        self.assertRaises(KeyError, state.remove, 10, 4.3)
+        self.assertRaises(ValueError, state.add, 20, 4.3)
+        # a failed correction leaves the state unchanged
+        self.assertRaises(ValueError, state.replace, 10, 4.1, 4.5, new_dose=20)
+        self.assertEqual(state.dunn_test(), stats.dunntest.dunn_test(doses, responses))
+        # an emptied dose group is dropped as in the tests of the raw data
+        for value in (4.1, 5.0, 4.0, 4.2):
+            state.remove(10, value)
+        doses, responses = doses[:4] + doses[8:], responses[:4] + responses[8:]
+        self.assertEqual(state.dunn_test(), stats.dunntest.dunn_test(doses, responses))
+        self.assertEqual(state.shirley_test(), stats.shirleytest.shirley_test(doses, responses))
+        self.assertEqual(state.jonckheere(),
+                         stats.jonckheere.jonckheere_test(doses, responses)['output'])
+        self.assertEqual(state.williams()['output']['x'],
+                         stats.Williams.Williams(doses, responses)['output']['x'])
+
+    def test_distributions(self):
+        from scipy.stats import norm, t
+        for x in (-2.5, 0.0, 1.3):
+            self.assertEqual(stats._distributions.norm_sf(x), norm.sf(x))
+            self.assertEqual(stats._distributions.t_sf(x, 7.5), t.sf(x, 7.5))
+        self.assertEqual(stats._distributions.norm_ppf(0.99375), norm.ppf(0.99375))
+
+    def test_cli(self):
+        import os
+        import tempfile
+        import pandas as pd
+        try:
+            import pyarrow
+        except ImportError:
+            return
+        folder = tempfile.mkdtemp()
+        study = os.path.join(folder, 'study.csv')
+        output = os.path.join(folder, 'results.parquet')
+        doses = [0, 0, 0, 0, 10, 10, 10, 10, 30, 30, 30, 30]
+        trend = [5.1, 4.9, 5.0, 5.2, 4.1, 4.3, 4.0, 4.2, 3.1, 3.0, 3.3, 3.2]
+        flat = [5.1, 4.9, 5.0, 5.2, 5.0, 5.3, 4.8, 5.1, 5.2, 4.9, 5.0, 5.1]
+        pd.DataFrame({'endpoint': ['flat'] * 12 + ['trend'] * 12,
+                      'dose': doses * 2,
+                      'response': flat + trend}).to_csv(study, index=False)
+        status = stats.cli.main([study, output, '--keys', 'endpoint',
+                                 '--tests', 'pipeline', 'dunn', '--quiet',
+                                 '--batch-size', '1'])
+        self.assertEqual(status, 0)
+        results = pd.read_parquet(output)
+        self.assertEqual(sorted(results['endpoint'].unique()), ['flat', 'trend'])
+        self.assertIn("Shirley's test", results['method'].tolist())
+        self.assertEqual(results['method'].tolist().count("Dunn's test"), 9)
+
+    def test_service(self):
+        import asyncio
+        import json
+        doses = [0, 0, 0, 0, 10, 10, 10, 10, 30, 30, 30, 30]
+        responses = [5.1, 4.9, 5.0, 5.2, 4.1, 4.3, 4.0, 4.2, 3.1, 3.0, 3.3, 3.2]
+
+        async def run():
+            async with stats.service.StatsService(processes=0, window=0.05) as service:
+                results = await asyncio.gather(
+                        service.submit('dunn', doses, responses),
+                        service.submit('shirley', doses, responses, tau=-1),
+                        service.submit('williams', doses, responses))
+                self.assertEqual(service.batches, 1)
+                server = await asyncio.start_server(service.handle_http, '127.0.0.1', 0)
+                port = server.sockets[0].getsockname()[1]
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                body = json.dumps({'doses':doses, 'responses':responses}).encode()
+                writer.write(b'POST /dunn HTTP/1.1\r\nContent-Length: %d\r\n\r\n'
+                             % len(body) + body)
+                await writer.drain()
+                reply = await reader.read()
+                writer.close()
+                server.close()
+                await server.wait_closed()
+                return results, reply
+
+        results, reply = asyncio.run(run())
+        self.assertEqual(results[0], stats.dunntest.dunn_test(doses, responses))
+        self.assertEqual(results[1], stats.shirleytest.shirley_test(doses, responses, -1))
+        self.assertEqual(results[2], stats.Williams.Williams(doses, responses))
+        self.assertTrue(reply.startswith(b'HTTP/1.1 200'))
+        self.assertEqual(json.loads(reply.split(b'\r\n\r\n', 1)[1]), results[0])
+        # NaN results are sent as null, valid JSON for the clients
+        import numpy as np
+        safe = stats.service._json_safe({'willStats':[float('nan'), np.float64(1.5)],
+                                         'dose':np.array([10, 30])})
+        self.assertEqual(json.dumps(safe, allow_nan=False),
+                         '{"willStats": [null, 1.5], "dose": [10, 30]}')
+
+    def test_permutation(self):
+        doses = [0, 0, 0, 10, 10, 10, 30, 30]
+        responses = [1, 2, 2, 3, 5, 4, 6, 7]
+        dunn = stats.dunntest.dunn_test(doses, responses, permutations=1000)['output']
+        self.assertTrue(dunn['exact'])
+        self.assertEqual(dunn['permutations'], 560)
+        self.assertAlmostEqual(dunn['p_value'][2], 3 / 560.)
+        self.assertEqual(dunn['mult_comp_signif'], [0, 0, 2])
+        doses = [d for d in range(8) for _ in range(5)]
+        responses = [0.5 * d + (i % 5) * 0.7 for i, d in enumerate(doses)]
+        first = stats.shirleytest.shirley_test(doses, responses, permutations=2000, seed=1)
+        second = stats.shirleytest.shirley_test(doses, responses, permutations=2000, seed=1)
+        self.assertEqual(first, second)
+        output = first['output']
+        self.assertFalse(output['exact'])
+        self.assertEqual(output['dose'][0], 7)
+        self.assertLess(output['p_value'][0], 0.01)
+        self.assertEqual(output['mult_comp_signif'][0], 2)
+
+    def test_shirley_criticals(self):
+        import os
+        import tempfile
+        from unittest import mock
+        import numpy as np
+        scrit = stats.shirleycriticals
+        crit05, crit01 = scrit.generate_criticals(2, draws=40000)
+        self.assertAlmostEqual(crit05, 2.015, places=1)
+        self.assertAlmostEqual(crit01, 2.607, places=1)
+        with mock.patch.dict(os.environ, {'CEBSPY_SHIRLEY_TABLE':''}):
+            self.assertIsNone(scrit.table_path())
+        # the packaged grid answers the designs beyond the SAS table
+        with mock.patch.object(scrit, 'generate_criticals', side_effect=AssertionError):
+            criticals = scrit.ShirleyCriticals()
+            # continuous at the end of the SAS table (column 7, crit05 2.0485)
+            crit01, crit05 = criticals.lookup(7)
+            self.assertAlmostEqual(crit05, 2.0485, places=2)
+            self.assertAlmostEqual(crit01, 2.622, places=2)
+            self.assertGreater(criticals.lookup(8)[1], crit05)
+            low, middle, high = [criticals.lookup(8, ratio)[1] for ratio in (1.5, 1.6, 1.75)]
+            self.assertTrue(min(low, high) < middle < max(low, high))
+            with stats.profiling.Profile() as profile:
+                criticals.criticals(3, test='williams')
+            self.assertEqual(profile.paths, {('williams', 'generated_criticals', 'grid'):1})
+            doses = [d for d in range(9) for _ in range(4)]
+            responses = [d + (i % 4) * 0.5 for i, d in enumerate(doses)]
+            output = stats.shirleytest.shirley_test(doses, responses)['output']
+            self.assertEqual(output['dose'][0], 8)
+            self.assertEqual(output['mult_comp_signif'][0], 2)
+        # values off the grid are simulated once and kept in the table
+        def generate(k, ratio, alpha, dof):
+            return np.full((len(k), len(alpha)), 3.0)
+        with tempfile.TemporaryDirectory() as folder, \
+                mock.patch.object(scrit, 'generate_criticals', side_effect=generate) as simulated:
+            path = os.path.join(folder, 'shirley.csv')
+            criticals = scrit.ShirleyCriticals(path)
+            values = criticals.lookup(30, 1.5)
+            self.assertEqual(criticals.lookup(30, 1.5), values)
+            self.assertEqual(simulated.call_count, 1)
+            self.assertEqual(scrit.ShirleyCriticals(path).values, criticals.values)
+            self.assertEqual(scrit.ShirleyCriticals(path).lookup(30, 1.5), values)
+            self.assertEqual(simulated.call_count, 1)
+            # tables of another layout or with damaged rows are regenerated
+            with open(path, 'w') as f:
+                f.write('k,ratio,crit05,crit01\n30,1.5,2.0,2.6\n')
+            self.assertEqual(scrit.ShirleyCriticals(path).values, {})
+            self.assertEqual(scrit.ShirleyCriticals(path).lookup(30, 1.5), values)
+            with open(path, 'a') as f:
+                f.write('k,ratio,dof,alpha,crit\n')
+            self.assertEqual(scrit.ShirleyCriticals(path).lookup(30, 1.5), values)
+            scrit.ShirleyCriticals().lookup(30, 1.5)
+            self.assertEqual(os.listdir(folder), ['shirley.csv'])
+
+    def test_dunn_all_pairs(self):
+        import numpy as np
+        doses = [0, 0, 0, 10, 10, 10, 30, 30, 30]
+        responses = [5.1, 4.9, 5.0, 4.1, 4.3, 4.0, 3.1, 3.0, 3.3]
+        output = stats.dunntest.dunn_all_pairs(doses, responses, adjust='bonferroni')['output']
+        self.assertEqual(output['dose1'], [0, 0, 10])
+        self.assertEqual(output['dose2'], [10, 30, 30])
+        self.assertEqual(output['rank_mean'], [8.0, 5.0, 2.0])
+        self.assertAlmostEqual(output['z'][1], -6 / 5 ** .5)
+        self.assertAlmostEqual(output['p_adjusted'][0], 3 * output['p_value'][0])
+        self.assertEqual(output['mult_comp_signif'], [0, 1, 0])
+        self.assertEqual(output['dunnsign'], [-1, -1, -1])
+        adjusted = stats.dunntest._adjust_p_values(np.array([.01, .04, .03]), 'holm')
+        self.assertEqual(adjusted.round(10).tolist(), [.03, .06, .06])
+        sidak = stats.dunntest._adjust_p_values(np.array([.01]), 'sidak')
+        self.assertAlmostEqual(sidak[0], .01)
+        self.assertRaises(ValueError, stats.dunntest.dunn_all_pairs, doses, responses,
+                          adjust='hochberg')
+
      
 if __name__ == '__main__':
     unittest.main()
@@ -10,13 +10,15 @@ Created on Mon Jul 2 15:38:31 2018
 import warnings
 import math
 import numpy as np
-from scipy.stats import distributions
 
+import cebspy.stats._arrays as arr
+import cebspy.stats._distributions as dist
 from cebspy.stats.commons import valid_floats as vfloats
+from cebspy.stats.groupstats import DoseGroupStats
 from cebspy.stats.samplestats import sample_stats
 
 
-__all__ = ['one_sample_t_test','t_test']
+__all__ = ['one_sample_t_test','t_test','t_test_matrix']
 
 #####################################
 #       INFERENTIAL STATISTICS      #
@@ -81,7 +83,7 @@ def one_sample_t_test(x, popmean=0):
         std_error = x_stats.get('std_error')
         if std_error > 0:
             t = (mean - popmean) / std_error
-            prob = distributions.t.sf(np.abs(t), df) * 2
+            prob = dist.t_sf(np.abs(t), df) * 2
             results.update({'t':t,
                             'df':df,
                             'p_value':prob,
@@ -127,13 +129,15 @@ def two_samples_t_test(x, y, var_equal):
     """
     Compute t-test statistics for two samples
     """
-    x_stats = sample_stats(x)
-    y_stats = sample_stats(y)
+    groups = DoseGroupStats.from_samples(x, y)
+    x_stats = groups.summary(0)
+    y_stats = groups.summary(1)
     name = 'Two Sample t-test'
     if var_equal:
-        (df, std_error) = equal_var_t_test_estimates(
-                x_stats.get('variance'), x_stats.get('size'),
-                y_stats.get('variance'), y_stats.get('size'))
+        # pooled variance straight from the per-group sums of squares
+        df = groups.dof
+        std_error = math.sqrt(groups.pooled_variance() *
+                              (1 / x_stats.get('size') + 1 / y_stats.get('size')))
     else:
         (df, std_error) = unequal_var_t_test_estimates(
                 x_stats.get('variance'), x_stats.get('size'),
@@ -141,13 +145,25 @@ def two_samples_t_test(x, y, var_equal):
         name = 'Welch Two Sample t-test'
         
     t = (x_stats.get('mean') - y_stats.get('mean')) / std_error
-    prob = distributions.t.sf(np.abs(t), df) * 2
+    prob = dist.t_sf(np.abs(t), df) * 2
     return {'name':name,
             'sample1_stats':x_stats, 'sample2_stats':y_stats,
             't':t, 'df':df, 'p_value':prob, 
             'std_error':std_error, 'var_equal':var_equal}
 
 
+def _valid_sample(x):
+    """
+    Non-missing values as a float64 array
+
+    Arrays, Series and Arrow columns are masked without copying, only Python
+    lists go through valid_floats to drop non-numeric entries.
+    """
+    if isinstance(x, (list, tuple)):
+        x = vfloats(x)[0]
+    return arr.valid_values(x)
+
+
 def t_test(x, y = None, alternative = 'two.sided', popmean = 0, paired = False,
            var_equal = False, conf_level = 0.95, nan_policy = 'omit'):
     """
@@ -263,7 +279,7 @@ def t_test(x, y = None, alternative = 'two.sided', popmean = 0, paired = False,
     }
     >>>
     """
-    s1, cn1, ce1 = vfloats(x)
+    s1 = _valid_sample(x)
     results = {'method':'T-test', 'has_output':bool(0), 'has_errors':bool(0)}
     test = None
     
@@ -272,7 +288,7 @@ def t_test(x, y = None, alternative = 'two.sided', popmean = 0, paired = False,
             # One sample t-test
             test = one_sample_t_test(s1, popmean)
         else:
-            s2, cn2, ce2 = vfloats(y)
+            s2 = _valid_sample(y)
             if (len(s2) > 1):
                 test = two_samples_t_test(s1, s2, var_equal)
             else:
@@ -291,4 +307,105 @@ def t_test(x, y = None, alternative = 'two.sided', popmean = 0, paired = False,
     return results
 
 
+def _matrix_stats(x, axis):
+    """
+    Size, mean and variance along axis ignoring NaN values
+    """
+    valid = ~np.isnan(x)
+    n = valid.sum(axis=axis)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(valid, x, 0).sum(axis=axis) / n
+        dev = np.where(valid, x - np.expand_dims(mean, axis), 0)
+        variance = (dev * dev).sum(axis=axis) / (n - 1)
+    return n, mean, variance
+
+
+def t_test_matrix(X, Y, axis=1, var_equal=False, alternative='two.sided'):
+    """
+    Two samples t-test for every row of two data matrices
+
+    Computes Student (var_equal=True) or Welch t statistics, degrees of
+    freedom and p values for many comparisons at once, e.g. one per probe
+    of an expression dataset, with NumPy reductions and a single call of
+    the t distribution.
+
+    Parameters
+    ----------
+    X : a 2-D array of numeric values as the first samples, or a 1-D
+        array as the sample of a single comparison
 
+    Y : a 2-D array of numeric values as the second samples, with the same
+        number of comparisons as X, or a 1-D array
+
+    axis : the axis holding the sample values, 1 (default) when each row is
+        one comparison, 0 when each column is one comparison
+
+    var_equal : a logical variable indicating whether to use the pooled
+        variance (True) or the Welch approximation (False, default)
+
+    alternative : one of "two.sided" (default), "greater" or "less"; you
+        can specify just the initial letter
+
+    NaN values are omitted per comparison.
+
+    Returns
+    -------
+    The results dict of t_test where 'output' holds one array per column:
+    't', 'df', 'p_value', 'std_error', 'mean1', 'mean2', 'size1', 'size2'.
+    Comparisons with less than two values in a sample get NaN.
+
+    Examples
+    --------
+    >>> from cebspy.stats.ttest import t_test_matrix
+    >>> results = t_test_matrix(treated, controls, var_equal=True)
+    >>> results['output']['p_value'][:5]
+    """
+    X = np.asarray(X, dtype=float)
+    Y = np.asarray(Y, dtype=float)
+    ## a 1-D sample is a single comparison
+    if X.ndim == 1:
+        X = X[:, None] if axis == 0 else X[None, :]
+    if Y.ndim == 1:
+        Y = Y[:, None] if axis == 0 else Y[None, :]
+    results = {'method':'T-test', 'has_output':bool(0), 'has_errors':bool(0)}
+    alternatives = {'t':'two.sided', 'g':'greater', 'l':'less'}
+    alternative = alternatives.get(str(alternative)[:1])
+    if alternative is None:
+        message = 'alternative must be one of "two.sided", "greater" or "less"'
+        warnings.warn(message)
+        results.update({'has_errors':bool(1), 'warnings':[message]})
+        return results
+    n1, mean1, variance1 = _matrix_stats(X, axis)
+    n2, mean2, variance2 = _matrix_stats(Y, axis)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if var_equal:
+            name = 'Two Sample t-test'
+            df = (n1 + n2 - 2).astype(float)
+            sp = ((n1 - 1) * variance1 + (n2 - 1) * variance2) / df
+            std_error = np.sqrt(sp * (1 / n1 + 1 / n2))
+        else:
+            name = 'Welch Two Sample t-test'
+            pooled_variance = variance1 / n1 + variance2 / n2
+            denom = (variance1 / n1) ** 2 / (n1 - 1) + (variance2 / n2) ** 2 / (n2 - 1)
+            df = pooled_variance ** 2 / denom
+            std_error = np.sqrt(pooled_variance)
+        t = (mean1 - mean2) / std_error
+    too_small = (n1 < 2) | (n2 < 2)
+    t[too_small] = np.nan
+    df[too_small] = np.nan
+    if alternative == 'two.sided':
+        prob = dist.t_sf(np.abs(t), df) * 2
+    elif alternative == 'greater':
+        prob = dist.t_sf(t, df)
+    else:
+        prob = dist.t_sf(-t, df)
+    results.update({'is_finished':bool(1),
+                    'has_output':bool(1),
+                    'output':{'name':name,
+                              't':t, 'df':df, 'p_value':prob,
+                              'std_error':std_error,
+                              'mean1':mean1, 'mean2':mean2,
+                              'size1':n1, 'size2':n2,
+                              'var_equal':var_equal,
+                              'alternative':alternative}})
+    return results
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+# williamscrit.py
+"""
+Process-wide index of the Williams critical-value tables
+
+The SAS 1% and 5% tables from williams_criticals are read and merged on
+first use, once per process, and kept as contiguous arrays keyed by (dof,
+dose index), so lookups for whole arrays of treatment groups are answered with a
+searchsorted instead of DataFrame filters.
+
+Every integer dof of the table range is precomputed on a dense grid, so the
+usual lookups are a single indexing. Outside the tables the values are
+extended instead of left missing: dof beyond the last row follow the large
+dof asymptotics (linear in 1/dof through the last two rows), dof below the
+first row and dose columns beyond the last one come from the precomputed
+grid of shirleycriticals (simulated in memory only off that grid).
+"""
+import re
+import numpy as np
+
+import cebspy.stats.profiling as prof
+
+__all__ = ['WilliamsCriticals', 'get_williams_criticals']
+
+_COLUMN = re.compile(r'^w([15])(crit|adj)(\d+)$')
+
+## one-sided levels of the w1 and w5 tables
+ALPHA = {'1':0.01, '5':0.05}
+
+_criticals = None
+
+
+class WilliamsCriticals(object):
+    """
+    Williams critical values as arrays indexed by (dof row, dose index)
+
+    Parameters
+    ----------
+    willtables : a DataFrame with a 'dof' column and w1critN, w1adjN, w5critN,
+        w5adjN columns as the merged SAS tables
+
+    Attributes
+    ----------
+    dof : sorted float array of the tabulated degrees of freedom
+
+    w1crit, w1adj, w5crit, w5adj : float arrays of shape (len(dof), max_k + 1)
+        where column N holds the table column with suffix N (the values of
+        N - 1 treatment groups); columns missing from the tables are NaN.
+        Columns beyond max_k are appended by lookup when a design needs them
+    """
+    def __init__(self, willtables):
+        willtables = willtables.sort_values('dof')
+        self.dof = np.ascontiguousarray(willtables['dof'].to_numpy(dtype=float))
+        found = [_COLUMN.match(str(c)) for c in willtables.columns]
+        found = [m for m in found if m is not None]
+        self.max_k = max(int(m.group(3)) for m in found)
+        arrays = {}
+        for level in '15':
+            for kind in ('crit', 'adj'):
+                arrays[(level, kind)] = np.full((len(self.dof), self.max_k + 1), np.nan)
+        for m in found:
+            arrays[(m.group(1), m.group(2))][:, int(m.group(3))] = \
+                willtables[m.group(0)].to_numpy(dtype=float)
+        self.w1crit = arrays[('1', 'crit')]
+        self.w1adj = arrays[('1', 'adj')]
+        self.w5crit = arrays[('5', 'crit')]
+        self.w5adj = arrays[('5', 'adj')]
+        self._build_grid()
+
+    def _build_grid(self):
+        """
+        Critical values and scaled adjustments of every integer dof of the
+        table range, as the exact and interpolated lookups compute them
+        """
+        n = len(self.dof)
+        grid = np.arange(np.ceil(self.dof[0]), np.floor(self.dof[-1]) + 1)
+        high = np.searchsorted(self.dof, grid, side='left')
+        self.grid_start = grid[0]
+        self.grid_exact = self.dof[np.minimum(high, n - 1)] == grid
+        lo = np.where(self.grid_exact, high, high - 1)
+        hi = high
+        dofactor = np.where(self.grid_exact, 0,
+                            (grid - self.dof[lo]) / np.maximum(self.dof[hi] - self.dof[lo], 1e-12))
+        ## the adjustment is scaled by .1 on exact matches and by .01 when
+        ## interpolating, as in the R script
+        scale = np.where(self.grid_exact, .1, .01)[:, None]
+        self.grid_crit = {}
+        self.grid_adj = {}
+        for level, crit, adj in (('1', self.w1crit, self.w1adj), ('5', self.w5crit, self.w5adj)):
+            self.grid_crit[level] = crit[lo] - (dofactor[:, None] * (crit[lo] - crit[hi]))
+            self.grid_adj[level] = scale * adj[lo]
+
+    def _extend(self, k):
+        """
+        Append the dose columns up to k, the asymptotic values of the new
+        columns scaled by the dof profile of the last table column
+        """
+        import cebspy.stats.shirleycriticals as scrit
+        width = self.w1crit.shape[1]
+        columns = np.arange(width, k + 1)
+        last = width - 1
+        for level in '15':
+            crit = getattr(self, 'w%scrit' % level)
+            adj = getattr(self, 'w%sadj' % level)
+            asymptotic = scrit.get_criticals().criticals(np.r_[last, columns] - 1,
+                                                         alpha=ALPHA[level],
+                                                         test='williams')[:, 0]
+            new = crit[:, last:] * (asymptotic[1:] / asymptotic[0])
+            setattr(self, 'w%scrit' % level, np.hstack([crit, new]))
+            setattr(self, 'w%sadj' % level,
+                    np.hstack([adj, np.repeat(adj[:, last:], len(columns), axis=1)]))
+        self._build_grid()
+
+    def _generated(self, dof, k, ratio):
+        """
+        Critical values of dof below the tables from the packaged grid of
+        shirleycriticals, adjusted as the interpolated values of the first
+        table row
+        """
+        import cebspy.stats.shirleycriticals as scrit
+        crit01 = np.empty(dof.shape)
+        crit05 = np.empty(dof.shape)
+        for value in np.unique(dof):
+            at = dof == value
+            columns = np.unique(k[at])
+            criticals = scrit.get_criticals().criticals(columns - 1, alpha=(.01, .05),
+                                                        dof=value, test='williams')
+            index = np.searchsorted(columns, k[at])
+            crit01[at] = criticals[index, 0] - (.01 * self.w1adj[0, k[at]] * ratio[at])
+            crit05[at] = criticals[index, 1] - (.01 * self.w5adj[0, k[at]] * ratio[at])
+        return crit01, crit05
+
+    def lookup(self, dof, k, ratio):
+        """
+        Critical values for arrays of treatment groups
+
+        Parameters
+        ----------
+        dof : array of degrees of freedom
+
+        k : array of table column indexes (dose position + 1 as in the
+            SAS tables)
+
+        ratio : array of treatment to control group sizes (n_trt / n_ctrl)
+
+        Returns
+        -------
+        (crit01, crit05) : float arrays, NaN only where dof is not positive
+            or k indexes a column missing from the tables
+        """
+        dof = np.asarray(dof, dtype=float)
+        k = np.asarray(k, dtype=int)
+        ratio = 1 - np.asarray(ratio, dtype=float)
+        dof, k, ratio = np.broadcast_arrays(dof, k, ratio)
+        crit01 = np.full(dof.shape, np.nan)
+        crit05 = np.full(dof.shape, np.nan)
+        if k.size and k.max() >= self.w1crit.shape[1]:
+            self._extend(int(k.max()))
+
+        n = len(self.dof)
+        in_k = k >= 0
+        in_range = in_k & (dof >= self.dof[0]) & (dof <= self.dof[-1])
+        ## integer dof of the table range, precomputed on the dense grid
+        grid = in_range & (dof == np.floor(dof))
+        row, col = (dof[grid] - self.grid_start).astype(int), k[grid]
+        crit01[grid] = self.grid_crit['1'][row, col] - (self.grid_adj['1'][row, col] * ratio[grid])
+        crit05[grid] = self.grid_crit['5'][row, col] - (self.grid_adj['5'][row, col] * ratio[grid])
+
+        ## DOF NOT PRESENT IN TABLE, interpolate between lower and upper bound
+        inner = in_range & ~grid
+        hi, col = np.searchsorted(self.dof, dof[inner], side='left'), k[inner]
+        lo = hi - 1
+        dofactor = (dof[inner] - self.dof[lo]) / (self.dof[hi] - self.dof[lo])
+        crit01[inner] = ((self.w1crit[lo, col] - (dofactor * (self.w1crit[lo, col] - self.w1crit[hi, col])))
+                         - (.01 * self.w1adj[lo, col] * ratio[inner]))
+        crit05[inner] = ((self.w5crit[lo, col] - (dofactor * (self.w5crit[lo, col] - self.w5crit[hi, col])))
+                         - (.01 * self.w5adj[lo, col] * ratio[inner]))
+
+        ## DOF BEYOND THE TABLE, linear in 1/dof through the last two rows
+        ## up to the asymptote at infinite dof
+        above = in_k & (dof > self.dof[-1])
+        col = k[above]
+        dofactor = (1 / self.dof[-1] - 1 / dof[above]) / (1 / self.dof[-2] - 1 / self.dof[-1])
+        crit01[above] = ((self.w1crit[n - 1, col] - (dofactor * (self.w1crit[n - 2, col] - self.w1crit[n - 1, col])))
+                         - (.01 * self.w1adj[n - 1, col] * ratio[above]))
+        crit05[above] = ((self.w5crit[n - 1, col] - (dofactor * (self.w5crit[n - 2, col] - self.w5crit[n - 1, col])))
+                         - (.01 * self.w5adj[n - 1, col] * ratio[above]))
+
+        ## DOF BELOW THE TABLE, simulated
+        below = in_k & (dof > 0) & (dof < self.dof[0])
+        if below.any():
+            crit01[below], crit05[below] = self._generated(dof[below], k[below], ratio[below])
+        if prof.enabled():
+            n_exact = np.count_nonzero(self.grid_exact[row])
+            n_inner = np.count_nonzero(grid) - n_exact + np.count_nonzero(inner)
+            n_above, n_below = np.count_nonzero(above), np.count_nonzero(below)
+            prof.path('williams', 'dof_lookup', 'exact', n_exact)
+            prof.path('williams', 'dof_lookup', 'interpolated', n_inner)
+            prof.path('williams', 'dof_lookup', 'asymptotic', n_above)
+            prof.path('williams', 'dof_lookup', 'generated', n_below)
+            prof.path('williams', 'dof_lookup', 'out_of_table',
+                      dof.size - n_exact - n_inner - n_above - n_below)
+        return crit01, crit05
+
+
+def get_williams_criticals():
+    """
+    Return the process-wide WilliamsCriticals, loading the tables on first use
+
+    williams_criticals (and the pandas it needs) is only imported here, so
+    importing the test modules stays cheap for short-lived workers.
+    """
+    global _criticals
+    prof.path('williams', 'critical_tables', 'cached' if _criticals is not None else 'loaded')
+    if _criticals is None:
+        import williams_criticals as will
+        will005 = will.get_will005_csv()
+        will025 = will.get_will025_csv()
+        _criticals = WilliamsCriticals(will005.merge(will025, on='dof'))
+    return _criticals